@@ -0,0 +1,8 @@
+# Benchmarks for Litama's hot paths. Run them from the repository root, e.g. python -m benchmarks.run
+# The server modules use top level imports (they are run from inside litama/), so make them importable here.
+import os
+import sys
+
+LITAMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "litama")
+if LITAMA_DIR not in sys.path:
+    sys.path.insert(0, LITAMA_DIR)
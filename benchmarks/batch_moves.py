@@ -0,0 +1,105 @@
+# Throughput of batch_moves.py against the scalar path in game.py: every successor of every position and the winner
+# of each successor, starting from the board strings stored in matches.
+# Usage: python -m benchmarks.batch_moves [--positions 20000] [--seed 0]
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+import batch_moves
+import bitboard
+import engine
+from benchmarks.positions import DEALS, START_BOARD
+from conversions import get_cards_from_names, str_to_board
+from game import apply_move, check_win_condition, generate_moves_for_piece
+from structures import Player, Pos
+
+# (board string, hand names, turn)
+Position = Tuple[str, Tuple[str, str], Player]
+
+
+def random_positions(count: int, seed: int) -> List[Position]:
+    # Positions from random playouts of the fixed deals, skipping finished games.
+    rng = random.Random(seed)
+    positions: List[Position] = []
+    while len(positions) < count:
+        deal = rng.choice(DEALS)
+        bb = bitboard.from_str(START_BOARD)
+        hands: engine.Hands = ((deal[0], deal[1]), (deal[2], deal[3]), deal[4])
+        turn = Player.BLUE
+        key = engine.zobrist_hash(bb, hands, turn)
+        for _ in range(rng.randrange(40)):
+            moves = engine.legal_moves(bb, hands, turn)
+            if not moves or bitboard.winner(bb) != Player.NONE:
+                break
+            positions.append((bitboard.to_str(bb), hands[0] if turn == Player.BLUE else hands[1], turn))
+            bb, hands, key = engine.play(bb, hands, turn, key, rng.choice(moves))
+            turn = engine.enemy_of(turn)
+    return positions[:count]
+
+
+def scalar(positions: List[Position]) -> Tuple[int, int]:
+    # Returns the number of successors and how many of them are won.
+    successors = won = 0
+    for board_str, names, turn in positions:
+        board = str_to_board(board_str)
+        cards = get_cards_from_names(list(names))
+        for y in range(5):
+            for x in range(5):
+                if board[y][x].color != turn:
+                    continue
+                piece_pos = Pos(x, y)
+                for move_pos, card in generate_moves_for_piece(piece_pos, cards, board):
+                    new_board = apply_move(piece_pos, move_pos, card, cards, board)
+                    successors += 1
+                    if new_board is not None and check_win_condition(new_board) != Player.NONE:
+                        won += 1
+    return successors, won
+
+
+def vectorized(positions: List[Position]) -> Tuple[int, int]:
+    boards = batch_moves.boards_from_strs([board for board, _, _ in positions])
+    hands = batch_moves.hands_from_names([names for _, names, _ in positions])
+    turns = np.array([0 if turn == Player.BLUE else 1 for _, _, turn in positions], dtype=np.uint8)
+    masks = batch_moves.legal_move_masks(boards, turns, hands)
+    _, successors = batch_moves.successors(boards, masks)
+    won = int((batch_moves.check_win_conditions(successors) != batch_moves.NO_WINNER).sum())
+    return len(successors), won
+
+
+def run(count: int, seed: int) -> Dict[str, Any]:
+    positions = random_positions(count, seed)
+    results: Dict[str, Any] = {"positions": len(positions)}
+    counts = {}
+    for name, func in (("scalar", scalar), ("vectorized", vectorized)):
+        start = time.perf_counter()
+        counts[name] = func(positions)
+        seconds = time.perf_counter() - start
+        results[name] = {
+            "seconds": round(seconds, 4),
+            "positionsPerSecond": round(len(positions) / seconds),
+            "successors": counts[name][0],
+            "wins": counts[name][1],
+        }
+    results["speedup"] = round(results["scalar"]["seconds"] / results["vectorized"]["seconds"], 1)
+    # Both paths have to agree for the timings to mean anything.
+    results["ok"] = counts["scalar"] == counts["vectorized"]
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = run(args.positions, args.seed)
+    print(json.dumps({"benchmark": "batch_moves", "results": results}, indent=2))
+    if not results["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
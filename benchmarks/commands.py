@@ -0,0 +1,124 @@
+# End to end cost of the commands against the in-memory stand-in for the matches collection, both directly
+# and through the match cache the server uses. Also checks that through the cache a move makes at most one call to
+# the collection, even when the match has to be loaded first, and exits with an error if one makes more.
+# Usage: python -m benchmarks.commands [--games 20] [--seed 0]
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import bitboard
+import engine
+from bson import ObjectId
+from commands.create import Create
+from commands.join import Join
+from commands.message import Message
+from commands.move import Move
+from commands.state import State
+from conversions import pos_to_notation, stored_bitboard
+from match_cache import MatchCache
+from memory_collection import MemoryCollection
+from storage import STATE_FIELDS
+from structures import GameState, Player
+
+MAX_PLIES = 200
+
+
+def next_move(match: Dict[str, Any]) -> str:
+    # First legal move from the engine's generator, in the format the Move command takes.
+    cards = match["cards"]
+    hands: engine.Hands = ((cards["blue"][0], cards["blue"][1]), (cards["red"][0], cards["red"][1]), cards["side"])
+    from_sq, to_sq, card_name = engine.legal_moves(stored_bitboard(match["board"]), hands,
+                                                   Player(match["currentTurn"]))[0]
+    from_notation = pos_to_notation(bitboard.square_to_pos(from_sq))
+    to_notation = pos_to_notation(bitboard.square_to_pos(to_sq))
+    return f"{card_name} {from_notation}{to_notation}"
+
+
+def play_games(matches: Any, collection: MemoryCollection, games: int,
+               before_move: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    timings: Dict[str, List[float]] = {"create": [], "join": [], "move": [], "state": []}
+    move_calls: List[int] = []
+
+    def timed(name: str, func: Callable[[], List[Message]]) -> List[Message]:
+        start = time.perf_counter()
+        messages = func()
+        timings[name].append(time.perf_counter() - start)
+        return messages
+
+    for _ in range(games):
+        match_id = timed("create", lambda: Create.apply_command(matches, "player1"))[0].match_id
+        timed("join", lambda: Join.apply_command(matches, f"{match_id} player2"))
+        for _ in range(MAX_PLIES):
+            match = matches.find_one({"_id": ObjectId(match_id)})
+            if match["gameState"] != GameState.IN_PROGRESS.value:
+                break
+            token = match["token" + match["currentTurn"].title()]
+            query = f"{match_id} {token} {next_move(match)}"
+            if before_move is not None:
+                before_move()
+            calls = collection.calls
+            timed("move", lambda: Move.apply_command(matches, query))
+            move_calls.append(collection.calls - calls)
+            timed("state", lambda: State.apply_command(matches, match_id))
+
+    results: Dict[str, Any] = {
+        f"{name}Microseconds": round(sum(values) / len(values) * 1e6, 2)
+        for name, values in timings.items()
+    }
+    results["moves"] = len(move_calls)
+    results["mongoCallsPerMove"] = round(sum(move_calls) / len(move_calls), 3)
+    results["maxMongoCallsPerMove"] = max(move_calls)
+    return results
+
+
+def run(games: int, seed: int) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+
+    random.seed(seed)
+    collection = MemoryCollection()
+    results["collection"] = play_games(collection, collection, games)
+
+    random.seed(seed)
+    collection = MemoryCollection()
+    cache = MatchCache(collection)
+    results["matchCache"] = play_games(cache, collection, games)
+    start = time.perf_counter()
+    cache.flush()
+    results["matchCache"]["flushMicroseconds"] = round((time.perf_counter() - start) * 1e6, 2)
+    results["matchCache"]["ok"] = results["matchCache"]["maxMongoCallsPerMove"] <= 1
+
+    # Every match is written back and dropped from the cache before each move, so every move has to load it. Only the
+    # fields the servers' cache reads on a miss are loaded.
+    random.seed(seed)
+    collection = MemoryCollection()
+    cache = MatchCache(collection, max_size=0, load_fields=STATE_FIELDS)
+
+    def evict_all() -> None:
+        cache.flush()
+        cache.evict()
+
+    results["coldMatchCache"] = play_games(cache, collection, games, evict_all)
+    results["coldMatchCache"]["ok"] = results["coldMatchCache"]["maxMongoCallsPerMove"] <= 1
+    return results
+
+
+def ok(results: Dict[str, Dict[str, Any]]) -> bool:
+    return all(result.get("ok", True) for result in results.values())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = run(args.games, args.seed)
+    print(json.dumps({"benchmark": "commands", "results": results}, indent=2))
+    if not ok(results):
+        sys.exit("a move made more than one call to the collection")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Reports the engine's nodes per second and the depth it reaches under a fixed time limit.
+# Usage: python -m benchmarks.engine_bench [--time 1.0] [--positions 5] [--seed 0]
+import argparse
+import json
+import random
+
+import bitboard
+import engine
+from benchmarks.positions import START_BOARD
+from cards import ALL_BASE_CARDS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per search")
+    parser.add_argument("--positions", type=int, default=5, help="number of card deals to search")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    for _ in range(args.positions):
+        deal = [card.name for card in rng.sample(ALL_BASE_CARDS, 5)]
+        hands: engine.Hands = ((deal[0], deal[1]), (deal[2], deal[3]), deal[4])
+        turn = next(card.color for card in ALL_BASE_CARDS if card.name == deal[4])
+        # Every search starts cold so that the numbers don't depend on the previous deal.
+        engine._transposition_table.clear()
+        result = engine.search(bitboard.from_str(START_BOARD), hands, turn, args.time)
+        results.append({
+            "cards": deal,
+            "turn": turn.value,
+            "depth": result.depth,
+            "nodes": result.nodes,
+            "seconds": round(result.elapsed, 4),
+            "nodesPerSecond": round(result.nodes / result.elapsed) if result.elapsed else 0,
+            "score": result.score,
+        })
+
+    total_nodes = sum(r["nodes"] for r in results)
+    total_seconds = sum(r["seconds"] for r in results)
+    print(json.dumps({
+        "benchmark": "engine",
+        "timeLimit": args.time,
+        "results": results,
+        "nodesPerSecond": round(total_nodes / total_seconds) if total_seconds else 0,
+        "averageDepth": sum(r["depth"] for r in results) / len(results),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
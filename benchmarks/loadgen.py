@@ -0,0 +1,301 @@
+# Load generator for the WebSocket backends. Starts each backend against the in-memory store and runs one or both
+# scenarios against it, reporting the results as JSON:
+# - poll: many connections that each create a match, then all poll state concurrently. Reports server memory per
+#   connection (from /proc, so Linux only) and request latency percentiles.
+# - games: matches played out like real ones. Two players create and join each match, spectators watch it, and
+#   the players alternate random legal moves. Reports throughput, latency percentiles per command and how long
+#   the state broadcast after each move takes to reach every client in the match.
+# Usage: python -m benchmarks.loadgen [--backend gevent asyncio] [--scenario poll games] [--connections 200]
+#                                     [--requests 50] [--games 50] [--spectators 4] [--moves 40]
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import websockets
+
+import engine
+from benchmarks import LITAMA_DIR
+from bitboard import from_str, square_to_pos, winner
+from conversions import pos_to_notation
+from structures import Player
+
+BACKENDS = {
+    "gevent": "server.py",
+    "asyncio": "async_server.py",
+}
+SCENARIOS = ("poll", "games")
+# Seconds to wait for a reply or for the last broadcast of a match before giving up on it.
+TIMEOUT = 10.0
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_ms(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99": round(percentile(latencies, 0.99) * 1000, 3),
+        "max": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+def start_server(backend: str, port: int) -> "subprocess.Popen[bytes]":
+    # Without the per-connection rate limit, the scenarios send as fast as the server answers.
+    env = dict(os.environ, LITAMA_MEMORY_STORE="1", PORT=str(port), LITAMA_RATE_LIMIT="0")
+    return subprocess.Popen([sys.executable, BACKENDS[backend]], cwd=LITAMA_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server on port {port} didn't start")
+
+
+async def run_poll(url: str, connections: int, requests: int, pid: Optional[int]) -> Dict[str, Any]:
+    sockets: List[Any] = []
+    match_ids: List[str] = []
+    rss_before = rss_bytes(pid) if pid else 0
+
+    async def connect() -> None:
+        ws = await websockets.connect(url, max_queue=None)
+        await ws.send("create loadgen")
+        match_ids.append(json.loads(await ws.recv())["matchId"])
+        sockets.append(ws)
+
+    # Connect in batches so that the listen backlog doesn't overflow.
+    for start in range(0, connections, 100):
+        await asyncio.gather(*(connect() for _ in range(min(100, connections - start))))
+    rss_after = rss_bytes(pid) if pid else 0
+
+    latencies: List[float] = []
+
+    async def poll(ws: Any, match_id: str) -> None:
+        for _ in range(requests):
+            start = time.perf_counter()
+            await ws.send(f"state {match_id}")
+            await ws.recv()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(poll(ws, match_id) for ws, match_id in zip(sockets, match_ids)))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(ws.close() for ws in sockets))
+
+    return {
+        "connections": connections,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "requestsPerSecond": round(len(latencies) / elapsed, 1),
+        "latencyMs": latency_ms(latencies),
+        "serverRssBytes": rss_after,
+        "bytesPerConnection": round((rss_after - rss_before) / connections) if pid else None,
+    }
+
+
+class Client:
+    # One connection in the games scenario. A reader task takes the state broadcasts, recording how long after the
+    # move they follow, and queues every other message as the reply to the last command.
+    def __init__(self, ws: Any, moves_sent: Dict[Tuple[str, int], float], lags: List[float]) -> None:
+        self.ws = ws
+        self.moves_sent = moves_sent
+        self.lags = lags
+        self.replies: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        # The newest state received and the number of moves in it.
+        self.state: Optional[Dict[str, Any]] = None
+        self.ply = 0
+        self.state_received = asyncio.Event()
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self) -> None:
+        try:
+            async for raw in self.ws:
+                message = json.loads(raw)
+                if message["messageType"] != "state":
+                    self.replies.put_nowait(message)
+                    continue
+                ply = len(message.get("moves", ()))
+                sent = self.moves_sent.get((message["matchId"], ply))
+                if sent is not None and ply > self.ply:
+                    self.lags.append(time.perf_counter() - sent)
+                if ply >= self.ply:
+                    self.state = message
+                    self.ply = ply
+                self.state_received.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    async def command(self, query: str, latencies: Dict[str, List[float]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        await self.ws.send(query)
+        reply = await asyncio.wait_for(self.replies.get(), TIMEOUT)
+        latencies.setdefault(query.split(" ", 1)[0], []).append(time.perf_counter() - start)
+        return reply
+
+    async def wait_for_ply(self, ply: int) -> bool:
+        # Whether a state with at least ply moves arrived in time.
+        deadline = time.monotonic() + TIMEOUT
+        while self.state is None or self.ply < ply:
+            self.state_received.clear()
+            try:
+                await asyncio.wait_for(self.state_received.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def close(self) -> None:
+        await self.ws.close()
+        await self.reader
+
+
+async def play_match(url: str, spectators: int, max_moves: int, rng: random.Random,
+                     moves_sent: Dict[Tuple[str, int], float], lags: List[float],
+                     latencies: Dict[str, List[float]]) -> Tuple[int, int]:
+    # Returns the number of moves played and of clients that never got the state after the last one.
+    async def connect() -> Client:
+        return Client(await websockets.connect(url, max_queue=None), moves_sent, lags)
+
+    creator = await connect()
+    created = await creator.command("create loadgen", latencies)
+    match_id = created["matchId"]
+    joiner = await connect()
+    joined = await joiner.command(f"join {match_id} loadgen", latencies)
+    clients = [creator, joiner] + [await connect() for _ in range(spectators)]
+    for client in clients:
+        await client.command(f"spectate {match_id}", latencies)
+    tokens = {0: created["token"], 1: joined["token"]}
+
+    # Every client gets the state when it spectates, the one after the last spectate has everything.
+    if not await creator.wait_for_ply(0):
+        raise RuntimeError(f"no state received for {match_id}")
+    state = creator.state
+    assert state is not None
+    players = {color: (clients[index], tokens[index]) for color, index in state["indices"].items()}
+    bb = from_str(state["board"])
+    cards = state["cards"]
+    hands: engine.Hands = ((cards["blue"][0], cards["blue"][1]), (cards["red"][0], cards["red"][1]), cards["side"])
+    turn = Player(state["currentTurn"])
+    key = engine.zobrist_hash(bb, hands, turn)
+
+    played = 0
+    while played < max_moves:
+        moves = engine.legal_moves(bb, hands, turn)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        client, token = players[turn.value]
+        notation = pos_to_notation(square_to_pos(move[0])) + pos_to_notation(square_to_pos(move[1]))
+        moves_sent[(match_id, played + 1)] = time.perf_counter()
+        reply = await client.command(f"move {match_id} {token} {move[2]} {notation}", latencies)
+        if reply["messageType"] != "move":
+            raise RuntimeError(f"move rejected: {reply}")
+        played += 1
+        bb, hands, key = engine.play(bb, hands, turn, key, move)
+        turn = engine.enemy_of(turn)
+        if winner(bb) != Player.NONE:
+            break
+
+    arrived = await asyncio.gather(*(client.wait_for_ply(played) for client in clients))
+    await asyncio.gather(*(client.close() for client in clients))
+    return played, arrived.count(False)
+
+
+async def run_games(url: str, games: int, spectators: int, max_moves: int, seed: int) -> Dict[str, Any]:
+    moves_sent: Dict[Tuple[str, int], float] = {}
+    lags: List[float] = []
+    latencies: Dict[str, List[float]] = {}
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        play_match(url, spectators, max_moves, random.Random(rng.random()), moves_sent, lags, latencies)
+        for _ in range(games)
+    ))
+    elapsed = time.perf_counter() - start
+    moves = sum(played for played, _ in results)
+    commands = sum(len(values) for values in latencies.values())
+    return {
+        "games": games,
+        "connections": games * (2 + spectators),
+        "moves": moves,
+        "commands": commands,
+        "seconds": round(elapsed, 3),
+        "commandsPerSecond": round(commands / elapsed, 1),
+        "movesPerSecond": round(moves / elapsed, 1),
+        "latencyMs": {command: latency_ms(values) for command, values in sorted(latencies.items())},
+        # From sending a move to each client in the match getting the state after it. Broadcasts that a slow
+        # client skipped because a newer state replaced them are left out.
+        "broadcastLagMs": latency_ms(lags),
+        "broadcastsReceived": len(lags),
+        "clientsMissingLastState": sum(missing for _, missing in results),
+    }
+
+
+async def run_scenarios(url: str, scenarios: List[str], args: argparse.Namespace,
+                        pid: Optional[int]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    if "poll" in scenarios:
+        results["poll"] = await run_poll(url, args.connections, args.requests, pid)
+    if "games" in scenarios:
+        results["games"] = await run_games(url, args.games, args.spectators, args.moves, args.seed)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS))
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--connections", type=int, default=200, help="connections in the poll scenario")
+    parser.add_argument("--requests", type=int, default=50, help="state requests per connection")
+    parser.add_argument("--games", type=int, default=50, help="matches played at once in the games scenario")
+    parser.add_argument("--spectators", type=int, default=4, help="spectators per match")
+    parser.add_argument("--moves", type=int, default=40, help="most moves per match")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--url", help="use an already running server instead of starting the backends")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {}
+    if args.url:
+        results["external"] = asyncio.run(run_scenarios(args.url, args.scenario, args, None))
+    for i, backend in enumerate([] if args.url else args.backend):
+        port = args.port + i
+        server = start_server(backend, port)
+        try:
+            wait_for_port(port)
+            results[backend] = asyncio.run(run_scenarios(f"ws://127.0.0.1:{port}/", args.scenario, args, server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps({"benchmark": "loadgen", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
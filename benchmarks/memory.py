@@ -0,0 +1,108 @@
+# Memory held by the boards and generated moves of a match, with the current interned Piece and Pos
+# against the previous mutable dataclasses (reproduced below as Legacy*).
+# Usage: python -m benchmarks.memory [--count 1000]
+import argparse
+import json
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.positions import DEALS, START_BOARD
+from conversions import get_cards_from_names, str_to_board
+from game import generate_moves_for_piece
+from structures import Card, Player, Pos
+
+
+@dataclass
+class LegacyPiece:
+    is_master: bool
+    color: Player
+
+
+@dataclass(eq=True, frozen=True)
+class LegacyPos:
+    x: int
+    y: int
+
+
+def legacy_str_to_board(s: str) -> List[List[LegacyPiece]]:
+    board = [[LegacyPiece(False, Player.NONE) for _ in range(5)] for _ in range(5)]
+    for i, n in enumerate(s):
+        if n == "0":
+            continue
+        x = 4 - (i % 5)
+        y = i // 5
+        if n == "1" or n == "2":
+            board[y][x].color = Player.BLUE
+        if n == "3" or n == "4":
+            board[y][x].color = Player.RED
+        if n == "2" or n == "4":
+            board[y][x].is_master = True
+    return board
+
+
+def legacy_moves(board: List[List[LegacyPiece]], cards: List[Card]) -> List[Tuple[LegacyPos, Card]]:
+    moves: List[Tuple[LegacyPos, Card]] = []
+    for piece_y in range(5):
+        for piece_x in range(5):
+            piece = board[piece_y][piece_x]
+            if piece.color != Player.BLUE:
+                continue
+            for card in cards:
+                for move in card.moves:
+                    x = -move.x + piece_x
+                    y = move.y + piece_y
+                    if 0 > x or x > 4 or 0 > y or y > 4 or board[y][x].color == piece.color:
+                        continue
+                    moves.append((LegacyPos(x, y), card))
+    return moves
+
+
+def current_moves(board: List[List[Any]], cards: List[Card]) -> List[Tuple[Pos, Card]]:
+    moves: List[Tuple[Pos, Card]] = []
+    for y in range(5):
+        for x in range(5):
+            if board[y][x].color == Player.BLUE:
+                moves += generate_moves_for_piece(Pos(x, y), cards, board)
+    return moves
+
+
+def bytes_per_call(func: Callable[[], object], count: int) -> float:
+    # Everything built is kept alive, so the traced size is what that many results hold.
+    func()
+    tracemalloc.start()
+    kept = [func() for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / count
+
+
+def run(count: int) -> Dict[str, Dict[str, float]]:
+    cards = get_cards_from_names(list(DEALS[0][:2]))
+    legacy_board = legacy_str_to_board(START_BOARD)
+    board = str_to_board(START_BOARD)
+    results = {
+        "legacy": {
+            "boardBytes": bytes_per_call(lambda: legacy_str_to_board(START_BOARD), count),
+            "movesBytes": bytes_per_call(lambda: legacy_moves(legacy_board, cards), count),
+        },
+        "current": {
+            "boardBytes": bytes_per_call(lambda: str_to_board(START_BOARD), count),
+            "movesBytes": bytes_per_call(lambda: current_moves(board, cards), count),
+        },
+    }
+    for values in results.values():
+        values["perMoveBytes"] = values["boardBytes"] + values["movesBytes"]
+    return {name: {key: round(value) for key, value in values.items()} for name, values in results.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000)
+    args = parser.parse_args()
+    print(json.dumps({"benchmark": "memory", "unit": "bytes", "results": run(args.count)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Per call timings of the move generator, the win check and the board conversions.
+# Usage: python -m benchmarks.micro [--number 20000]
+import argparse
+import json
+import timeit
+from typing import Callable, Dict
+
+import bitboard
+import engine
+from benchmarks.positions import DEALS, START_BOARD
+from conversions import board_to_str, get_cards_from_names, str_to_board
+from game import apply_move, check_win_condition, clone_board, generate_moves_for_piece
+from structures import Player, Pos
+
+
+def time_call(func: Callable[[], object], number: int) -> float:
+    # Best of three, in nanoseconds per call.
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e9
+
+
+def run(number: int) -> Dict[str, float]:
+    deal = DEALS[0]
+    cards = get_cards_from_names(list(deal))
+    blue_cards = cards[:2]
+    board = str_to_board(START_BOARD)
+    bb = bitboard.from_str(START_BOARD)
+    hands: engine.Hands = ((deal[0], deal[1]), (deal[2], deal[3]), deal[4])
+    key = engine.zobrist_hash(bb, hands, Player.BLUE)
+    # Blue's master and a legal move for it.
+    master = Pos(2, 0)
+    move_pos, move_card = generate_moves_for_piece(master, blue_cards, board)[0]
+    engine_move = (bitboard.square(master), bitboard.square(move_pos), move_card.name)
+
+    benchmarks: Dict[str, Callable[[], object]] = {
+        "generate_moves_for_piece": lambda: generate_moves_for_piece(master, blue_cards, board),
+        "apply_move": lambda: apply_move(master, move_pos, move_card, blue_cards, board),
+        "clone_board": lambda: clone_board(board),
+        "check_win_condition": lambda: check_win_condition(board),
+        "board_to_str": lambda: board_to_str(board),
+        "str_to_board": lambda: str_to_board(START_BOARD),
+        "bitboard.from_str": lambda: bitboard.from_str(START_BOARD),
+        "bitboard.winner": lambda: bitboard.winner(bb),
+        "engine.legal_moves": lambda: engine.legal_moves(bb, hands, Player.BLUE),
+        "engine.play": lambda: engine.play(bb, hands, Player.BLUE, key, engine_move),
+    }
+    return {name: round(time_call(func, number), 1) for name, func in benchmarks.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000, help="calls per timing")
+    args = parser.parse_args()
+    print(json.dumps({"benchmark": "micro", "unit": "ns/call", "results": run(args.number)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
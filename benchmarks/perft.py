@@ -0,0 +1,107 @@
+# Perft: the number of leaf positions at a fixed depth from the starting position.
+# Positions where the game is already won are not expanded, like checkmates in chess perft.
+# The counts in EXPECTED were produced by the original List[List[Piece]] move generator, so any
+# change to the move rules or to the faster paths that disagrees with them is a bug.
+# Usage: python -m benchmarks.perft [--depth 4]
+import argparse
+import json
+import time
+from typing import Any, Dict, List
+
+import bitboard
+import engine
+from benchmarks.positions import DEALS, START_BOARD
+from conversions import get_cards_from_names, str_to_board
+from game import Board, apply_move, check_win_condition, generate_moves_for_piece
+from structures import Card, Player, Pos
+
+# EXPECTED[deal index][depth - 1]
+EXPECTED: List[List[int]] = [
+    [13, 130, 1420, 19384, 237670],
+    [10, 130, 1651, 23660, 372164],
+    [8, 64, 896, 10448, 130646],
+]
+
+
+def perft_board(board: Board, blue: List[Card], red: List[Card], side: Card, turn: Player, depth: int) -> int:
+    # Goes through the public game functions, as used by the Move command.
+    if depth == 0:
+        return 1
+    if check_win_condition(board) != Player.NONE:
+        return 0
+    hand = blue if turn == Player.BLUE else red
+    enemy = Player.RED if turn == Player.BLUE else Player.BLUE
+    total = 0
+    for y in range(5):
+        for x in range(5):
+            if board[y][x].color != turn:
+                continue
+            piece_pos = Pos(x, y)
+            for move_pos, card in generate_moves_for_piece(piece_pos, hand, board):
+                new_board = apply_move(piece_pos, move_pos, card, hand, board)
+                assert new_board is not None
+                new_hand = [side if c == card else c for c in hand]
+                if turn == Player.BLUE:
+                    total += perft_board(new_board, new_hand, red, card, enemy, depth - 1)
+                else:
+                    total += perft_board(new_board, blue, new_hand, card, enemy, depth - 1)
+    return total
+
+
+def perft_bitboard(bb: bitboard.BitBoard, hands: engine.Hands, turn: Player, key: int, depth: int) -> int:
+    # Goes through the engine's move generator.
+    if depth == 0:
+        return 1
+    if bitboard.winner(bb) != Player.NONE:
+        return 0
+    if depth == 1:
+        return len(engine.legal_moves(bb, hands, turn))
+    enemy = engine.enemy_of(turn)
+    total = 0
+    for move in engine.legal_moves(bb, hands, turn):
+        child_bb, child_hands, child_key = engine.play(bb, hands, turn, key, move)
+        total += perft_bitboard(child_bb, child_hands, enemy, child_key, depth - 1)
+    return total
+
+
+def run(max_depth: int) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for index, deal in enumerate(DEALS):
+        cards = get_cards_from_names(list(deal))
+        turn = cards[4].color
+        hands: engine.Hands = ((deal[0], deal[1]), (deal[2], deal[3]), deal[4])
+        bb = bitboard.from_str(START_BOARD)
+        key = engine.zobrist_hash(bb, hands, turn)
+        for depth in range(1, max_depth + 1):
+            start = time.perf_counter()
+            board_count = perft_board(str_to_board(START_BOARD), cards[:2], cards[2:4], cards[4], turn, depth)
+            board_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            bitboard_count = perft_bitboard(bb, hands, turn, key, depth)
+            bitboard_seconds = time.perf_counter() - start
+
+            expected = EXPECTED[index][depth - 1] if depth <= len(EXPECTED[index]) else None
+            results.append({
+                "deal": list(deal),
+                "depth": depth,
+                "nodes": board_count,
+                "expected": expected,
+                "ok": board_count == bitboard_count and expected in (None, board_count),
+                "boardSeconds": round(board_seconds, 6),
+                "bitboardSeconds": round(bitboard_seconds, 6),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=4)
+    args = parser.parse_args()
+    results = run(args.depth)
+    print(json.dumps({"benchmark": "perft", "results": results}, indent=2))
+    if not all(result["ok"] for result in results):
+        raise SystemExit("perft counts do not match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from typing import List, Tuple
+
+# Same layout as game.init_game, in the conversions.board_to_str format.
+START_BOARD = "11211" + "0" * 15 + "33433"
+
+# Fixed card deals: blue's two cards, red's two cards, then the side card.
+DEALS: List[Tuple[str, str, str, str, str]] = [
+    ("tiger", "crab", "monkey", "crane", "dragon"),
+    ("boar", "ox", "elephant", "horse", "eel"),
+    ("rabbit", "cobra", "goose", "frog", "rooster"),
+]
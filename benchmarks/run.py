@@ -0,0 +1,51 @@
+# Runs every benchmark and writes one JSON document, so results can be compared between commits.
+# Usage: python -m benchmarks.run [--output bench_output.json] [--quick]
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from typing import Any, Dict
+
+from benchmarks import commands, memory, micro, perft, storage
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="file to write the results to instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="smaller runs, for a smoke test")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "perft": perft.run(3 if args.quick else 4),
+        "micro": micro.run(1000 if args.quick else 20000),
+        "commands": commands.run(2 if args.quick else 20, 0),
+        "memory": memory.run(100 if args.quick else 1000),
+        "storage": storage.run(2 if args.quick else 20, 0),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if not all(result["ok"] for result in results["perft"]):
+        sys.exit("perft counts do not match")
+    if not commands.ok(results["commands"]):
+        sys.exit("a move made more than one call to the collection")
+    if not storage.ok(results["storage"]):
+        sys.exit("a command read as much with the projections as without them")
+
+
+if __name__ == "__main__":
+    main()
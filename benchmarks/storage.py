@@ -0,0 +1,133 @@
+# Bytes of BSON the commands read from the matches collection, with the projections from storage.py and with whole
+# documents like before them, and through the match cache of the servers when every command misses it. Runs against
+# the in-memory stand-in, so it measures the size of what MongoDB would send back rather than the time it takes.
+# Exits with an error unless every command reads fewer bytes with the projections than without, both directly and
+# through the cache.
+# Usage: python -m benchmarks.storage [--games 20] [--seed 0]
+import argparse
+import json
+import random
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+import bson
+from bson import ObjectId
+from benchmarks.commands import MAX_PLIES, next_move
+from commands.create import Create
+from commands.history import History
+from commands.join import Join
+from commands.message import Message
+from commands.move import Move
+from commands.moves import Moves
+from commands.spectate import Spectate
+from commands.state import State
+from match_cache import MatchCache
+from memory_collection import Document, MemoryCollection
+from storage import STATE_FIELDS
+from structures import GameState
+
+
+class CountingCollection(MemoryCollection):
+    # Adds up the encoded size of every document read, under the command that is running, and counts the times each
+    # command ran.
+    def __init__(self, projections: bool) -> None:
+        super().__init__()
+        self.projections = projections
+        self.command = ""
+        self.bytes_read: Dict[str, int] = {}
+        self.runs: Dict[str, int] = {}
+
+    def count(self, doc: Optional[Document]) -> Optional[Document]:
+        if doc is not None and self.command:
+            self.bytes_read[self.command] = self.bytes_read.get(self.command, 0) + len(bson.encode(doc))
+        return doc
+
+    def find_one(self, query: Document, projection: Optional[Dict[str, int]] = None) -> Optional[Document]:
+        return self.count(super().find_one(query, projection if self.projections else None))
+
+    def find_one_and_update(self, query: Document, update: Document, projection: Optional[Dict[str, int]] = None,
+                            return_document: bool = False) -> Optional[Document]:
+        return self.count(super().find_one_and_update(
+            query, update, projection if self.projections else None, return_document=return_document
+        ))
+
+
+def play_games(collection: CountingCollection, games: int, cache: Optional[MatchCache] = None,
+               before_command: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    # The commands run against cache if given, reading from collection through it.
+    matches: Any = collection if cache is None else cache
+
+    def run(name: str, command: Any, query: str) -> List[Message]:
+        if before_command is not None:
+            before_command()
+        collection.command = name
+        collection.runs[name] = collection.runs.get(name, 0) + 1
+        messages: List[Message] = command.apply_command(matches, query)
+        collection.command = ""
+        return messages
+
+    for _ in range(games):
+        match_id = run("create", Create, "player1")[0].match_id
+        run("join", Join, f"{match_id} player2")
+        run("spectate", Spectate, match_id)
+        for ply in range(MAX_PLIES):
+            if cache is not None:
+                cache.flush()
+            match = collection.docs[ObjectId(match_id)]
+            if match["gameState"] != GameState.IN_PROGRESS.value:
+                break
+            run("moves", Moves, match_id)
+            run("state", State, match_id)
+            token = match["token" + match["currentTurn"].title()]
+            run("move", Move, f"{match_id} {token} {next_move(match)}")
+            run("history", History, f"{match_id} {ply // 2}")
+
+    # Averaged over every time the command ran, including the ones that read nothing.
+    return {name: round(size / collection.runs[name], 1) for name, size in sorted(collection.bytes_read.items())}
+
+
+def run(games: int, seed: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for name, projections in (("wholeDocuments", False), ("projected", True)):
+        random.seed(seed)
+        results[name] = play_games(CountingCollection(projections), games)
+
+    # Every match is written back and dropped from the cache before each command, so every command has to read it.
+    random.seed(seed)
+    collection = CountingCollection(True)
+    cache = MatchCache(collection, max_size=0, load_fields=STATE_FIELDS)
+
+    def evict_all() -> None:
+        cache.flush()
+        cache.evict()
+
+    results["matchCache"] = play_games(collection, games, cache, evict_all)
+    for name in ("projected", "matchCache"):
+        results[f"{name}Saving"] = {
+            command: round(1 - size / results["wholeDocuments"][command], 3)
+            for command, size in results[name].items()
+        }
+    return results
+
+
+def ok(results: Dict[str, Dict[str, float]]) -> bool:
+    # Every command that reads reads less than the whole documents, with and without the cache.
+    return all(
+        results[name].keys() == results["wholeDocuments"].keys() and all(saving > 0 for saving in savings.values())
+        for name, savings in (("projected", results["projectedSaving"]), ("matchCache", results["matchCacheSaving"]))
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = run(args.games, args.seed)
+    print(json.dumps({"benchmark": "storage", "bytesReadPerCommand": results}, indent=2))
+    if not ok(results):
+        sys.exit("a command read as much with the projections as without them")
+
+
+if __name__ == "__main__":
+    main()
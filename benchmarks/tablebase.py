@@ -0,0 +1,89 @@
+# Generation time, size and probe latency of an endgame tablebase from litama/tablebase.py, built in a temporary
+# directory. Every sampled position is also checked against the positions its moves lead to.
+# Usage: python -m benchmarks.tablebase [--cards tiger,crab,monkey,crane,dragon] [--students 1] [--processes 4]
+#                                       [--probes 100000]
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import engine
+import tablebase
+from bitboard import BitBoard, winner
+from structures import Player
+
+Position = Tuple[BitBoard, engine.Hands, Player]
+
+
+def random_positions(names: Sequence[str], students: int, count: int, seed: int) -> List[Position]:
+    rng = random.Random(seed)
+    positions: List[Position] = []
+    while len(positions) < count:
+        cards = list(names)
+        rng.shuffle(cards)
+        hands: engine.Hands = ((cards[0], cards[1]), (cards[2], cards[3]), cards[4])
+        blue_master, red_master, blue_student, red_student = rng.sample(range(25), 4)
+        blue = 1 << blue_master | (1 << blue_student if students and rng.random() < 0.8 else 0)
+        red = 1 << red_master | (1 << red_student if students and rng.random() < 0.8 else 0)
+        bb = BitBoard(blue, red, 1 << blue_master | 1 << red_master)
+        if winner(bb) == Player.NONE:
+            positions.append((bb, hands, rng.choice((Player.BLUE, Player.RED))))
+    return positions
+
+
+def consistent(table: tablebase.Tablebase, position: Position) -> bool:
+    # A win in n has a move to a loss in n - 1, a loss in n only moves to wins, the longest in n - 1, and a draw
+    # neither.
+    bb, hands, turn = position
+    key = engine.zobrist_hash(bb, hands, turn)
+    children: List[int] = []
+    for move in engine.legal_moves(bb, hands, turn):
+        child_bb, child_hands, _ = engine.play(bb, hands, turn, key, move)
+        child = table.probe(child_bb, child_hands, engine.enemy_of(turn))
+        # None after a move means the move ended the game.
+        children.append(0 if child is None else child)
+        if child is None:
+            return table.probe(bb, hands, turn) == 1
+    losses = [-child for child in children if child < 0]
+    if losses:
+        expected = min(losses) + 1
+    elif children and all(child > 0 for child in children):
+        expected = -(max(children) + 1)
+    else:
+        expected = 0
+    return table.probe(bb, hands, turn) == expected
+
+
+def run(names: Sequence[str], students: int, processes: int, probes: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, tablebase.tablebase_name(names))
+        results: Dict[str, Any] = tablebase.generate(names, students, path, processes)
+        table = tablebase.Tablebase(path)
+        positions = random_positions(names, students, probes, 0)
+        start = time.perf_counter()
+        for bb, hands, turn in positions:
+            table.probe(bb, hands, turn)
+        results["probeNanoseconds"] = round((time.perf_counter() - start) / len(positions) * 1e9, 1)
+        results["ok"] = all(consistent(table, position) for position in positions[:2000])
+        table.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", default="tiger,crab,monkey,crane,dragon")
+    parser.add_argument("--students", type=int, default=tablebase.MAX_STUDENTS)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--probes", type=int, default=100000)
+    args = parser.parse_args()
+    results = run(args.cards.split(","), args.students, args.processes, args.probes)
+    print(json.dumps({"benchmark": "tablebase", "results": results}, indent=2))
+    if not results["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
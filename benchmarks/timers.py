@@ -0,0 +1,73 @@
+# Cost of the timer wheel the servers run match clocks and idle timeouts on, with many clocks at once. Each clock
+# is rescheduled after every move like a match's clock is, and the wheel is advanced one tick at a time.
+# Usage: python -m benchmarks.timers [--clocks 10000] [--seconds 60]
+import argparse
+import json
+import random
+import time
+from typing import Dict, List, Tuple
+
+from timers import TimerWheel
+
+# The TIMER_TICK of the servers. config.py isn't imported since it needs MONGODB_HOST.
+TIMER_TICK = 0.1
+
+
+def run(clocks: int, seconds: float, seed: int = 0) -> Dict[str, float]:
+    rng = random.Random(seed)
+    ticks = int(seconds / TIMER_TICK)
+    # Clocks start with 1 to 10 minutes and the players move every 1 to 20 seconds, except in one match in ten,
+    # which is abandoned with under a minute left and expires.
+    deadlines = [rng.uniform(1, 60) if i % 10 == 0 else rng.uniform(60, 600) for i in range(clocks)]
+    moves_at: Dict[int, List[Tuple[int, float]]] = {}
+    for i in range(clocks):
+        if i % 10 == 0:
+            continue
+        at = rng.uniform(1, 20)
+        while at < seconds:
+            moves_at.setdefault(int(at / TIMER_TICK) + 1, []).append((i, at + rng.uniform(60, 600)))
+            at += rng.uniform(1, 20)
+
+    wheel: TimerWheel[int] = TimerWheel(0.0, TIMER_TICK)
+    start = time.perf_counter()
+    for i, deadline in enumerate(deadlines):
+        wheel.schedule(i, deadline)
+    schedule_seconds = time.perf_counter() - start
+
+    moves = 0
+    expired = 0
+    advance_seconds = 0.0
+    reschedule_seconds = 0.0
+    for tick in range(1, ticks + 1):
+        start = time.perf_counter()
+        expired += len(wheel.advance(tick * TIMER_TICK))
+        advance_seconds += time.perf_counter() - start
+
+        tick_moves = moves_at.get(tick, [])
+        start = time.perf_counter()
+        for i, deadline in tick_moves:
+            wheel.schedule(i, deadline)
+        reschedule_seconds += time.perf_counter() - start
+        moves += len(tick_moves)
+
+    return {
+        "clocks": clocks,
+        "ticks": ticks,
+        "moves": moves,
+        "expired": expired,
+        "scheduleNanoseconds": round(schedule_seconds / clocks * 1e9, 1),
+        "rescheduleNanoseconds": round(reschedule_seconds / max(1, moves) * 1e9, 1),
+        "advanceMicrosecondsPerTick": round(advance_seconds / ticks * 1e6, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clocks", type=int, default=10000)
+    parser.add_argument("--seconds", type=float, default=60, help="simulated time the wheel is advanced through")
+    args = parser.parse_args()
+    print(json.dumps({"benchmark": "timers", "results": run(args.clocks, args.seconds)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Set
+
+import websockets
+
+from broadcaster import QueuedMessage, enqueue
+
+
+class AsyncClientWriter:
+    __slots__ = ("ws", "queue", "wakeup", "drained", "closed")
+
+    def __init__(self, ws: Any) -> None:
+        self.ws = ws
+        self.queue: Deque[QueuedMessage] = deque()
+        self.wakeup = asyncio.Event()
+        # Set whenever the queue is empty or the writer has stopped.
+        self.drained = asyncio.Event()
+        self.closed = False
+
+
+class AsyncBroadcaster:
+    # The Broadcaster of broadcaster.py for async_server.py, with a writer task per socket instead of a greenlet.
+    # Queues are bounded, coalesced and disconnected the same way, see enqueue.
+    def __init__(self, on_disconnect: Callable[[Any], None], max_queue: int = 32, max_lag: float = 10.0) -> None:
+        self.on_disconnect = on_disconnect
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self._writers: Dict[Any, AsyncClientWriter] = {}
+        # Keeps the writer and close tasks from being garbage collected.
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    def __len__(self) -> int:
+        return len(self._writers)
+
+    def register(self, ws: Any) -> None:
+        writer = AsyncClientWriter(ws)
+        self._writers[ws] = writer
+        self._start(self._write(writer))
+
+    def unregister(self, ws: Any) -> None:
+        writer = self._writers.pop(ws, None)
+        if writer is not None:
+            writer.closed = True
+            writer.wakeup.set()
+            writer.drained.set()
+
+    async def drain(self, ws: Any) -> None:
+        # Waits until everything queued for ws has been sent. The socket handler waits for this before reading the
+        # next command, so a client sending commands faster than it reads the replies is slowed down instead of
+        # being disconnected, while the other clients are sent to as usual.
+        writer = self._writers.get(ws)
+        if writer is not None and writer.queue:
+            writer.drained.clear()
+            await writer.drained.wait()
+
+    def send(self, ws: Any, payload: str, coalesce_key: Optional[str] = None) -> None:
+        writer = self._writers.get(ws)
+        if writer is None:
+            return
+        if enqueue(writer.queue, payload, coalesce_key, self.max_queue, self.max_lag):
+            writer.wakeup.set()
+        else:
+            self._disconnect(writer)
+
+    async def _write(self, writer: AsyncClientWriter) -> None:
+        while not writer.closed:
+            if not writer.queue:
+                writer.drained.set()
+                writer.wakeup.clear()
+                await writer.wakeup.wait()
+                continue
+            payload = writer.queue.popleft()[0]
+            try:
+                await writer.ws.send(payload)
+            except websockets.ConnectionClosed:
+                self._disconnect(writer)
+
+    def _disconnect(self, writer: AsyncClientWriter) -> None:
+        if writer.closed:
+            return
+        self._writers.pop(writer.ws, None)
+        writer.closed = True
+        writer.queue.clear()
+        writer.wakeup.set()
+        writer.drained.set()
+        self._start(writer.ws.close())
+        self.on_disconnect(writer.ws)
+
+    def _start(self, coroutine: Any) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,330 @@
+import asyncio
+import signal
+import time
+from http import HTTPStatus
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
+
+import websockets
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.collection import Collection
+
+from async_broadcaster import AsyncBroadcaster
+from book import open_book
+from commands.ai import Ai
+from commands.flag import Flag
+from commands.message import Message
+from commands.move import Move
+from commands.spectate import Spectate
+from config import AI_PROCESSES, AI_TIME_LIMIT, BOOK_PATH, FLUSH_INTERVAL, LOG_LEVEL, LOG_SAMPLE_RATE, \
+    MATCH_IDLE_TIMEOUT, MAX_FLUSH_BACKOFF, MAX_FRAME_LENGTH, MEMORY_STORE, MONGODB_HOST, PORT, RATE_BURST, RATE_LIMIT, \
+    SOCKET_IDLE_TIMEOUT, TABLEBASE_PATH, TIMER_TICK
+from conversions import stored_board_str
+from dispatch import dispatch, validate
+from engine import search_match
+from limits import TokenBucket, admit
+from match_cache import MatchCache
+from memory_collection import MemoryCollection
+from metrics import BROADCAST_BYTES, BROADCASTS, MATCH_SOCKETS, SOCKETS, collectors, log_query, logger, render, \
+    start_logging
+from storage import STATE_FIELDS, ensure_indexes
+from structures import GameState
+from tablebase import open_tablebases
+from timers import TimerWheel
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Alternative to server.py built on asyncio and the websockets package, running the same commands.
+# Run it the same way: python async_server.py
+
+T = TypeVar("T")
+
+matches: Union["Collection[Dict[str, Any]]", MemoryCollection]
+if MEMORY_STORE:
+    matches = MemoryCollection()
+else:
+    matches = MongoClient(MONGODB_HOST).litama.matches
+match_cache = MatchCache(matches, load_fields=STATE_FIELDS)
+
+# The commands are synchronous. Against the in-memory store they never block, so they run inline on the event loop.
+# With MongoDB behind the cache, a cache miss or a flush waits on pymongo, so everything touching the cache runs
+# on a single worker thread instead: the event loop keeps serving sockets and each match still has one writer.
+store_executor: Optional[ThreadPoolExecutor] = None if MEMORY_STORE else ThreadPoolExecutor(max_workers=1)
+engine_pool = ProcessPoolExecutor(max_workers=AI_PROCESSES, initializer=open_tablebases, initargs=(TABLEBASE_PATH,))
+
+game_clients: Dict[str, Set[Any]] = {}
+# The matches each client is in game_clients for, so they can be removed when it disconnects.
+client_matches: Dict[Any, Set[str]] = {}
+delta_clients: Set[Any] = set()
+# Deadlines of match clocks, idle matches and idle sockets, like in server.py.
+timers: TimerWheel[Tuple[str, Any]] = TimerWheel(time.monotonic(), TIMER_TICK)
+match_activity: Dict[str, float] = {}
+socket_activity: Dict[Any, float] = {}
+# Keeps engine moves in progress from being garbage collected.
+background_tasks: Set["asyncio.Task[None]"] = set()
+
+
+async def run_in_store(func: Callable[..., T], *args: Any) -> T:
+    if store_executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(store_executor, func, *args)
+
+
+async def game_socket(ws: Any, path: str = "") -> None:
+    # path is only passed by older versions of websockets.
+    broadcaster.register(ws)
+    SOCKETS.inc()
+    bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+    socket_activity[ws] = time.monotonic()
+    timers.schedule(("socket", ws), socket_activity[ws] + SOCKET_IDLE_TIMEOUT)
+    try:
+        async for query in ws:
+            if not isinstance(query, str):
+                continue
+            socket_activity[ws] = time.monotonic()
+
+            log_query(query, LOG_SAMPLE_RATE)
+
+            # Rejected frames are answered on the event loop without waiting for the store.
+            rejected = admit(query, bucket, MAX_FRAME_LENGTH) or validate(query)
+            if rejected is not None:
+                send_messages(ws, [rejected])
+                await broadcaster.drain(ws)
+                continue
+
+            send_messages(ws, await run_in_store(dispatch, match_cache, query))
+            await broadcaster.drain(ws)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        SOCKETS.inc(amount=-1)
+        broadcaster.unregister(ws)
+        forget_client(ws)
+        del socket_activity[ws]
+        timers.cancel(("socket", ws))
+
+
+def forget_client(ws: Any) -> None:
+    delta_clients.discard(ws)
+    for match_id in client_matches.pop(ws, set()):
+        clients = game_clients.get(match_id)
+        if clients is not None:
+            clients.discard(ws)
+            if not clients:
+                forget_match(match_id)
+
+
+def forget_match(match_id: str) -> None:
+    for ws in game_clients.pop(match_id, set()):
+        client_matches.get(ws, set()).discard(match_id)
+    match_activity.pop(match_id, None)
+    timers.cancel(("match", match_id))
+
+
+# All sends go through here, see async_broadcaster.py.
+broadcaster = AsyncBroadcaster(forget_client)
+
+
+def add_client_to_map(match_id: str, ws: Any) -> None:
+    if match_id not in game_clients:
+        game_clients[match_id] = set()
+        match_activity[match_id] = time.monotonic()
+        timers.schedule(("match", match_id), match_activity[match_id] + MATCH_IDLE_TIMEOUT)
+    game_clients[match_id].add(ws)
+    client_matches.setdefault(ws, set()).add(match_id)
+
+
+def send_messages(ws: Optional[Any], messages: List[Message]) -> None:
+    # ws is the client that sent the command, or None for moves made by the engine.
+    for message in messages:
+        if message.add_sender_to_spectate_map and ws is not None:
+            add_client_to_map(message.match_id, ws)
+        if message.set_delta_mode is not None and ws is not None:
+            if message.set_delta_mode:
+                delta_clients.add(ws)
+            else:
+                delta_clients.discard(ws)
+
+        if message.reply_to_only_sender:
+            if ws is not None and not message.batched:
+                broadcaster.send(ws, message.to_json())
+        else:
+            is_state = message.message.get("messageType") == "state"
+            if is_state:
+                schedule_clock(message.message)
+            # A newer state of the match replaces one the client hasn't been sent yet, like in server.py.
+            state_key = f"state:{message.match_id}" if is_state else None
+            full = message.to_json()
+            delta = None if message.delta is None else message.delta.to_json()
+            # Copied because the broadcaster can disconnect clients, which removes them from the set.
+            clients = list(game_clients.get(message.match_id, ()))
+            if clients:
+                match_activity[message.match_id] = time.monotonic()
+            sent = 0
+            for client in clients:
+                if delta is not None and client in delta_clients:
+                    broadcaster.send(client, delta)
+                    sent += len(delta)
+                else:
+                    broadcaster.send(client, full, state_key)
+                    sent += len(full)
+            BROADCASTS.observe(len(clients))
+            BROADCAST_BYTES.inc(amount=sent)
+
+        if message.ai_to_move:
+            start_background(play_ai_move(message.match_id))
+
+
+async def play_ai_move(match_id: str) -> None:
+    match = await run_in_store(match_cache.find_one, {"_id": ObjectId(match_id)})
+    if match is None or match["gameState"] != GameState.IN_PROGRESS.value:
+        return
+    result = await asyncio.get_running_loop().run_in_executor(
+        engine_pool, search_match, stored_board_str(match["board"]), match["cards"], match["currentTurn"], AI_TIME_LIMIT
+    )
+    if result.move is None:
+        # The engine has no legal move, which ends the match as a draw.
+        blocked = await run_in_store(Move.end_blocked, match_cache, match)
+        if blocked is not None:
+            send_messages(None, [blocked])
+        return
+    send_messages(None, await run_in_store(Move.apply_command, match_cache, Ai.move_query(match, result.move)))
+
+
+def schedule_clock(state: Dict[str, Any]) -> None:
+    time_left = Flag.time_left(state)
+    if time_left is None:
+        timers.cancel(("clock", state["matchId"]))
+    else:
+        timers.schedule(("clock", state["matchId"]), time.monotonic() + max(0.0, time_left))
+
+
+async def flag_match(match_id: str) -> None:
+    match = await run_in_store(match_cache.find_one, {"_id": ObjectId(match_id)})
+    time_left = None if match is None else Flag.time_left(match)
+    if time_left is None:
+        return
+    if time_left > 0:
+        timers.schedule(("clock", match_id), time.monotonic() + time_left)
+        return
+    send_messages(None, await run_in_store(Flag.apply_command, match_cache, match_id))
+
+
+def expire_match(match_id: str, now: float) -> None:
+    last = match_activity.get(match_id)
+    if last is None:
+        return
+    if now - last < MATCH_IDLE_TIMEOUT:
+        timers.schedule(("match", match_id), last + MATCH_IDLE_TIMEOUT)
+    else:
+        # The sockets stay open, so they are told that they won't get the match's broadcasts anymore.
+        idle = Spectate.idle_msg(match_id).to_json()
+        for ws in list(game_clients.get(match_id, ())):
+            broadcaster.send(ws, idle)
+        forget_match(match_id)
+
+
+def expire_socket(ws: Any, now: float) -> None:
+    last = socket_activity.get(ws)
+    if last is None:
+        return
+    if now - last < SOCKET_IDLE_TIMEOUT:
+        timers.schedule(("socket", ws), last + SOCKET_IDLE_TIMEOUT)
+    elif client_matches.get(ws):
+        timers.schedule(("socket", ws), now + SOCKET_IDLE_TIMEOUT)
+    else:
+        start_background(ws.close())
+
+
+async def run_timers() -> None:
+    while True:
+        await asyncio.sleep(TIMER_TICK)
+        now = time.monotonic()
+        for kind, key in timers.advance(now):
+            if kind == "clock":
+                start_background(flag_match(key))
+            elif kind == "match":
+                expire_match(key, now)
+            else:
+                expire_socket(key, now)
+
+
+def start_background(coroutine: Any) -> None:
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def collect_match_sockets() -> None:
+    MATCH_SOCKETS.reset()
+    for clients in game_clients.values():
+        MATCH_SOCKETS.observe(len(clients))
+
+
+collectors.append(collect_match_sockets)
+
+
+def process_request(*args: Any) -> Any:
+    # Answers GET /metrics over plain HTTP on the WebSocket port. Older versions of websockets pass the path and
+    # headers and take a (status, headers, body) tuple, newer ones pass the connection and the request.
+    if isinstance(args[0], str):
+        if args[0] == "/metrics":
+            return HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4")], render().encode()
+    elif args[1].path == "/metrics":
+        return args[0].respond(HTTPStatus.OK, render())
+    return None
+
+
+def flush_and_evict() -> None:
+    match_cache.flush()
+    match_cache.evict()
+
+
+async def flush_matches() -> None:
+    delay = FLUSH_INTERVAL
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await run_in_store(flush_and_evict)
+        except Exception:
+            # Like in server.py, the failed batch is written by a later flush and nothing is evicted until then.
+            delay = min(delay * 2, MAX_FLUSH_BACKOFF)
+            logger.exception("Writing matches failed, retrying in %.1f seconds", delay)
+            continue
+        delay = FLUSH_INTERVAL
+
+
+async def serve() -> None:
+    log_listener = start_logging(LOG_LEVEL)
+    open_book(BOOK_PATH)
+    ensure_indexes(matches)
+    loop = asyncio.get_running_loop()
+    stop: "asyncio.Future[None]" = loop.create_future()
+
+    def request_stop() -> None:
+        if not stop.done():
+            stop.set_result(None)
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, request_stop)
+
+    async with websockets.serve(game_socket, "127.0.0.1", PORT, process_request=process_request,
+                                max_size=MAX_FRAME_LENGTH):
+        flusher = asyncio.ensure_future(flush_matches())
+        timer_loop = asyncio.ensure_future(run_timers())
+        print("Running")
+        await stop
+        flusher.cancel()
+        timer_loop.cancel()
+    await run_in_store(match_cache.flush)
+    log_listener.stop()
+
+
+if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
+    asyncio.run(serve())
@@ -0,0 +1,92 @@
+from typing import List, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from cards import CARD_IDS, CARDS_BY_ID
+from structures import Player
+
+# Move generation and win checks for many boards at once with NumPy, for analysis jobs that go through millions of
+# positions. Nothing here is used by the server.
+#
+# Boards are uint8 arrays of shape (n, 25), indexed by square (y * 5 + x, like bitboard.py) and holding the same piece
+# codes as the conversions.board_to_str format: 0 empty, 1 blue student, 2 blue master, 3 red student, 4 red master.
+# Turns are uint8 arrays of shape (n,), 0 for blue and 1 for red. Hands are arrays of shape (n, 2) of card ids
+# (cards.CARD_IDS).
+
+Boards = npt.NDArray[np.uint8]
+
+EMPTY, BLUE_STUDENT, BLUE_MASTER, RED_STUDENT, RED_MASTER = range(5)
+BLUE, RED = 0, 1
+# Results of check_win_conditions.
+NO_WINNER, BLUE_WINS, RED_WINS = 0, 1, 2
+COLORS = (Player.BLUE, Player.RED)
+
+# board_to_str lists each row from x = 4 to x = 0, so character i is square (i // 5) * 5 + 4 - i % 5.
+STR_TO_SQUARE = np.array([(i // 5) * 5 + 4 - i % 5 for i in range(25)])
+SQUARE_TO_STR = np.argsort(STR_TO_SQUARE)
+
+# DESTINATIONS[card id, color, from square, to square] is True when the card moves a piece of that color between
+# the squares, ignoring what is on them.
+DESTINATIONS = np.zeros((len(CARDS_BY_ID), 2, 25, 25), dtype=bool)
+for _card_id, _card in enumerate(CARDS_BY_ID):
+    for _color, _player in enumerate(COLORS):
+        for _sq in range(25):
+            for _pos in _card.destinations[_player][_sq]:
+                DESTINATIONS[_card_id, _color, _sq, _pos.y * 5 + _pos.x] = True
+
+
+def boards_from_strs(boards: List[str]) -> Boards:
+    codes = np.frombuffer("".join(boards).encode(), dtype=np.uint8).reshape(len(boards), 25) - ord("0")
+    squares = np.empty_like(codes)
+    squares[:, STR_TO_SQUARE] = codes
+    return squares
+
+
+def boards_to_strs(boards: Boards) -> List[str]:
+    chars = (boards[:, STR_TO_SQUARE] + ord("0")).astype(np.uint8).tobytes().decode()
+    return [chars[i:i + 25] for i in range(0, len(chars), 25)]
+
+
+def hands_from_names(hands: List[Tuple[str, str]]) -> npt.NDArray[np.intp]:
+    return np.array([[CARD_IDS[a], CARD_IDS[b]] for a, b in hands], dtype=np.intp)
+
+
+def own_pieces(boards: Boards, turns: npt.NDArray[np.uint8]) -> npt.NDArray[np.bool_]:
+    # (n, 25) mask of the pieces belonging to the player to move.
+    blue = (boards == BLUE_STUDENT) | (boards == BLUE_MASTER)
+    red = (boards == RED_STUDENT) | (boards == RED_MASTER)
+    own: npt.NDArray[np.bool_] = np.where(turns[:, None] == BLUE, blue, red)
+    return own
+
+
+def legal_move_masks(boards: Boards, turns: npt.NDArray[np.uint8],
+                     hands: npt.NDArray[np.intp]) -> npt.NDArray[np.bool_]:
+    # (n, 2, 25, 25) mask, True at [board, card in hand, from square, to square] for every legal move.
+    own = own_pieces(boards, turns)
+    destinations = DESTINATIONS[hands, turns[:, None].astype(np.intp)]
+    return destinations & own[:, None, :, None] & ~own[:, None, None, :]
+
+
+def successors(boards: Boards, masks: npt.NDArray[np.bool_]) -> Tuple[npt.NDArray[np.intp], Boards]:
+    # Every legal move in masks as an (m, 4) array of (board, card in hand, from square, to square), and the
+    # (m, 25) boards they lead to.
+    moves = np.argwhere(masks)
+    board_index, from_sq, to_sq = moves[:, 0], moves[:, 2], moves[:, 3]
+    rows = np.arange(len(moves))
+    new_boards = boards[board_index]
+    new_boards[rows, to_sq] = new_boards[rows, from_sq]
+    new_boards[rows, from_sq] = EMPTY
+    return moves, new_boards
+
+
+def check_win_conditions(boards: Boards) -> npt.NDArray[np.uint8]:
+    # Same rules and order as bitboard.winner, NO_WINNER, BLUE_WINS or RED_WINS for every board.
+    blue_master = (boards == BLUE_MASTER).any(axis=1)
+    red_master = (boards == RED_MASTER).any(axis=1)
+    result: npt.NDArray[np.uint8] = np.select(
+        [~blue_master, ~red_master, boards[:, 2] == RED_MASTER, boards[:, 22] == BLUE_MASTER],
+        [RED_WINS, BLUE_WINS, RED_WINS, BLUE_WINS],
+        NO_WINNER
+    ).astype(np.uint8)
+    return result
@@ -0,0 +1,183 @@
+from typing import Dict, List, NamedTuple, Tuple
+
+from cards import ALL_CARDS
+from structures import Card, Piece, Player, Pos
+
+# Squares are numbered y * 5 + x, so bit n of a mask is the square at (n % 5, n // 5).
+# This matches the Board indexing in game.py (board[y][x]).
+
+# The temple a red master has to reach to win, and vice versa.
+BLUE_TEMPLE = 1 << (0 * 5 + 2)
+RED_TEMPLE = 1 << (4 * 5 + 2)
+
+
+class BitBoard(NamedTuple):
+    blue: int
+    red: int
+    masters: int
+
+
+def square(pos: Pos) -> int:
+    return pos.y * 5 + pos.x
+
+
+def square_to_pos(sq: int) -> Pos:
+    return Pos(sq % 5, sq // 5)
+
+
+def iter_squares(mask: int) -> List[int]:
+    squares: List[int] = []
+    while mask:
+        bit = mask & -mask
+        squares.append(bit.bit_length() - 1)
+        mask ^= bit
+    return squares
+
+
+# CARD_TARGETS[card name][color][square] = mask of every square the card can reach from that square,
+# already rotated for the color and clipped to the board.
+CARD_TARGETS: Dict[str, Dict[Player, Tuple[int, ...]]] = {card.name: card.target_masks for card in ALL_CARDS}
+
+
+def from_board(b: List[List[Piece]]) -> BitBoard:
+    blue = red = masters = 0
+    for y, row in enumerate(b):
+        for x, piece in enumerate(row):
+            bit = 1 << (y * 5 + x)
+            if piece.color == Player.BLUE:
+                blue |= bit
+            elif piece.color == Player.RED:
+                red |= bit
+            else:
+                continue
+            if piece.is_master:
+                masters |= bit
+    return BitBoard(blue, red, masters)
+
+
+def to_board(bb: BitBoard) -> List[List[Piece]]:
+    board: List[List[Piece]] = [[Piece(False, Player.NONE) for _ in range(5)] for _ in range(5)]
+    for y in range(5):
+        for x in range(5):
+            bit = 1 << (y * 5 + x)
+            if bb.blue & bit:
+                board[y][x] = Piece(bool(bb.masters & bit), Player.BLUE)
+            elif bb.red & bit:
+                board[y][x] = Piece(bool(bb.masters & bit), Player.RED)
+    return board
+
+
+def from_str(s: str) -> BitBoard:
+    # Same 25 character format as conversions.board_to_str, without building Piece objects.
+    blue = red = masters = 0
+    for i, n in enumerate(s):
+        if n == "0":
+            continue
+        bit = 1 << ((i // 5) * 5 + 4 - (i % 5))
+        if n == "1" or n == "2":
+            blue |= bit
+        elif n == "3" or n == "4":
+            red |= bit
+        if n == "2" or n == "4":
+            masters |= bit
+    return BitBoard(blue, red, masters)
+
+
+def to_str(bb: BitBoard) -> str:
+    chars: List[str] = []
+    for y in range(5):
+        for x in range(4, -1, -1):
+            bit = 1 << (y * 5 + x)
+            if bb.blue & bit:
+                chars.append("2" if bb.masters & bit else "1")
+            elif bb.red & bit:
+                chars.append("4" if bb.masters & bit else "3")
+            else:
+                chars.append("0")
+    return "".join(chars)
+
+
+def color_at(bb: BitBoard, sq: int) -> Player:
+    bit = 1 << sq
+    if bb.blue & bit:
+        return Player.BLUE
+    if bb.red & bit:
+        return Player.RED
+    return Player.NONE
+
+
+def own_pieces(bb: BitBoard, color: Player) -> int:
+    return bb.blue if color == Player.BLUE else bb.red
+
+
+def moves_for_square(bb: BitBoard, sq: int, cards: List[Card]) -> List[Tuple[int, Card]]:
+    # Each element is the square the move leads to and the card used for that move.
+    color = color_at(bb, sq)
+    if color == Player.NONE:
+        return []
+    blocked = own_pieces(bb, color)
+    moves: List[Tuple[int, Card]] = []
+    for card in cards:
+        for target in iter_squares(CARD_TARGETS[card.name][color][sq] & ~blocked):
+            moves.append((target, card))
+    return moves
+
+
+def generate_moves(bb: BitBoard, color: Player, cards: List[Card]) -> List[Tuple[int, int, Card]]:
+    # Every (from square, to square, card) available to color.
+    own = own_pieces(bb, color)
+    moves: List[Tuple[int, int, Card]] = []
+    for card in cards:
+        targets = CARD_TARGETS[card.name][color]
+        for sq in iter_squares(own):
+            for target in iter_squares(targets[sq] & ~own):
+                moves.append((sq, target, card))
+    return moves
+
+
+def is_legal(bb: BitBoard, from_sq: int, to_sq: int, card: Card, cards: List[Card]) -> bool:
+    if card not in cards:
+        return False
+    color = color_at(bb, from_sq)
+    if color == Player.NONE:
+        return False
+    return bool(CARD_TARGETS[card.name][color][from_sq] & ~own_pieces(bb, color) & (1 << to_sq))
+
+
+def make_move(bb: BitBoard, from_sq: int, to_sq: int) -> BitBoard:
+    # Doesn't check legality, see is_legal.
+    from_bit = 1 << from_sq
+    to_bit = 1 << to_sq
+    # Clear the target square first so captures fall out of the same operation.
+    blue = bb.blue & ~to_bit
+    red = bb.red & ~to_bit
+    masters = bb.masters & ~to_bit
+    if blue & from_bit:
+        blue ^= from_bit | to_bit
+    else:
+        red ^= from_bit | to_bit
+    if masters & from_bit:
+        masters ^= from_bit | to_bit
+    return BitBoard(blue, red, masters)
+
+
+def winner(bb: BitBoard) -> Player:
+    # Way of the Stone: the enemy master was captured.
+    if not bb.masters & bb.blue:
+        return Player.RED
+    if not bb.masters & bb.red:
+        return Player.BLUE
+
+    # Way of the Stream: the master reached the enemy temple.
+    if bb.masters & bb.red & BLUE_TEMPLE:
+        return Player.RED
+    if bb.masters & bb.blue & RED_TEMPLE:
+        return Player.BLUE
+
+    return Player.NONE
+
+
+# The winner when the side to move has no legal move. Unlike in the board game, where a blocked player passes and
+# only exchanges a card, players can't pass here, so the game ends as a draw. The move command, the engine, the
+# tablebases and the tournament runner all follow this rule.
+NO_MOVES_WINNER = Player.NONE
@@ -0,0 +1,153 @@
+# Opening book built from finished matches, stored as an open addressing hash table in a file that is memory-mapped
+# for lookups. Build it with: python book.py [--output book.bin] [--max-ply 24]
+import argparse
+import mmap
+import struct
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from conversions import stored_moves_bytes
+from engine import zobrist_hash
+from metrics import logger
+from replay import History
+from structures import GameState, Player
+
+MAGIC = b"LTBK"
+# Magic, format version, number of slots (a power of two).
+HEADER = struct.Struct("<4sII")
+# Zobrist key (0 for an empty slot), blue wins, red wins, draws, then the MOVES_PER_ENTRY most played moves from the
+# position in the packed format from conversions.py and how often each was played.
+MOVES_PER_ENTRY = 4
+ENTRY = struct.Struct(f"<QIII{MOVES_PER_ENTRY}H{MOVES_PER_ENTRY}I")
+VERSION = 1
+DEFAULT_MAX_PLY = 24
+BATCH_SIZE = 500
+
+
+class BookEntry(NamedTuple):
+    blue_wins: int
+    red_wins: int
+    draws: int
+    # (packed move, times played), most played first.
+    moves: List[Tuple[int, int]]
+
+
+class Book:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is too short to be an opening book")
+        magic, version, self._slots = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an opening book of version {VERSION}")
+        # probe masks keys with the slot count, so it has to be a power of two.
+        if not self._slots or self._slots & (self._slots - 1):
+            raise ValueError(f"{path} has {self._slots} slots, which isn't a power of two")
+        if len(self._map) != HEADER.size + self._slots * ENTRY.size:
+            raise ValueError(f"{path} doesn't have the {self._slots} slots its header says")
+
+    def probe(self, key: int) -> Optional[BookEntry]:
+        key = key or 1
+        slot = key & (self._slots - 1)
+        while True:
+            entry = ENTRY.unpack_from(self._map, HEADER.size + slot * ENTRY.size)
+            if entry[0] == 0:
+                return None
+            if entry[0] == key:
+                codes = entry[4:4 + MOVES_PER_ENTRY]
+                counts = entry[4 + MOVES_PER_ENTRY:]
+                return BookEntry(entry[1], entry[2], entry[3], [(c, n) for c, n in zip(codes, counts) if n])
+            slot = (slot + 1) & (self._slots - 1)
+
+    def close(self) -> None:
+        self._map.close()
+
+
+# Opened by the server at startup, see open_book.
+opening_book: Optional[Book] = None
+
+
+def open_book(path: str) -> None:
+    global opening_book
+    try:
+        opening_book = Book(path)
+    except FileNotFoundError:
+        opening_book = None
+    except (OSError, ValueError) as e:
+        # A broken book only turns the book command off, the server runs without it.
+        logger.warning("Not using the opening book %s: %s", path, e)
+        opening_book = None
+
+
+# Built in memory: key -> [blue wins, red wins, draws, {packed move: times played}]
+Stats = Dict[int, List[Any]]
+
+
+def add_match(stats: Stats, match: Dict[str, Any], max_ply: int) -> None:
+    moves = stored_moves_bytes(match["moves"])
+    replay = History(match["startingCards"], moves)
+    result = {Player.BLUE.value: 0, Player.RED.value: 1}.get(match["winner"], 2)
+    for ply, position in enumerate(replay.positions()):
+        if ply >= max_ply or ply >= len(replay):
+            break
+        key = zobrist_hash(position.board, position.hands, position.turn) or 1
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = [0, 0, 0, {}]
+        entry[result] += 1
+        next_moves: Dict[int, int] = entry[3]
+        code = replay.codes[ply]
+        next_moves[code] = next_moves.get(code, 0) + 1
+
+
+def write_book(stats: Stats, path: str) -> int:
+    # Returns the number of positions written. The table is kept at most half full so probes stay short.
+    slots = 1
+    while slots < len(stats) * 2:
+        slots *= 2
+    table = bytearray(HEADER.size + slots * ENTRY.size)
+    HEADER.pack_into(table, 0, MAGIC, VERSION, slots)
+    for key, (blue_wins, red_wins, draws, next_moves) in stats.items():
+        top = sorted(next_moves.items(), key=lambda item: -item[1])[:MOVES_PER_ENTRY]
+        top += [(0, 0)] * (MOVES_PER_ENTRY - len(top))
+        slot = key & (slots - 1)
+        while table[HEADER.size + slot * ENTRY.size:HEADER.size + slot * ENTRY.size + 8] != bytes(8):
+            slot = (slot + 1) & (slots - 1)
+        ENTRY.pack_into(table, HEADER.size + slot * ENTRY.size, key, blue_wins, red_wins, draws,
+                        *[code for code, _ in top], *[count for _, count in top])
+    with open(path, "wb") as f:
+        f.write(table)
+    return len(stats)
+
+
+def build(matches: Any, path: str, max_ply: int = DEFAULT_MAX_PLY) -> Tuple[int, int]:
+    # Returns the number of matches read and positions written.
+    stats: Stats = {}
+    count = 0
+    cursor = matches.find(
+        {"gameState": GameState.ENDED.value},
+        {"startingCards": 1, "moves": 1, "winner": 1},
+        batch_size=BATCH_SIZE
+    )
+    for match in cursor:
+        if "startingCards" in match:
+            add_match(stats, match, max_ply)
+            count += 1
+    return count, write_book(stats, path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="book.bin")
+    parser.add_argument("--max-ply", type=int, default=DEFAULT_MAX_PLY, help="positions after this ply are left out")
+    args = parser.parse_args()
+
+    from config import MONGODB_HOST
+    from pymongo import MongoClient
+    matches: Any = MongoClient(MONGODB_HOST).litama.matches
+    count, positions = build(matches, args.output, args.max_ply)
+    print(f"{positions} positions from {count} matches written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
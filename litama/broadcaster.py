@@ -0,0 +1,98 @@
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import gevent
+from gevent.event import Event
+from geventwebsocket import WebSocketError
+from geventwebsocket.websocket import WebSocket
+
+# (payload, coalesce key, time it was queued)
+QueuedMessage = Tuple[str, Optional[str], float]
+
+
+def enqueue(queue: Deque[QueuedMessage], payload: str, coalesce_key: Optional[str], max_queue: int,
+            max_lag: float) -> bool:
+    # Queues payload, dropping a queued message with the same coalesce key. Returns False instead if the client is
+    # too far behind: its queue is full or its oldest message has waited longer than max_lag seconds.
+    now = time.monotonic()
+    if coalesce_key is not None:
+        for i, (_, key, _) in enumerate(queue):
+            if key == coalesce_key:
+                del queue[i]
+                break
+    if len(queue) >= max_queue or (queue and now - queue[0][2] > max_lag):
+        return False
+    queue.append((payload, coalesce_key, now))
+    return True
+
+
+class ClientWriter:
+    __slots__ = ("ws", "queue", "wakeup", "closed")
+
+    def __init__(self, ws: WebSocket) -> None:
+        self.ws = ws
+        self.queue: Deque[QueuedMessage] = deque()
+        self.wakeup = Event()
+        self.closed = False
+
+
+class Broadcaster:
+    # Every socket gets a bounded outgoing queue and its own writer greenlet, so sending to a slow client never
+    # holds up the greenlet that handled the command or the other recipients.
+    # A queued message with the same coalesce key as a newer one is dropped, e.g. an older state of the same match
+    # that the client hasn't received yet. Clients whose queue is full or whose oldest message has waited longer
+    # than max_lag seconds are disconnected, and on_disconnect is called for them.
+    def __init__(self, on_disconnect: Callable[[WebSocket], None], max_queue: int = 32, max_lag: float = 10.0) -> None:
+        self.on_disconnect = on_disconnect
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self._writers: Dict[WebSocket, ClientWriter] = {}
+
+    def __len__(self) -> int:
+        return len(self._writers)
+
+    def register(self, ws: WebSocket) -> None:
+        writer = ClientWriter(ws)
+        self._writers[ws] = writer
+        gevent.spawn(self._write, writer)
+
+    def unregister(self, ws: WebSocket) -> None:
+        writer = self._writers.pop(ws, None)
+        if writer is not None:
+            writer.closed = True
+            writer.wakeup.set()
+
+    def send(self, ws: WebSocket, payload: str, coalesce_key: Optional[str] = None) -> None:
+        writer = self._writers.get(ws)
+        if writer is None:
+            return
+        if enqueue(writer.queue, payload, coalesce_key, self.max_queue, self.max_lag):
+            writer.wakeup.set()
+        else:
+            self._disconnect(writer)
+
+    def _write(self, writer: ClientWriter) -> None:
+        while not writer.closed:
+            if not writer.queue:
+                writer.wakeup.clear()
+                writer.wakeup.wait()
+                continue
+            payload = writer.queue.popleft()[0]
+            try:
+                writer.ws.send(payload)
+            except (WebSocketError, OSError):
+                self._disconnect(writer)
+
+    def _disconnect(self, writer: ClientWriter) -> None:
+        if writer.closed:
+            return
+        self._writers.pop(writer.ws, None)
+        writer.closed = True
+        writer.queue.clear()
+        writer.wakeup.set()
+        try:
+            writer.ws.close()
+        except (WebSocketError, OSError):
+            pass
+        self.on_disconnect(writer.ws)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 from structures import Card, Pos, Player
 
@@ -54,3 +54,9 @@ ALL_EXPANSION_CARD_NAMES: List[str] = [card.name for card in ALL_EXPANSION_CARDS
 
 ALL_CARDS: List[Card] = ALL_BASE_CARDS + ALL_EXPANSION_CARDS
 ALL_CARD_NAMES: List[str] = ALL_BASE_CARD_NAMES + ALL_EXPANSION_CARD_NAMES
+
+# Lookups by name and by integer id. Ids are the index in ALL_CARDS, so they stay the same as long as
+# cards are only ever appended.
+CARDS_BY_NAME: Dict[str, Card] = {card.name: card for card in ALL_CARDS}
+CARDS_BY_ID: List[Card] = list(ALL_CARDS)
+CARD_IDS: Dict[str, int] = {card.name: i for i, card in enumerate(ALL_CARDS)}
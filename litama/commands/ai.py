@@ -0,0 +1,91 @@
+from random import random
+from secrets import token_hex
+from typing import Any, Dict, List
+
+import bitboard
+from commands.command import Command, MatchCollection
+from commands.message import Message
+from conversions import bitboard_to_bytes, pos_to_notation
+from engine import EngineMove
+from game import init_game
+from storage import created
+from structures import GameState, Player
+
+AI_USERNAME = "Litama AI"
+
+
+class Ai(Command):
+    STARTS_WITH = "ai "
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Starts a match against the server's engine straight away, there is nobody to wait for.
+        username = query
+
+        token: str = token_hex(32)
+        color: str = "blue"
+        ai_color: str = "red"
+        if random() < 0.5:
+            color = "red"
+            ai_color = "blue"
+
+        board, blue_cards, red_cards, side_card = init_game()
+        insert = {
+            "usernames": {
+                color: username,
+                ai_color: AI_USERNAME
+            },
+            "indices": {
+                color: 0,
+                ai_color: 1
+            },
+            f"token{color.title()}": token,
+            # The engine moves through the Move command like a player would, so it needs a token too.
+            f"token{ai_color.title()}": token_hex(32),
+            "ai": ai_color,
+            "gameState": GameState.IN_PROGRESS.value,
+            "board": bitboard_to_bytes(bitboard.from_board(board)),
+            "moves": [],
+            "ply": 0,
+            "currentTurn": side_card.color.value,
+            "cards": {
+                "blue": [i.name for i in blue_cards],
+                "red": [i.name for i in red_cards],
+                "side": side_card.name
+            },
+            "startingCards": {
+                "blue": [i.name for i in blue_cards],
+                "red": [i.name for i in red_cards],
+                "side": side_card.name
+            },
+            "winner": Player.NONE.value,
+            **created(GameState.IN_PROGRESS.value)
+        }
+        match_id = str(matches.insert_one(insert).inserted_id)
+
+        state = Command.state_message(matches, insert, False)
+        state.ai_to_move = insert["currentTurn"] == ai_color
+
+        return [
+            Message(
+                {
+                    "messageType": "ai",
+                    "matchId": match_id,
+                    "token": token,
+                    "index": 0
+                },
+                True,
+                match_id,
+                True
+            ),
+            state
+        ]
+
+    @staticmethod
+    def move_query(match: Dict[str, Any], move: EngineMove) -> str:
+        # The query for the Move command that plays the engine's move.
+        from_sq, to_sq, card_name = move
+        color: str = match["currentTurn"]
+        from_notation = pos_to_notation(bitboard.square_to_pos(from_sq))
+        to_notation = pos_to_notation(bitboard.square_to_pos(to_sq))
+        return f"{match['_id']} {match['token' + color.title()]} {card_name} {from_notation}{to_notation}"
@@ -0,0 +1,52 @@
+from typing import List
+
+import book
+from bitboard import from_str
+from cards import CARDS_BY_NAME
+from commands.command import Command, MatchCollection
+from commands.message import Message
+from conversions import bytes_to_move_strs
+from engine import Hands, zobrist_hash
+from structures import Player
+
+
+class Book(Command):
+    STARTS_WITH = "book "
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Command format: book [board] [blue card],[blue card],[red card],[red card],[side card] [turn]
+        # Example: book 1121100000000000000033433 tiger,crab,monkey,crane,dragon blue
+        # Looks the position up in the opening book, see book.py. The match collection isn't used.
+        split = query.split(" ")
+        if len(split) != 3:
+            return [Command.error_msg("Expected a board, cards and turn", "book")]
+        board, cards_str, turn = split
+        cards = cards_str.split(",")
+
+        if len(board) != 25 or any(n not in "01234" for n in board):
+            return [Command.error_msg("board was in an incorrect format", "book")]
+        if len(cards) != 5 or any(name not in CARDS_BY_NAME for name in cards):
+            return [Command.error_msg("Expected 5 comma separated card names", "book")]
+        if turn not in ("blue", "red"):
+            return [Command.error_msg("turn must be 'blue' or 'red'", "book")]
+        if book.opening_book is None:
+            return [Command.error_msg("No opening book loaded", "book")]
+
+        hands: Hands = ((cards[0], cards[1]), (cards[2], cards[3]), cards[4])
+        entry = book.opening_book.probe(zobrist_hash(from_str(board), hands, Player(turn)))
+        message = {
+            "messageType": "book",
+            "board": board,
+            "cards": cards_str,
+            "currentTurn": turn,
+            "found": entry is not None
+        }
+        if entry is not None:
+            message["blueWins"] = entry.blue_wins
+            message["redWins"] = entry.red_wins
+            message["draws"] = entry.draws
+            message["moves"] = [
+                {"move": bytes_to_move_strs(code.to_bytes(2, "big"))[0], "count": count} for code, count in entry.moves
+            ]
+        return [Message(message, True, "")]
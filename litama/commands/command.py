@@ -1,11 +1,20 @@
-from typing import List, Dict, Union, Any
+from typing import FrozenSet, List, Dict, Optional, Tuple, Union, Any
 
 import bson
 from bson import ObjectId
 from pymongo.collection import Collection
 
-from commands.message import Message
-from structures import GameState
+import bitboard
+from commands.message import Message, to_json_str
+from conversions import get_cards_from_names, squares_to_move_str, stored_bitboard, stored_board_str, \
+    stored_move_strs
+from match_cache import MatchCache
+from memory_collection import MemoryCollection
+from structures import GameState, Player
+
+MatchCollection = Union["Collection[Dict[str, Any]]", MatchCache, MemoryCollection]
+# The legal moves in the order they were generated, and the same moves as a set to check moves against.
+LegalMoves = Tuple[List[str], FrozenSet[str]]
 
 
 class Command:
@@ -16,7 +25,13 @@ class Command:
         return query.startswith(cls.STARTS_WITH)
 
     @staticmethod
-    def apply_command(matches: Collection, query: str) -> List[Message]:
+    def validate(query: str) -> Optional[Message]:
+        # Rejects queries that are malformed without reading any match, returning the error to reply with.
+        # dispatch only runs apply_command for queries this accepted.
+        return None
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
         pass
 
     @staticmethod
@@ -39,26 +54,73 @@ class Command:
         except bson.errors.InvalidId:
             return Command.error_msg("matchId was in an incorrect format", message_type, match_id)
 
+    @staticmethod
+    def validate_match_id(match_id: str, message_type: str) -> Optional[Message]:
+        if ObjectId.is_valid(match_id):
+            return None
+        return Command.error_msg("matchId was in an incorrect format", message_type, match_id)
+
+    @staticmethod
+    def state_message(matches: MatchCollection, match: Dict[str, Any], reply_to_only_sender: bool) -> Message:
+        match_id = str(match["_id"])
+        if not isinstance(matches, MatchCache):
+            return Message(Command.generate_state_dict(match), reply_to_only_sender, match_id)
+
+        # Build and encode the state once per match version, every later reply reuses it.
+        cached = matches.payload(match["_id"], "state")
+        if cached is None:
+            state = Command.generate_state_dict(match)
+            cached = (state, to_json_str(state))
+            matches.set_payload(match["_id"], "state", cached)
+        return Message(cached[0], reply_to_only_sender, match_id, encoded=cached[1])
+
     @staticmethod
     def generate_state_dict(match: Dict[str, Any]) -> Dict[str, str]:
+        state: Dict[str, Any]
         if match["gameState"] == GameState.WAITING_FOR_PLAYER.value:
-            return {
+            state = {
                 "messageType": "state",
                 "matchId": str(match["_id"]),
                 "gameState": match["gameState"],
                 "usernames": match["usernames"]
             }
+        else:
+            state = {
+                "messageType": "state",
+                "usernames": match["usernames"],
+                "indices": match["indices"],
+                "matchId": str(match["_id"]),
+                "currentTurn": match["currentTurn"],
+                "cards": match["cards"],
+                "startingCards": match["startingCards"],
+                "moves": stored_move_strs(match["moves"]),
+                "board": stored_board_str(match["board"]),
+                "gameState": match["gameState"],
+                "winner": match["winner"]
+            }
+        # Only timed matches have a clock, see Flag.
+        if "clock" in match:
+            state["clock"] = match["clock"]
+        return state
+
+    @staticmethod
+    def legal_moves(matches: MatchCollection, match: Dict[str, Any]) -> LegalMoves:
+        # Every move the side to move can make in a match in progress, as "card:a1a2" like in the moves list.
+        # Generated once per ply and kept with the cached state when matches is a MatchCache.
+        if isinstance(matches, MatchCache):
+            cached = matches.payload(match["_id"], "legalMoves")
+            if cached is not None:
+                legal: LegalMoves = cached
+                return legal
 
-        return {
-            "messageType": "state",
-            "usernames": match["usernames"],
-            "indices": match["indices"],
-            "matchId": str(match["_id"]),
-            "currentTurn": match["currentTurn"],
-            "cards": match["cards"],
-            "startingCards": match["startingCards"],
-            "moves": match["moves"],
-            "board": match["board"],
-            "gameState": match["gameState"],
-            "winner": match["winner"]
-        }
+        color = match["currentTurn"]
+        moves = [
+            squares_to_move_str(card.name, from_sq, to_sq)
+            for from_sq, to_sq, card in bitboard.generate_moves(
+                stored_bitboard(match["board"]), Player(color), get_cards_from_names(match["cards"][color])
+            )
+        ]
+        legal = (moves, frozenset(moves))
+        if isinstance(matches, MatchCache):
+            matches.set_payload(match["_id"], "legalMoves", legal)
+        return legal
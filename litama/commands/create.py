@@ -1,20 +1,33 @@
+import re
 from random import random
 from secrets import token_hex
 from typing import List
 
-from pymongo.collection import Collection
-
-from commands.command import Command
+from commands.command import Command, MatchCollection
+from commands.flag import Flag
 from commands.message import Message
+from storage import created
 from structures import GameState
 
 
+# Seconds each player starts with and seconds added after each of their moves, e.g. 300+5.
+TIME_CONTROL_PATTERN = re.compile("([0-9]{1,5})\\+([0-9]{1,4})")
+
+
 class Create(Command):
     STARTS_WITH = "create "
 
     @staticmethod
-    def apply_command(matches: Collection, query: str) -> List[Message]:
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Command format: create [time control] [username]
+        # The time control is optional, without one the match has no clock.
         username = query
+        clock = None
+        split = query.split(" ", 1)
+        time_control = TIME_CONTROL_PATTERN.fullmatch(split[0])
+        if len(split) == 2 and time_control is not None and int(time_control.group(1)) > 0:
+            username = split[1]
+            clock = Flag.new_clock(int(time_control.group(1)), int(time_control.group(2)))
 
         token: str = token_hex(32)
         color: str = "Blue"
@@ -39,8 +52,11 @@ class Create(Command):
             },
             f"token{color}": token,
             f"token{enemy}": "",
-            "gameState": GameState.WAITING_FOR_PLAYER.value
+            "gameState": GameState.WAITING_FOR_PLAYER.value,
+            **created(GameState.WAITING_FOR_PLAYER.value)
         }
+        if clock is not None:
+            insert["clock"] = clock
         match_id = str(matches.insert_one(insert).inserted_id)
 
         return [
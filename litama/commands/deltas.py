@@ -0,0 +1,28 @@
+from typing import List
+
+from commands.command import Command, MatchCollection
+from commands.message import Message
+
+
+class Deltas(Command):
+    STARTS_WITH = "deltas "
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Command format: deltas [on|off]
+        # With deltas on, the state broadcast after a move is replaced by a delta message.
+        # Clients should send a state command when the delta's seq isn't one more than the last one seen.
+        if query not in ("on", "off"):
+            return [Command.error_msg("Expected 'on' or 'off'", "deltas")]
+
+        return [
+            Message(
+                {
+                    "messageType": "deltas",
+                    "enabled": query == "on"
+                },
+                True,
+                "",
+                set_delta_mode=query == "on"
+            )
+        ]
@@ -0,0 +1,94 @@
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from commands.command import Command, MatchCollection
+from commands.message import Message
+from storage import FLAG_FIELDS, STATE_FIELDS, timestamps
+from structures import GameState
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+
+class Flag(Command):
+    STARTS_WITH = "flag "
+
+    @staticmethod
+    def validate(query: str) -> Optional[Message]:
+        return Command.validate_match_id(query, "flag")
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Command format: flag [match_id]
+        # Ends a timed match whose side to move has run out of time. The servers send it for the matches they own
+        # when a clock runs out, and anyone can send it too.
+        match_id = query
+
+        check: Union[Message, ObjectId] = Command.check_match_id(match_id, "flag")
+        if isinstance(check, Message):
+            return [check]
+
+        object_id = check
+        match = matches.find_one({"_id": object_id}, FLAG_FIELDS)
+        if match is None:
+            return [Command.error_msg("Match not found", "flag", match_id)]
+        if match["gameState"] != GameState.IN_PROGRESS.value:
+            return [Command.error_msg("Game is not in progress", "flag", match_id)]
+        time_left = Flag.time_left(match)
+        if time_left is None:
+            return [Command.error_msg("Match has no clock", "flag", match_id)]
+        if time_left > 0:
+            return [Command.error_msg("Time has not run out", "flag", match_id)]
+
+        broadcast = Flag.flag(matches, match)
+        if broadcast is None:
+            return [Command.error_msg("Match was changed by another move, try again", "flag", match_id)]
+        return [
+            Message(
+                {
+                    "messageType": "flag",
+                    "matchId": match_id
+                },
+                True,
+                match_id
+            ),
+            broadcast
+        ]
+
+    @staticmethod
+    def new_clock(initial: int, increment: int) -> Dict[str, Any]:
+        # Stored with the match as "clock". Times are in seconds, turnStartedAt is a Unix time set once the match
+        # starts.
+        return {"initial": initial, "increment": increment, "blue": initial, "red": initial, "turnStartedAt": None}
+
+    @staticmethod
+    def time_left(match: Dict[str, Any], now: Optional[float] = None) -> Optional[float]:
+        # Seconds the side to move has left, None if the match has no clock running. Works on stored matches and on
+        # state messages alike.
+        clock = match.get("clock")
+        if clock is None or clock["turnStartedAt"] is None or match["gameState"] != GameState.IN_PROGRESS.value:
+            return None
+        elapsed = (time.time() if now is None else now) - clock["turnStartedAt"]
+        time_left: float = clock[match["currentTurn"]] - elapsed
+        return time_left
+
+    @staticmethod
+    def flag(matches: MatchCollection, match: Dict[str, Any]) -> Optional[Message]:
+        # Ends the match as lost on time by the side to move and returns the state broadcast. Returns None if a move
+        # was made after match was read, like Move.try_move.
+        color = match["currentTurn"]
+        updated = matches.find_one_and_update(
+            {"_id": match["_id"], "ply": match.get("ply"), "gameState": GameState.IN_PROGRESS.value},
+            {
+                "$set": {
+                    "gameState": GameState.ENDED.value,
+                    "winner": "red" if color == "blue" else "blue",
+                    f"clock.{color}": 0,
+                    **timestamps(GameState.ENDED.value)
+                }
+            },
+            projection=STATE_FIELDS,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            return None
+        return Command.state_message(matches, updated, False)
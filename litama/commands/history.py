@@ -0,0 +1,50 @@
+from typing import List, Optional, Union
+
+from commands.command import Command, MatchCollection
+from commands.message import Message
+from conversions import bytes_to_move_strs
+from replay import history, snapshot_dict
+from storage import HISTORY_FIELDS
+from structures import GameState
+from bson import ObjectId
+
+
+class History(Command):
+    STARTS_WITH = "history "
+
+    @staticmethod
+    def validate(query: str) -> Optional[Message]:
+        split = query.split(" ")
+        if len(split) != 2 or not split[1].isdigit():
+            return Command.error_msg("Expected a matchId and a ply", "history")
+        return Command.validate_match_id(split[0], "history")
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Command format: history [match_id] [ply]
+        # Replies with the position after the first ply moves of the match, 0 being the starting position.
+        match_id, ply_str = query.split(" ")
+
+        check: Union[Message, ObjectId] = Command.check_match_id(match_id, "history")
+        if isinstance(check, Message):
+            return [check]
+
+        object_id = check
+        match = matches.find_one({"_id": object_id}, HISTORY_FIELDS)
+        if match is None:
+            return [Command.error_msg("Match not found", "history", match_id)]
+        if match["gameState"] == GameState.WAITING_FOR_PLAYER.value:
+            return [Command.error_msg("Game has not started", "history", match_id)]
+
+        replay = history(match)
+        ply = int(ply_str)
+        if ply > len(replay):
+            return [Command.error_msg("ply is after the last move", "history", match_id)]
+
+        message = snapshot_dict(replay.at(ply))
+        message["messageType"] = "history"
+        message["matchId"] = match_id
+        message["ply"] = ply
+        # The move that led to this position.
+        message["move"] = bytes_to_move_strs(replay.moves[ply * 2 - 2:ply * 2])[0] if ply else None
+        return [Message(message, True, match_id)]
@@ -1,12 +1,13 @@
+import time
 from secrets import token_hex
-from typing import List, Union
+from typing import List, Optional, Union
 
-from pymongo.collection import Collection
-
-from commands.command import Command
+from commands.command import Command, MatchCollection
 from commands.message import Message
-from conversions import board_to_str
+from bitboard import from_board
+from conversions import bitboard_to_bytes
 from game import init_game
+from storage import JOIN_FIELDS, STATE_FIELDS, timestamps
 from structures import GameState, Player
 from bson import ObjectId
 
@@ -15,7 +16,11 @@ class Join(Command):
     STARTS_WITH = "join "
 
     @staticmethod
-    def apply_command(matches: Collection, query: str) -> List[Message]:
+    def validate(query: str) -> Optional[Message]:
+        return Command.validate_match_id(query.split(" ", 1)[0], "join")
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
         split = query.split(" ")
         match_id = split[0]
 
@@ -25,7 +30,7 @@ class Join(Command):
 
         object_id = check
         username = " ".join(split[1:])
-        match = matches.find_one({"_id": object_id})
+        match = matches.find_one({"_id": object_id}, JOIN_FIELDS)
         if match is None:
             return [Command.error_msg("Match not found", "join", match_id)]
         if match["gameState"] != GameState.WAITING_FOR_PLAYER.value:
@@ -38,16 +43,21 @@ class Join(Command):
         usernames[color] = username
         indices = match["indices"]
         indices[color] = 1
+        # The clock of the first player starts running now.
+        clock = {"clock.turnStartedAt": time.time()} if "clock" in match else {}
 
         matches.find_one_and_update(
             {"_id": object_id},
             {"$set": {
+                **clock,
                 f"token{color.title()}": token,
                 "usernames": usernames,
                 "indices": indices,
                 "gameState": GameState.IN_PROGRESS.value,
-                "board": board_to_str(board),
+                "board": bitboard_to_bytes(from_board(board)),
                 "moves": [],
+                # Moves made so far, see Move for how it guards against concurrent moves.
+                "ply": 0,
                 "currentTurn": side_card.color.value,
                 "cards": {
                     "blue": [i.name for i in blue_cards],
@@ -59,7 +69,8 @@ class Join(Command):
                     "red": [i.name for i in red_cards],
                     "side": side_card.name
                 },
-                "winner": Player.NONE.value
+                "winner": Player.NONE.value,
+                **timestamps(GameState.IN_PROGRESS.value)
             }}
         )
 
@@ -74,9 +85,5 @@ class Join(Command):
                 True,
                 match_id
             ),
-            Message(
-                Command.generate_state_dict(matches.find_one({"_id": object_id})),  # type: ignore
-                False,
-                match_id
-            )
+            Command.state_message(matches, matches.find_one({"_id": object_id}, STATE_FIELDS), False)  # type: ignore
         ]
@@ -1,6 +1,11 @@
+import json
 from dataclasses import dataclass
 
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+
+def to_json_str(d: Dict[str, Any]) -> str:
+    return json.dumps(d, separators=(',', ':'))
 
 
 @dataclass
@@ -9,3 +14,18 @@ class Message:
     reply_to_only_sender: bool
     match_id: str
     add_sender_to_spectate_map: bool = False
+    # Already serialized form of message, shared between every reply built from the same match version.
+    encoded: Optional[str] = None
+    # Compact replacement for this message sent to clients that opted into deltas.
+    delta: Optional["Message"] = None
+    # Switches delta mode on or off for the sender.
+    set_delta_mode: Optional[bool] = None
+    # The engine has to reply to this state in a match against the AI.
+    ai_to_move: bool = False
+    # Already part of a batch reply, so it isn't sent on its own.
+    batched: bool = False
+
+    def to_json(self) -> str:
+        if self.encoded is None:
+            self.encoded = to_json_str(self.message)
+        return self.encoded
@@ -1,21 +1,43 @@
-from typing import List, Optional, Union
-
-from pymongo.collection import Collection
-
-from cards import ALL_BASE_CARD_NAMES
-from commands.command import Command
+import re
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import bitboard
+from cards import CARDS_BY_NAME
+from commands.command import Command, MatchCollection
+from commands.flag import Flag
 from commands.message import Message
-from conversions import board_to_str, str_to_board, notation_to_pos, get_card_from_name, get_cards_from_names
-from game import Board, apply_move, check_win_condition
+from conversions import bitboard_to_bytes, get_cards_from_names, move_str_to_bytes, notation_to_pos, stored_bitboard
+from storage import MOVE_FIELDS, STATE_FIELDS, timestamps
 from structures import GameState, Player
 from bson import ObjectId
+from pymongo import ReturnDocument
+
+
+# How often a move is checked again after losing a race against another move on the same match.
+MAX_ATTEMPTS = 3
+# The square of the piece to move, then the square it moves to.
+MOVE_PATTERN = re.compile("[a-e][1-5][a-e][1-5]")
 
 
 class Move(Command):
     STARTS_WITH = "move "
 
     @staticmethod
-    def apply_command(matches: Collection, query: str) -> List[Message]:
+    def validate(query: str) -> Optional[Message]:
+        split = query.split(" ")
+        if len(split) != 4:
+            return Command.error_msg("Expected a matchId, token, card and move", "move")
+        match_id, _, card_name, move = split
+        invalid = Command.validate_match_id(match_id, "move")
+        if invalid is not None:
+            return invalid
+        if card_name not in CARDS_BY_NAME or MOVE_PATTERN.fullmatch(move) is None:
+            return Command.error_msg("'move' or 'card' not given properly", "move", match_id)
+        return None
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
         # Command format: move [match_id] [token] [card] [move]
         # Example: move 5f9c394ee71e1740c218587b iq2V39W9WNm0EZpDqEcqzoLRhSkdD3lY boar a1a2
         split = query.split(" ")
@@ -26,9 +48,23 @@ class Move(Command):
             return [check]
 
         object_id = check
-        match = matches.find_one({"_id": object_id})
-        if match is None:
-            return [Command.error_msg("Match not found", "move", match_id)]
+
+        # The move is checked against the match as it was read and only written if no other move was made meanwhile.
+        # If one was, it is checked again against the new state, which usually means it is no longer this
+        # player's turn.
+        for _ in range(MAX_ATTEMPTS):
+            match = matches.find_one({"_id": object_id}, MOVE_FIELDS)
+            if match is None:
+                return [Command.error_msg("Match not found", "move", match_id)]
+            result = Move.try_move(matches, match, match_id, token, card_name, move)
+            if result is not None:
+                return result
+        return [Command.error_msg("Match was changed by another move, try again", "move", match_id)]
+
+    @staticmethod
+    def try_move(matches: MatchCollection, match: Dict[str, Any], match_id: str,
+                 token: str, card_name: str, move: str) -> Optional[List[Message]]:
+        # Returns None if another move was committed after match was read.
         if match["gameState"] == GameState.ENDED.value:
             return [Command.error_msg("Game ended", "move", match_id)]
 
@@ -39,57 +75,93 @@ class Move(Command):
         else:
             return [Command.error_msg("Token is incorrect", "move", match_id)]
 
-        if move[0] not in "abdce" or move[1] not in "12345" or move[2] not in "abcde" or move[3] not in "12345":
-            move = "none"
-        if card_name not in ALL_BASE_CARD_NAMES:
-            card_name = "none"
-        if move == "none" or card_name == "none":
-            return [Command.error_msg("'move' or 'card' not given properly", "move", match_id)]
-
-        board = str_to_board(match["board"])
-        piece_pos = notation_to_pos(move[:2])
+        bb = stored_bitboard(match["board"])
+        from_sq = bitboard.square(notation_to_pos(move[:2]))
 
         if match["currentTurn"] != color:
             return [Command.error_msg("Cannot move when it is not your turn", "move", match_id)]
 
-        if board[piece_pos.y][piece_pos.x].color.value != color:
+        # A move that comes in after the player's time ran out ends the match instead, in case the server's timer
+        # hasn't yet.
+        now = time.time()
+        time_left = Flag.time_left(match, now)
+        if time_left is not None and time_left <= 0:
+            flagged = Flag.flag(matches, match)
+            if flagged is None:
+                return None
+            return [Command.error_msg("Out of time", "move", match_id), flagged]
+
+        if bitboard.color_at(bb, from_sq).value != color:
             return [Command.error_msg("Cannot move opponent's pieces or empty squares", "move", match_id)]
 
-        move_pos = notation_to_pos(move[2:])
-        move_card = get_card_from_name(card_name)
-        cards = get_cards_from_names(match["cards"][color])
-        new_board: Optional[Board] = apply_move(piece_pos, move_pos, move_card, cards, board)
-
-        if new_board is None:
+        played = f"{card_name}:{move}"
+        if played not in Command.legal_moves(matches, match)[1]:
             return [Command.error_msg("Invalid move", "move", match_id)]
 
-        winner = check_win_condition(new_board)
-        state = GameState.ENDED.value if winner != Player.NONE else GameState.IN_PROGRESS.value
-
-        moves = match["moves"]
-        moves.append(f"{card_name}:{move}")
-        side_card: str = match["cards"]["side"]
-        new_cards: List[str] = match["cards"][color]
-        new_cards[new_cards.index(card_name)] = side_card
+        to_sq = bitboard.square(notation_to_pos(move[2:]))
+        new_bb = bitboard.make_move(bb, from_sq, to_sq)
+        winner = bitboard.winner(new_bb)
 
+        new_cards: List[str] = list(match["cards"][color])
+        new_cards[new_cards.index(card_name)] = match["cards"]["side"]
         enemy = "red" if color == "blue" else "blue"
-        enemy_cards = match["cards"][enemy]
-
-        matches.find_one_and_update(
-            {"_id": object_id},
-            {"$set": {
-                "board": board_to_str(new_board),
-                "moves": moves,
-                "currentTurn": "blue" if color == "red" else "red",
-                "cards": {
-                    enemy: enemy_cards,
-                    color: new_cards,
-                    "side": card_name
+
+        # An opponent left without a legal move ends the match, see bitboard.NO_MOVES_WINNER.
+        blocked = winner == Player.NONE and not bitboard.generate_moves(
+            new_bb, Player(enemy), get_cards_from_names(match["cards"][enemy])
+        )
+        if blocked:
+            winner = bitboard.NO_MOVES_WINNER
+        state = GameState.ENDED.value if winner != Player.NONE or blocked else GameState.IN_PROGRESS.value
+
+        # Matches created before ply was stored don't have it, {"ply": None} matches them in MongoDB too. Their
+        # moves are read only to count them, MOVE_FIELDS leaves them out.
+        ply: Optional[int] = match.get("ply")
+        if ply is None:
+            stored = matches.find_one({"_id": match["_id"]}, {"moves": 1})
+            if stored is None:
+                return None
+            ply = len(stored["moves"])
+        clock: Dict[str, Any] = {}
+        if time_left is not None:
+            clock = {f"clock.{color}": time_left + match["clock"]["increment"], "clock.turnStartedAt": now}
+        updated = matches.find_one_and_update(
+            {"_id": match["_id"], "ply": match.get("ply")},
+            {
+                "$set": {
+                    "board": bitboard_to_bytes(new_bb),
+                    "currentTurn": enemy,
+                    f"cards.{color}": new_cards,
+                    "cards.side": card_name,
+                    "gameState": state,
+                    "winner": winner.value,
+                    "ply": ply + 1,
+                    **clock,
+                    **timestamps(state)
                 },
-                "gameState": state,
-                "winner": winner.value
-            }}
+                "$push": {"moves": move_str_to_bytes(played)}
+            },
+            projection=STATE_FIELDS,
+            return_document=ReturnDocument.AFTER
         )
+        if updated is None:
+            return None
+
+        broadcast = Command.state_message(matches, updated, False)
+        delta = {
+            "messageType": "delta",
+            "matchId": match_id,
+            "seq": ply + 1,
+            "move": played,
+            "side": card_name,
+            "currentTurn": enemy,
+            "gameState": state,
+            "winner": winner.value
+        }
+        if "clock" in updated:
+            delta["clock"] = updated["clock"]
+        broadcast.delta = Message(delta, False, match_id)
+        broadcast.ai_to_move = state == GameState.IN_PROGRESS.value and match.get("ai") == enemy
 
         return [
             Message(
@@ -100,9 +172,25 @@ class Move(Command):
                 True,
                 match_id
             ),
-            Message(
-                Command.generate_state_dict(matches.find_one({"_id": object_id})),  # type: ignore
-                False,
-                match_id
-            )
+            broadcast
         ]
+
+    @staticmethod
+    def end_blocked(matches: MatchCollection, match: Dict[str, Any]) -> Optional[Message]:
+        # Ends a match in progress whose side to move has no legal move, for matches stored before moves ended them.
+        # Returns the state broadcast, or None if the match was changed after it was read, like Flag.flag.
+        updated = matches.find_one_and_update(
+            {"_id": match["_id"], "ply": match.get("ply"), "gameState": GameState.IN_PROGRESS.value},
+            {
+                "$set": {
+                    "gameState": GameState.ENDED.value,
+                    "winner": bitboard.NO_MOVES_WINNER.value,
+                    **timestamps(GameState.ENDED.value)
+                }
+            },
+            projection=STATE_FIELDS,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            return None
+        return Command.state_message(matches, updated, False)
@@ -0,0 +1,48 @@
+from typing import List, Optional, Union
+
+from commands.command import Command, MatchCollection
+from commands.message import Message
+from storage import MOVES_FIELDS
+from structures import GameState
+from bson import ObjectId
+
+
+class Moves(Command):
+    STARTS_WITH = "moves "
+
+    @staticmethod
+    def validate(query: str) -> Optional[Message]:
+        return Command.validate_match_id(query, "moves")
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
+        # Command format: moves [match_id]
+        # Replies with every legal move of the side to move, in the same format as the move command takes them.
+        match_id = query
+
+        check: Union[Message, ObjectId] = Command.check_match_id(match_id, "moves")
+        if isinstance(check, Message):
+            return [check]
+
+        object_id = check
+        match = matches.find_one({"_id": object_id}, MOVES_FIELDS)
+        if match is None:
+            return [Command.error_msg("Match not found", "moves", match_id)]
+        if match["gameState"] == GameState.WAITING_FOR_PLAYER.value:
+            return [Command.error_msg("Game has not started", "moves", match_id)]
+        if match["gameState"] == GameState.ENDED.value:
+            return [Command.error_msg("Game ended", "moves", match_id)]
+
+        return [
+            Message(
+                {
+                    "messageType": "moves",
+                    "matchId": match_id,
+                    "currentTurn": match["currentTurn"],
+                    "ply": match.get("ply", len(match["moves"])),
+                    "moves": Command.legal_moves(matches, match)[0]
+                },
+                True,
+                match_id
+            )
+        ]
@@ -1,9 +1,8 @@
-from typing import List, Union
+from typing import List, Optional, Union
 
-from pymongo.collection import Collection
-
-from commands.command import Command
+from commands.command import Command, MatchCollection
 from commands.message import Message
+from storage import STATE_FIELDS
 from structures import GameState
 from bson import ObjectId
 
@@ -12,7 +11,11 @@ class Spectate(Command):
     STARTS_WITH = "spectate "
 
     @staticmethod
-    def apply_command(matches: Collection, query: str) -> List[Message]:
+    def validate(query: str) -> Optional[Message]:
+        return Command.validate_match_id(query, "spectate")
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
         match_id = query
 
         check: Union[Message, ObjectId] = Command.check_match_id(match_id, "spectate")
@@ -20,7 +23,7 @@ class Spectate(Command):
             return [check]
 
         object_id = check
-        match = matches.find_one({"_id": object_id})
+        match = matches.find_one({"_id": object_id}, STATE_FIELDS)
         if match is None:
             return [Command.error_msg("Match not found", "spectate", match_id)]
         if match["gameState"] == GameState.ENDED.value:
@@ -36,9 +39,11 @@ class Spectate(Command):
                 match_id,
                 True
             ),
-            Message(
-                Command.generate_state_dict(matches.find_one({"_id": object_id})),  # type: ignore
-                False,
-                match_id
-            )
+            Command.state_message(matches, match, False)
         ]
+
+    @staticmethod
+    def idle_msg(match_id: str) -> Message:
+        # Sent by the servers to the sockets watching a match when they stop watching it for being idle.
+        return Command.error_msg("Stopped sending updates of an idle match, spectate it again to resume", "spectate",
+                                 match_id)
@@ -1,9 +1,8 @@
-from typing import List, Union
+from typing import List, Optional, Union
 
-from pymongo.collection import Collection
-
-from commands.command import Command
+from commands.command import Command, MatchCollection
 from commands.message import Message
+from storage import STATE_FIELDS
 from bson import ObjectId
 
 
@@ -11,7 +10,11 @@ class State(Command):
     STARTS_WITH = "state "
 
     @staticmethod
-    def apply_command(matches: Collection, query: str) -> List[Message]:
+    def validate(query: str) -> Optional[Message]:
+        return Command.validate_match_id(query, "state")
+
+    @staticmethod
+    def apply_command(matches: MatchCollection, query: str) -> List[Message]:
         match_id = query
 
         check: Union[Message, ObjectId] = Command.check_match_id(match_id, "state")
@@ -19,14 +22,10 @@ class State(Command):
             return [check]
 
         object_id = check
-        match = matches.find_one({"_id": object_id})
+        match = matches.find_one({"_id": object_id}, STATE_FIELDS)
         if match is None:
             return [Command.error_msg("Match not found", "state", match_id)]
 
         return [
-            Message(
-                Command.generate_state_dict(match),
-                True,
-                match_id
-            )
+            Command.state_message(matches, match, True)
         ]
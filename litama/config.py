@@ -1,3 +1,43 @@
 import os
 
-MONGODB_HOST = os.environ["MONGODB_HOST"]
+# Keeps matches in process memory instead of MongoDB, for running locally and for load tests.
+MEMORY_STORE = os.environ.get("LITAMA_MEMORY_STORE", "") == "1"
+MONGODB_HOST = "" if MEMORY_STORE else os.environ["MONGODB_HOST"]
+PORT = int(os.environ.get("PORT", "5000"))
+
+# Seconds between writes of changed matches from the match cache to the collection.
+FLUSH_INTERVAL = 1.0
+# After a failed write, the wait before the next one doubles up to this many seconds.
+MAX_FLUSH_BACKOFF = 30.0
+# Processes searching for the engine in matches against the AI, and the time it gets per move.
+AI_PROCESSES = 2
+AI_TIME_LIMIT = 1.0
+# Directory of the endgame tablebases built by tablebase.py, which the engine probes when they cover a position.
+TABLEBASE_PATH = os.environ.get("LITAMA_TABLEBASES", "tablebases")
+# Opening book answering the book command, built by book.py. The command replies with an error if there is none.
+BOOK_PATH = os.environ.get("LITAMA_BOOK", "book.bin")
+
+# Frames each connection can send per second, with bursts of up to RATE_BURST, 0 for no limit. Both servers close
+# connections that send a message longer than MAX_FRAME_LENGTH bytes before reading all of it, which leaves room for a
+# full batch, and the commands also reject frames longer than MAX_FRAME_LENGTH characters.
+RATE_LIMIT = float(os.environ.get("LITAMA_RATE_LIMIT", "20"))
+RATE_BURST = int(os.environ.get("LITAMA_RATE_BURST", "40"))
+MAX_FRAME_LENGTH = 16 * 1024
+
+# Seconds between ticks of the timer loop. It ends matches whose clock ran out, stops watching matches without a
+# broadcast for MATCH_IDLE_TIMEOUT seconds, telling the sockets that watched them, and closes sockets that sent
+# nothing for SOCKET_IDLE_TIMEOUT seconds and aren't watching any match.
+TIMER_TICK = 0.1
+MATCH_IDLE_TIMEOUT = 30 * 60
+SOCKET_IDLE_TIMEOUT = 10 * 60
+
+# Level of the litama logger, and the fraction of received frames logged at DEBUG.
+LOG_LEVEL = os.environ.get("LITAMA_LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.environ.get("LITAMA_LOG_SAMPLE", "0.01"))
+
+# Name of this worker and of every worker, for running several server processes on one or more hosts.
+# Matches are spread between them by consistent hashing and each is only ever changed by its own worker.
+WORKER_ID = os.environ.get("LITAMA_WORKER_ID", "0")
+WORKERS = os.environ.get("LITAMA_WORKERS", WORKER_ID).split(",")
+# host:port of the hub from pubsub.py that connects the workers. Without it everything stays in this process.
+PUBSUB_ADDRESS = os.environ.get("LITAMA_PUBSUB", "")
@@ -1,49 +1,117 @@
-from typing import List
+import struct
+from typing import Dict, List, Union
 
-from cards import ALL_BASE_CARDS
+import bitboard
+from bitboard import BitBoard
+from cards import CARD_IDS, CARDS_BY_ID, CARDS_BY_NAME
 from game import Board
 from structures import Player, Piece, Pos, Card
 
+_PIECES_BY_CHAR: Dict[str, Piece] = {
+    "0": Piece(False, Player.NONE),
+    "1": Piece(False, Player.BLUE),
+    "2": Piece(True, Player.BLUE),
+    "3": Piece(False, Player.RED),
+    "4": Piece(True, Player.RED),
+}
+_CHARS_BY_PIECE: Dict[Piece, str] = {piece: char for char, piece in _PIECES_BY_CHAR.items()}
+
 
 def board_to_str(b: Board) -> str:
-    s = ""
-    for row in b:
-        for piece in row[::-1]:
-            if piece.color == Player.BLUE:
-                s += "2" if piece.is_master else "1"
-            elif piece.color == Player.RED:
-                s += "4" if piece.is_master else "3"
-            else:
-                s += "0"
-    return s
+    # Each row in the string goes from x = 4 to x = 0.
+    return "".join([_CHARS_BY_PIECE[piece] for row in b for piece in row[::-1]])
 
 
 def str_to_board(s: str) -> Board:
-    board: Board = [[Piece(False, Player.NONE) for _ in range(5)] for _ in range(5)]
-    for i, n in enumerate(s):
-        if n == "0":
-            continue
-        x = 4 - (i % 5)
-        y = i // 5
-        if n == "1" or n == "2":
-            board[y][x].color = Player.BLUE
-        if n == "3" or n == "4":
-            board[y][x].color = Player.RED
-        if n == "2" or n == "4":
-            board[y][x].is_master = True
-    return board
+    # Each row in the string goes from x = 4 to x = 0.
+    return [[_PIECES_BY_CHAR[n] for n in s[y * 5:y * 5 + 5][::-1]] for y in range(5)]
 
 
 def notation_to_pos(s: str) -> Pos:
     return Pos(4 - (ord(s[0]) - 97), int(s[1]) - 1)
 
 
+def pos_to_notation(p: Pos) -> str:
+    return f"{chr(97 + 4 - p.x)}{p.y + 1}"
+
+
 def get_card_from_name(name: str) -> Card:
-    return next(filter(lambda x: x.name == name, ALL_BASE_CARDS))
+    return CARDS_BY_NAME[name]
 
 
 def get_cards_from_names(names: List[str]) -> List[Card]:
-    cards: List[Card] = []
-    for name in names:
-        cards.append(get_card_from_name(name))
-    return cards
+    return [CARDS_BY_NAME[name] for name in names]
+
+
+# Matches store the board as 10 bytes, the blue, red and masters masks from bitboard.py with 25 bits each, and the
+# moves as an array of 2 byte binary values, the card id (cards.CARD_IDS) and the from and to squares with 5 bits
+# each, so a move is a single $push. Matches saved before that have the board string and a list of "card:a1a2"
+# strings, which later moves are pushed onto. The stored_* functions read both. Clients are always sent the string
+# formats.
+
+StoredMoves = List[Union[str, bytes]]
+
+
+def bitboard_to_bytes(bb: BitBoard) -> bytes:
+    return (bb.blue | bb.red << 25 | bb.masters << 50).to_bytes(10, "little")
+
+
+def bytes_to_bitboard(data: bytes) -> BitBoard:
+    n = int.from_bytes(data, "little")
+    return BitBoard(n & 0x1FFFFFF, n >> 25 & 0x1FFFFFF, n >> 50 & 0x1FFFFFF)
+
+
+def board_str_to_bytes(s: str) -> bytes:
+    return bitboard_to_bytes(bitboard.from_str(s))
+
+
+def bytes_to_board_str(data: bytes) -> str:
+    return bitboard.to_str(bytes_to_bitboard(data))
+
+
+_SQUARE_NOTATION: List[str] = [pos_to_notation(bitboard.square_to_pos(sq)) for sq in range(25)]
+
+
+def squares_to_move_str(card_name: str, from_sq: int, to_sq: int) -> str:
+    return f"{card_name}:{_SQUARE_NOTATION[from_sq]}{_SQUARE_NOTATION[to_sq]}"
+
+
+def move_str_to_bytes(move: str) -> bytes:
+    # "card:a1a2"
+    card_name, squares = move.split(":")
+    from_sq = bitboard.square(notation_to_pos(squares[:2]))
+    to_sq = bitboard.square(notation_to_pos(squares[2:]))
+    return (CARD_IDS[card_name] << 10 | from_sq << 5 | to_sq).to_bytes(2, "big")
+
+
+# Decoded moves by their 2 byte value, filled as they are seen. There are at most 32 * 25 * 25 of them.
+_move_strs: Dict[int, str] = {}
+
+
+def _move_str(n: int) -> str:
+    move = _move_strs.get(n)
+    if move is None:
+        move = f"{CARDS_BY_ID[n >> 10].name}:{_SQUARE_NOTATION[n >> 5 & 31]}{_SQUARE_NOTATION[n & 31]}"
+        _move_strs[n] = move
+    return move
+
+
+def bytes_to_move_strs(data: bytes) -> List[str]:
+    return [_move_str(n) for n in struct.unpack(f">{len(data) // 2}H", data)]
+
+
+def stored_bitboard(board: Union[str, bytes]) -> BitBoard:
+    return bitboard.from_str(board) if isinstance(board, str) else bytes_to_bitboard(board)
+
+
+def stored_board_str(board: Union[str, bytes]) -> str:
+    return board if isinstance(board, str) else bytes_to_board_str(board)
+
+
+def stored_moves_bytes(moves: StoredMoves) -> bytes:
+    # All the moves packed together, 2 bytes each.
+    return b"".join(move if isinstance(move, bytes) else move_str_to_bytes(move) for move in moves)
+
+
+def stored_move_strs(moves: StoredMoves) -> List[str]:
+    return [move if isinstance(move, str) else _move_str(int.from_bytes(move, "big")) for move in moves]
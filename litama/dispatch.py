@@ -0,0 +1,130 @@
+import json
+import time
+from typing import Any, Dict, List, Optional, Type
+
+from bson import ObjectId
+
+from commands.ai import Ai
+from commands.book import Book
+from commands.command import Command, MatchCollection
+from commands.create import Create
+from commands.deltas import Deltas
+from commands.flag import Flag
+from commands.history import History
+from commands.join import Join
+from commands.message import Message
+from commands.move import Move
+from commands.moves import Moves
+from commands.spectate import Spectate
+from commands.state import State
+from match_cache import MatchCache
+from metrics import COMMAND_SECONDS, REJECTED
+
+# Shared by the gevent server (server.py) and the asyncio one (async_server.py).
+commands: List[Type[Command]] = [Create, Join, State, Move, Moves, Spectate, Deltas, Ai, History, Book, Flag]
+# Every STARTS_WITH is a single word followed by a space, so the command is found by everything up to the first space.
+commands_by_prefix: Dict[str, Type[Command]] = {command.STARTS_WITH: command for command in commands}
+# Commands that take the match they act on as their first argument.
+match_commands: List[Type[Command]] = [Join, State, Move, Moves, Spectate, History, Flag]
+
+# batch ["state <id>", "state <id>", ...] runs several commands from one frame and replies with one message.
+BATCH_PREFIX = "batch "
+MAX_BATCH_SIZE = 100
+
+
+def dispatch(matches: MatchCollection, query: str) -> List[Message]:
+    start = time.perf_counter()
+    if query.startswith(BATCH_PREFIX):
+        name = "batch"
+        batch = parse_batch(query)
+        if batch is None:
+            REJECTED.inc("malformed")
+            messages = [Command.error_msg(f"Batch must be a JSON list of at most {MAX_BATCH_SIZE} commands", "batch")]
+        else:
+            messages = dispatch_batch(matches, batch)
+    else:
+        command = commands_by_prefix.get(query[:query.find(" ") + 1])
+        if command is None:
+            name = "invalid"
+            messages = [invalid_command(query)]
+        else:
+            name = command.__name__.lower()
+            args = query[len(command.STARTS_WITH):]
+            rejected = command.validate(args)
+            if rejected is None:
+                messages = command.apply_command(matches, args)
+            else:
+                REJECTED.inc("malformed")
+                messages = [rejected]
+    COMMAND_SECONDS.observe(time.perf_counter() - start, name)
+    return messages
+
+
+def invalid_command(query: str) -> Message:
+    REJECTED.inc("unknown_command")
+    return Command.error_msg("Invalid command sent", query)
+
+
+def validate(query: str) -> Optional[Message]:
+    # The error dispatch would reply with without reading any match, for checking commands before forwarding them.
+    # Batches are checked command by command when they are dispatched.
+    if query.startswith(BATCH_PREFIX):
+        return None
+    command = commands_by_prefix.get(query[:query.find(" ") + 1])
+    if command is None:
+        return invalid_command(query)
+    rejected = command.validate(query[len(command.STARTS_WITH):])
+    if rejected is not None:
+        REJECTED.inc("malformed")
+    return rejected
+
+
+def parse_batch(query: str) -> Optional[List[str]]:
+    try:
+        batch = json.loads(query[len(BATCH_PREFIX):])
+    except ValueError:
+        return None
+    if not isinstance(batch, list) or len(batch) > MAX_BATCH_SIZE or not all(isinstance(q, str) for q in batch):
+        return None
+    return batch
+
+
+def dispatch_batch(matches: MatchCollection, batch: List[str], indices: Optional[List[int]] = None) -> List[Message]:
+    # The reply has the messages each command sent to the sender, in order: {"messageType": "batch",
+    # "replies": [[...], ...]}. indices is set when this is part of a batch split between workers, and tells the
+    # client where the replies go in the batch it sent. Broadcasts are sent as usual.
+    if isinstance(matches, MatchCache):
+        # Loads every match the batch needs that isn't cached with one query.
+        match_ids = [target_match(query) for query in batch if not query.startswith(BATCH_PREFIX)]
+        matches.preload([ObjectId(match_id) for match_id in match_ids if match_id and ObjectId.is_valid(match_id)])
+
+    replies: List[List[Message]] = []
+    messages: List[Message] = []
+    for query in batch:
+        if query.startswith(BATCH_PREFIX):
+            results = [Command.error_msg("Batches can't be nested", "batch")]
+        else:
+            results = dispatch(matches, query)
+        replies.append([message for message in results if message.reply_to_only_sender])
+        for message in results:
+            # Replies are sent as part of the batch reply, but their flags still apply to the sender.
+            message.batched = message.reply_to_only_sender
+        messages.extend(results)
+
+    reply: Dict[str, Any] = {"messageType": "batch", "replies": [[m.message for m in r] for r in replies]}
+    # Built from the encoded replies, so cached state messages aren't encoded again.
+    encoded_replies = ",".join("[" + ",".join(m.to_json() for m in r) + "]" for r in replies)
+    encoded = '{"messageType":"batch",'
+    if indices is not None:
+        reply["indices"] = indices
+        encoded += f'"indices":{json.dumps(indices)},'
+    encoded += f'"replies":[{encoded_replies}]}}'
+    return [Message(reply, True, "", encoded=encoded)] + messages
+
+
+def target_match(query: str) -> Optional[str]:
+    # The match id a command acts on, or None for commands that don't act on an existing match.
+    for command in match_commands:
+        if command.command_matches(query):
+            return query[len(command.STARTS_WITH):].split(" ", 1)[0]
+    return None
@@ -0,0 +1,268 @@
+import random
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from bitboard import BitBoard, CARD_TARGETS, BLUE_TEMPLE, RED_TEMPLE, from_str, iter_squares, winner
+from cards import ALL_CARDS
+from structures import Player
+from tablebase import probe, tablebases
+
+# Scores are from the point of view of the side to move.
+WIN = 1_000_000
+# Anything above this is a forced win, with the distance to it folded into the score.
+WIN_THRESHOLD = WIN - 1000
+STUDENT_VALUE = 100
+
+EXACT, LOWER, UPPER = 0, 1, 2
+TT_MAX_SIZE = 1 << 20
+
+# (from square, to square, card name)
+EngineMove = Tuple[int, int, str]
+# Blue hand, red hand, side card
+Hands = Tuple[Tuple[str, str], Tuple[str, str], str]
+
+# Zobrist keys. Seeded so that hashes are stable between processes and runs.
+_rng = random.Random(0x4C6974616D61)
+# PIECE_KEYS[color][is master][square]
+PIECE_KEYS: Dict[Player, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {
+    color: (tuple(_rng.getrandbits(64) for _ in range(25)), tuple(_rng.getrandbits(64) for _ in range(25)))
+    for color in (Player.BLUE, Player.RED)
+}
+# CARD_KEYS[card name][holder], holder being Player.BLUE, Player.RED or Player.NONE for the side card.
+CARD_KEYS: Dict[str, Dict[Player, int]] = {
+    card.name: {holder: _rng.getrandbits(64) for holder in (Player.BLUE, Player.RED, Player.NONE)}
+    for card in ALL_CARDS
+}
+RED_TO_MOVE_KEY = _rng.getrandbits(64)
+
+# Distance of each square to each temple, used to pull masters forward.
+_TEMPLE_DISTANCE: Dict[Player, Tuple[int, ...]] = {
+    Player.BLUE: tuple(abs(sq // 5 - 4) + abs(sq % 5 - 2) for sq in range(25)),
+    Player.RED: tuple(sq // 5 + abs(sq % 5 - 2) for sq in range(25)),
+}
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult(NamedTuple):
+    move: Optional[EngineMove]
+    score: int
+    depth: int
+    nodes: int
+    elapsed: float
+
+
+def enemy_of(color: Player) -> Player:
+    return Player.RED if color == Player.BLUE else Player.BLUE
+
+
+def zobrist_hash(bb: BitBoard, hands: Hands, turn: Player) -> int:
+    key = 0
+    for color, pieces in ((Player.BLUE, bb.blue), (Player.RED, bb.red)):
+        for sq in iter_squares(pieces):
+            key ^= PIECE_KEYS[color][1 if bb.masters >> sq & 1 else 0][sq]
+    for name in hands[0]:
+        key ^= CARD_KEYS[name][Player.BLUE]
+    for name in hands[1]:
+        key ^= CARD_KEYS[name][Player.RED]
+    key ^= CARD_KEYS[hands[2]][Player.NONE]
+    if turn == Player.RED:
+        key ^= RED_TO_MOVE_KEY
+    return key
+
+
+def play(bb: BitBoard, hands: Hands, turn: Player, key: int,
+         move: EngineMove) -> Tuple[BitBoard, Hands, int]:
+    # Applies a move known to be legal and returns the new board, hands and hash.
+    # The used card goes to the side and the side card takes its place in the mover's hand.
+    from_sq, to_sq, name = move
+    from_bit = 1 << from_sq
+    to_bit = 1 << to_sq
+    enemy = enemy_of(turn)
+    is_master = 1 if bb.masters & from_bit else 0
+
+    key ^= PIECE_KEYS[turn][is_master][from_sq] ^ PIECE_KEYS[turn][is_master][to_sq]
+    if (bb.red if turn == Player.BLUE else bb.blue) & to_bit:
+        key ^= PIECE_KEYS[enemy][1 if bb.masters & to_bit else 0][to_sq]
+
+    blue = bb.blue & ~to_bit
+    red = bb.red & ~to_bit
+    masters = bb.masters & ~to_bit
+    if turn == Player.BLUE:
+        blue ^= from_bit | to_bit
+    else:
+        red ^= from_bit | to_bit
+    if is_master:
+        masters ^= from_bit | to_bit
+
+    blue_hand, red_hand, side = hands
+    key ^= CARD_KEYS[name][turn] ^ CARD_KEYS[name][Player.NONE]
+    key ^= CARD_KEYS[side][Player.NONE] ^ CARD_KEYS[side][turn]
+    key ^= RED_TO_MOVE_KEY
+    if turn == Player.BLUE:
+        blue_hand = (side, blue_hand[1]) if blue_hand[0] == name else (blue_hand[0], side)
+    else:
+        red_hand = (side, red_hand[1]) if red_hand[0] == name else (red_hand[0], side)
+
+    return BitBoard(blue, red, masters), (blue_hand, red_hand, name), key
+
+
+def legal_moves(bb: BitBoard, hands: Hands, turn: Player) -> List[EngineMove]:
+    own = bb.blue if turn == Player.BLUE else bb.red
+    pieces = iter_squares(own)
+    moves: List[EngineMove] = []
+    for name in hands[0] if turn == Player.BLUE else hands[1]:
+        targets = CARD_TARGETS[name][turn]
+        for sq in pieces:
+            for target in iter_squares(targets[sq] & ~own):
+                moves.append((sq, target, name))
+    return moves
+
+
+def evaluate(bb: BitBoard, turn: Player) -> int:
+    blue_students = bin(bb.blue & ~bb.masters).count("1")
+    red_students = bin(bb.red & ~bb.masters).count("1")
+    score = (blue_students - red_students) * STUDENT_VALUE
+    blue_master = bb.blue & bb.masters
+    red_master = bb.red & bb.masters
+    if blue_master:
+        score -= _TEMPLE_DISTANCE[Player.BLUE][blue_master.bit_length() - 1] * 5
+    if red_master:
+        score += _TEMPLE_DISTANCE[Player.RED][red_master.bit_length() - 1] * 5
+    return score if turn == Player.BLUE else -score
+
+
+class Searcher:
+    def __init__(self, deadline: float, tt: Dict[int, Tuple[int, int, int, Optional[EngineMove]]]) -> None:
+        self.deadline = deadline
+        self.tt = tt
+        self.nodes = 0
+
+    def negamax(self, bb: BitBoard, hands: Hands, turn: Player, key: int,
+                depth: int, alpha: int, beta: int, ply: int) -> Tuple[int, Optional[EngineMove]]:
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+        # The previous move can only have won the game for the side that made it.
+        if winner(bb) != Player.NONE:
+            return -(WIN - ply), None
+        # Endgames in a tablebase are known exactly. Not at the root, which has to return a move.
+        if ply and tablebases:
+            distance = probe(bb, hands, turn)
+            if distance is not None:
+                if distance > 0:
+                    return WIN - (ply + distance), None
+                if distance < 0:
+                    return -(WIN - (ply - distance)), None
+                return 0, None
+        if depth == 0:
+            return evaluate(bb, turn), None
+
+        original_alpha = alpha
+        tt_move: Optional[EngineMove] = None
+        entry = self.tt.get(key)
+        if entry is not None:
+            tt_depth, tt_score, tt_flag, tt_move = entry
+            if tt_depth >= depth:
+                # Mate scores are stored relative to the node, see below.
+                if tt_score > WIN_THRESHOLD:
+                    tt_score -= ply
+                elif tt_score < -WIN_THRESHOLD:
+                    tt_score += ply
+                if tt_flag == EXACT:
+                    return tt_score, tt_move
+                if tt_flag == LOWER and tt_score > alpha:
+                    alpha = tt_score
+                elif tt_flag == UPPER and tt_score < beta:
+                    beta = tt_score
+                if alpha >= beta:
+                    return tt_score, tt_move
+
+        moves = self.order(bb, turn, legal_moves(bb, hands, turn), tt_move)
+        if not moves:
+            # A draw, see bitboard.NO_MOVES_WINNER.
+            return 0, None
+
+        best_score = -WIN - 1
+        best_move: Optional[EngineMove] = None
+        for move in moves:
+            child_bb, child_hands, child_key = play(bb, hands, turn, key, move)
+            score = -self.negamax(child_bb, child_hands, enemy_of(turn), child_key,
+                                  depth - 1, -beta, -alpha, ply + 1)[0]
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        stored = best_score
+        if stored > WIN_THRESHOLD:
+            stored += ply
+        elif stored < -WIN_THRESHOLD:
+            stored -= ply
+        if len(self.tt) >= TT_MAX_SIZE:
+            self.tt.clear()
+        self.tt[key] = (depth, stored, flag, best_move)
+        return best_score, best_move
+
+    @staticmethod
+    def order(bb: BitBoard, turn: Player, moves: List[EngineMove],
+              tt_move: Optional[EngineMove]) -> List[EngineMove]:
+        # Best move from the transposition table and moves into the temple, then master captures,
+        # then other captures.
+        enemy = bb.red if turn == Player.BLUE else bb.blue
+        temple = RED_TEMPLE if turn == Player.BLUE else BLUE_TEMPLE
+
+        def rank(move: EngineMove) -> int:
+            to_bit = 1 << move[1]
+            if move == tt_move or (bb.masters & (1 << move[0]) and temple & to_bit):
+                return 0
+            if enemy & to_bit:
+                return 1 if bb.masters & to_bit else 2
+            return 3
+
+        return sorted(moves, key=rank)
+
+
+_transposition_table: Dict[int, Tuple[int, int, int, Optional[EngineMove]]] = {}
+
+
+def search(bb: BitBoard, hands: Hands, turn: Player, time_limit: float, max_depth: int = 64) -> SearchResult:
+    # Iterative deepening negamax. Returns the best move of the deepest search that finished in time.
+    start = time.monotonic()
+    searcher = Searcher(start + time_limit, _transposition_table)
+    key = zobrist_hash(bb, hands, turn)
+    result = SearchResult(None, 0, 0, 0, 0.0)
+    # Every position after a move from one in a tablebase is in it too, so depth 1 already has the exact result.
+    in_tablebase = bool(tablebases) and probe(bb, hands, turn) is not None
+    for depth in range(1, max_depth + 1):
+        try:
+            score, move = searcher.negamax(bb, hands, turn, key, depth, -WIN - 1, WIN + 1, 0)
+        except SearchTimeout:
+            break
+        result = SearchResult(move, score, depth, searcher.nodes, time.monotonic() - start)
+        # No point searching deeper once a forced result is known.
+        if abs(score) > WIN_THRESHOLD or in_tablebase:
+            break
+    if result.move is None:
+        moves = legal_moves(bb, hands, turn)
+        if moves:
+            result = result._replace(move=moves[0])
+    return result._replace(nodes=searcher.nodes, elapsed=time.monotonic() - start)
+
+
+def search_match(board: str, cards: Dict[str, Any], turn: str, time_limit: float) -> SearchResult:
+    # Entry point for the process pool, takes the fields as they are stored in a match.
+    hands: Hands = ((cards["blue"][0], cards["blue"][1]), (cards["red"][0], cards["red"][1]), cards["side"])
+    return search(from_str(board), hands, Player(turn), time_limit)
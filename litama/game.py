@@ -1,24 +1,26 @@
 import random
 from typing import List, Tuple, Optional
 
+import bitboard
 from cards import ALL_BASE_CARDS
 from structures import Piece, Pos, Card, Player
 
 Board = List[List[Piece]]
 
 
-def init_game() -> Tuple[Board, List[Card], List[Card], Card]:
+def init_game(rng: Optional[random.Random] = None) -> Tuple[Board, List[Card], List[Card], Card]:
+    # rng makes the deal reproducible, e.g. for tournaments.
     board: Board = [[Piece(False, Player.NONE) for _ in range(5)] for _ in range(5)]
 
     for x, y in [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0)]:
-        board[y][x].color = Player.BLUE
-    board[0][2].is_master = True
+        board[y][x] = Piece(False, Player.BLUE)
+    board[0][2] = Piece(True, Player.BLUE)
 
     for x, y in [(0, 4), (1, 4), (2, 4), (3, 4), (4, 4)]:
-        board[y][x].color = Player.RED
-    board[4][2].is_master = True
+        board[y][x] = Piece(False, Player.RED)
+    board[4][2] = Piece(True, Player.RED)
 
-    random_cards = random.sample(ALL_BASE_CARDS, 5)
+    random_cards = (rng or random).sample(ALL_BASE_CARDS, 5)
     blue_cards = random_cards[:2]
     red_cards = random_cards[2:4]
     side_card = random_cards[4]
@@ -51,13 +53,8 @@ def print_game(b: Board, blue_cards: List[Card], red_cards: List[Card], side_car
 
 
 def clone_board(board: Board) -> Board:
-    new_board: Board = []
-    for y in board:
-        new_board.append([])
-        for x in y:
-            new_board[-1].append(Piece(x.is_master, x.color))
-
-    return new_board
+    # Pieces are immutable and shared, so only the rows need copying.
+    return [row[:] for row in board]
 
 
 def generate_moves_for_piece(piece_pos: Pos, cards: List[Card], b: Board) -> List[Tuple[Pos, Card]]:
@@ -65,20 +62,14 @@ def generate_moves_for_piece(piece_pos: Pos, cards: List[Card], b: Board) -> Lis
     moves: List[Tuple[Pos, Card]] = []
     # Each element in moves is a tuple.
     # The tuple contains the position that the move would lead to and the card used for that move.
+    if piece.color == Player.NONE:
+        return moves
 
+    sq = piece_pos.y * 5 + piece_pos.x
     for card in cards:
-        for move in card.moves:
-            # Account for card rotation on both sides
-            # On blue side, negative X goes right
-            # On red side, negative Y goes up
-            x = (-move.x if piece.color == Player.BLUE else move.x) + piece_pos.x
-            y = (-move.y if piece.color == Player.RED else move.y) + piece_pos.y
-            if 0 > x or x > 4 or 0 > y or y > 4:
-                continue
-            if b[y][x].color != Player.NONE and b[y][x].color == piece.color:
-                continue
-
-            moves.append((Pos(x, y), card))
+        for pos in card.destinations[piece.color][sq]:
+            if b[pos.y][pos.x].color != piece.color:
+                moves.append((pos, card))
 
     return moves
 
@@ -86,33 +77,18 @@ def generate_moves_for_piece(piece_pos: Pos, cards: List[Card], b: Board) -> Lis
 def apply_move(piece_pos: Pos,
                move_pos: Pos, move_card: Card,
                cards: List[Card], b: Board) -> Optional[Board]:
-    generated_moves = generate_moves_for_piece(piece_pos, cards, b)
-    if (move_pos, move_card) not in generated_moves:
+    piece: Piece = b[piece_pos.y][piece_pos.x]
+    if piece.color == Player.NONE or move_card not in cards:
+        return None
+    if move_pos not in move_card.destinations[piece.color][piece_pos.y * 5 + piece_pos.x]:
+        return None
+    if b[move_pos.y][move_pos.x].color == piece.color:
         return None
     cloned: Board = clone_board(b)
-    cloned[move_pos.y][move_pos.x].color = cloned[piece_pos.y][piece_pos.x].color
-    cloned[move_pos.y][move_pos.x].is_master = cloned[piece_pos.y][piece_pos.x].is_master
-    cloned[piece_pos.y][piece_pos.x].color = Player.NONE
+    cloned[move_pos.y][move_pos.x] = piece
+    cloned[piece_pos.y][piece_pos.x] = Piece(False, Player.NONE)
     return cloned
 
 
 def check_win_condition(b: Board) -> Player:
-    blue_master_exists = False
-    red_master_exists = False
-    for row in b:
-        for piece in row:
-            if piece.is_master and piece.color == Player.BLUE:
-                blue_master_exists = True
-            if piece.is_master and piece.color == Player.RED:
-                red_master_exists = True
-    if not blue_master_exists:
-        return Player.RED
-    if not red_master_exists:
-        return Player.BLUE
-
-    if b[0][2].is_master and b[0][2].color == Player.RED:
-        return Player.RED
-    if b[4][2].is_master and b[4][2].color == Player.BLUE:
-        return Player.BLUE
-
-    return Player.NONE
+    return bitboard.winner(bitboard.from_board(b))
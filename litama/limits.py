@@ -0,0 +1,41 @@
+# Limits on what a single connection can send, checked for every frame before it is dispatched.
+import time
+from typing import Optional
+
+from commands.command import Command
+from commands.message import Message
+from metrics import REJECTED
+
+
+class TokenBucket:
+    # Allows bursts of up to burst frames, refilled at rate frames per second. A rate of 0 allows everything.
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def take(self) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def admit(query: str, bucket: TokenBucket, max_length: int) -> Optional[Message]:
+    # The error to reply with if the frame is rejected, None if it can be dispatched.
+    if len(query) > max_length:
+        REJECTED.inc("too_large")
+        # Only the start of the frame is echoed back, the rest could be anything.
+        return Command.error_msg(f"Frames can be at most {max_length} characters", query[:16].split(" ", 1)[0])
+    if not bucket.take():
+        REJECTED.inc("rate_limited")
+        return Command.error_msg("Too many commands, slow down", query[:16].split(" ", 1)[0])
+    return None
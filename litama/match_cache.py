@@ -0,0 +1,231 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.collection import Collection
+
+from memory_collection import Document, InsertResult, MemoryCollection, apply_update, is_update, matches_filter, \
+    project
+from metrics import STORE_SECONDS
+from structures import GameState
+
+
+class CachedMatch:
+    __slots__ = ("doc", "fields", "changed", "dirty", "last_access", "payloads")
+
+    def __init__(self, doc: Document, fields: Optional[Set[str]], dirty: bool, now: float) -> None:
+        self.doc = doc
+        # The top level fields of doc that were loaded or set, None if doc is the whole match. Partial matches are
+        # written back with a $set of the fields in changed instead of being replaced.
+        self.fields = fields
+        self.changed: Set[str] = set()
+        self.dirty = dirty
+        self.last_access = now
+        # Values derived from doc (e.g. the encoded state message), cleared on every update.
+        self.payloads: Dict[str, Any] = {}
+
+
+class MatchCache:
+    # Authoritative in-process copy of live matches. Reads and writes from the commands are served
+    # from memory and changed matches are written back to MongoDB in batches by flush().
+    # With load_fields, a miss only reads the fields of the projection asked for and of load_fields, and the fields
+    # a later command needs on top are read then. load_fields are the ones most commands go on to need, so that
+    # they don't read the match twice. Without it, matches are always read whole.
+    def __init__(self, matches: Union["Collection[Document]", MemoryCollection],
+                 max_size: int = 10000,
+                 idle_ttl: float = 30 * 60,
+                 ended_ttl: float = 60,
+                 batch_size: int = 500,
+                 new_id: Callable[[], ObjectId] = ObjectId,
+                 load_fields: Optional[Dict[str, int]] = None) -> None:
+        self.matches = matches
+        self.load_fields = load_fields
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.ended_ttl = ended_ttl
+        self.batch_size = batch_size
+        # Makes the _id of inserted matches.
+        self.new_id = new_id
+        self._entries: "OrderedDict[ObjectId, CachedMatch]" = OrderedDict()
+        self._dirty: Set[ObjectId] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _fields(self, query: Document, projection: Optional[Dict[str, int]]) -> Optional[Set[str]]:
+        # The top level fields a call needs loaded, None for the whole match.
+        if projection is None or self.load_fields is None:
+            return None
+        return {*projection, *self.load_fields, *query} - {"_id"}
+
+    def _read(self, match_id: Any, fields: Optional[Set[str]]) -> Optional[Document]:
+        start = time.perf_counter()
+        doc = self.matches.find_one({"_id": match_id}, None if fields is None else dict.fromkeys(fields, 1))
+        STORE_SECONDS.observe(time.perf_counter() - start, "find_one")
+        return doc
+
+    def _get(self, match_id: Any, fields: Optional[Set[str]]) -> Optional[CachedMatch]:
+        entry = self._entries.get(match_id)
+        if entry is None:
+            doc = self._read(match_id, fields)
+            if doc is None:
+                return None
+            entry = CachedMatch(doc, fields, False, time.monotonic())
+            self._entries[match_id] = entry
+            return entry
+
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(match_id)
+        if entry.fields is not None and (fields is None or not fields <= entry.fields):
+            # Reads the fields that are missing. Fields that were loaded or set already are newer than what is
+            # stored, so they are kept.
+            missing = None if fields is None else fields - entry.fields
+            doc = self._read(match_id, missing) or {}
+            for key, value in doc.items():
+                if key not in entry.fields:
+                    entry.doc[key] = value
+            if missing is None:
+                entry.fields = None
+            else:
+                entry.fields |= missing
+        return entry
+
+    def preload(self, match_ids: List[ObjectId]) -> None:
+        # Loads the given matches that aren't cached yet with a single query.
+        missing = [match_id for match_id in set(match_ids) if match_id not in self._entries]
+        if not missing:
+            return
+        start = time.perf_counter()
+        docs = list(self.matches.find({"_id": {"$in": missing}}))
+        STORE_SECONDS.observe(time.perf_counter() - start, "find")
+        now = time.monotonic()
+        for doc in docs:
+            self._entries[doc["_id"]] = CachedMatch(doc, None, False, now)
+
+    def find_one(self, query: Document, projection: Optional[Dict[str, int]] = None) -> Optional[Document]:
+        # The fields returned are the cached values themselves, not copies.
+        entry = self._get(query["_id"], self._fields(query, projection))
+        if entry is None or not matches_filter(entry.doc, query):
+            return None
+        return project(entry.doc, projection)
+
+    def insert_one(self, document: Document) -> InsertResult:
+        if "_id" not in document:
+            document["_id"] = self.new_id()
+        match_id = document["_id"]
+        self._entries[match_id] = CachedMatch(document, None, True, time.monotonic())
+        self._dirty.add(match_id)
+        return InsertResult(match_id)
+
+    def find_one_and_update(self, query: Document, update: Document, projection: Optional[Dict[str, int]] = None,
+                            return_document: bool = False) -> Optional[Document]:
+        # return_document follows pymongo's ReturnDocument: False (BEFORE) or True (AFTER). projection is applied
+        # like in find_one.
+        fields = self._fields(query, projection)
+        if fields is not None:
+            # Fields the update changes part of have to be loaded first, fields it sets as a whole don't.
+            fields |= {
+                path.split(".", 1)[0] for operator, changes in update.items() for path in changes
+                if operator != "$set" or "." in path
+            }
+        entry = self._get(query["_id"], fields)
+        if entry is None or not matches_filter(entry.doc, query):
+            return None
+        before = None if return_document else copy.deepcopy(entry.doc)
+        apply_update(entry.doc, update)
+        if entry.fields is not None:
+            changed = {path.split(".", 1)[0] for changes in update.values() for path in changes}
+            entry.fields |= changed
+            entry.changed |= changed
+        entry.payloads.clear()
+        entry.dirty = True
+        self._dirty.add(query["_id"])
+        return project(entry.doc if before is None else before, projection)
+
+    def payload(self, match_id: ObjectId, key: str) -> Any:
+        entry = self._entries.get(match_id)
+        return None if entry is None else entry.payloads.get(key)
+
+    def set_payload(self, match_id: ObjectId, key: str, value: Any) -> None:
+        entry = self._entries.get(match_id)
+        if entry is not None:
+            entry.payloads[key] = value
+
+    def flush(self) -> int:
+        # Returns the number of matches written.
+        written = 0
+        while self._dirty:
+            batch_ids: List[ObjectId] = []
+            # (filter, whole match or update) pairs.
+            batch: List[Tuple[Document, Document]] = []
+            while self._dirty and len(batch) < self.batch_size:
+                match_id = self._dirty.pop()
+                entry = self._entries.get(match_id)
+                if entry is None:
+                    continue
+                entry.dirty = False
+                batch_ids.append(match_id)
+                # Copy so that the write isn't affected by moves made while it is in flight.
+                if entry.fields is None:
+                    batch.append(({"_id": match_id}, copy.deepcopy(entry.doc)))
+                else:
+                    batch.append(({"_id": match_id}, self._changes(entry)))
+            if not batch:
+                continue
+            try:
+                start = time.perf_counter()
+                if isinstance(self.matches, MemoryCollection):
+                    self.matches.write_many(batch)
+                else:
+                    self.matches.bulk_write([
+                        UpdateOne(query, doc) if is_update(doc) else ReplaceOne(query, doc, upsert=True)
+                        for query, doc in batch
+                    ], ordered=False)
+                STORE_SECONDS.observe(time.perf_counter() - start, "bulk_write")
+            except BaseException:
+                # Keep the batch for the next flush, including when the flusher gets killed mid-write.
+                for (_, doc), match_id in zip(batch, batch_ids):
+                    failed = self._entries.get(match_id)
+                    if failed is not None:
+                        failed.dirty = True
+                        if is_update(doc):
+                            failed.changed.update(*doc.values())
+                self._dirty.update(batch_ids)
+                raise
+            written += len(batch)
+        return written
+
+    @staticmethod
+    def _changes(entry: CachedMatch) -> Document:
+        # The update that writes back the changed fields of a partial match.
+        update: Document = {
+            "$set": {key: copy.deepcopy(entry.doc[key]) for key in entry.changed if key in entry.doc},
+            "$unset": {key: "" for key in entry.changed if key not in entry.doc}
+        }
+        entry.changed = set()
+        return {operator: fields for operator, fields in update.items() if fields}
+
+    def evict(self) -> int:
+        # Drops clean matches that ended or went idle, then the least recently used ones over max_size.
+        # Dirty matches are kept until the next flush so nothing is lost.
+        now = time.monotonic()
+        evicted = [
+            match_id for match_id, entry in self._entries.items()
+            if not entry.dirty and (
+                now - entry.last_access > self.idle_ttl
+                or (entry.doc.get("gameState") == GameState.ENDED.value
+                    and now - entry.last_access > self.ended_ttl)
+            )
+        ]
+        for match_id in evicted:
+            del self._entries[match_id]
+
+        overflow = len(self._entries) - self.max_size
+        if overflow > 0:
+            for match_id in [match_id for match_id, entry in self._entries.items() if not entry.dirty][:overflow]:
+                del self._entries[match_id]
+                evicted.append(match_id)
+        return len(evicted)
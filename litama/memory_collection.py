@@ -0,0 +1,144 @@
+import copy
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+Document = Dict[str, Any]
+
+# Seconds between deletions of expired documents, like the TTL monitor of mongod.
+TTL_SWEEP_INTERVAL = 60.0
+
+
+class InsertResult:
+    # Stand-in for pymongo's InsertOneResult, only inserted_id is used by the commands.
+    def __init__(self, inserted_id: ObjectId) -> None:
+        self.inserted_id = inserted_id
+
+
+def matches_filter(doc: Document, query: Document) -> bool:
+    # Only equality and $in on top level fields, which is all the commands filter on.
+    for key, value in query.items():
+        if isinstance(value, dict) and "$in" in value:
+            if doc.get(key) not in value["$in"]:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+def project(doc: Document, projection: Optional[Dict[str, int]]) -> Document:
+    # Only including top level fields is supported.
+    if projection is None:
+        return doc
+    return {key: value for key, value in doc.items() if key == "_id" or key in projection}
+
+
+def is_update(doc: Document) -> bool:
+    # Whether doc is an update, like {"$set": ...}, rather than a whole document.
+    return any(key.startswith("$") for key in doc)
+
+
+def apply_update(doc: Document, update: Document) -> None:
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            *parents, key = path.split(".")
+            target = doc
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            if operator == "$set":
+                target[key] = value
+            elif operator == "$unset":
+                target.pop(key, None)
+            elif operator == "$inc":
+                target[key] = target.get(key, 0) + value
+            elif operator == "$push":
+                target.setdefault(key, []).append(value)
+            else:
+                raise ValueError(f"Unsupported update operator {operator}")
+
+
+class MemoryCollection:
+    # Local stand-in for the matches collection, used when running without MongoDB and by the benchmarks.
+    # Documents are copied in and out like they would be by a round trip through BSON, and every call is counted.
+    def __init__(self) -> None:
+        self.docs: Dict[ObjectId, Document] = {}
+        self.calls = 0
+        # Field -> seconds, for the indexes created with expireAfterSeconds.
+        self.ttl_indexes: Dict[str, float] = {}
+        self.last_sweep = time.monotonic()
+
+    def create_index(self, key: str, expireAfterSeconds: Optional[float] = None) -> str:
+        # Lookups are by _id only, so the only index that changes anything here is a TTL one.
+        if expireAfterSeconds is not None:
+            self.ttl_indexes[key] = expireAfterSeconds
+        return f"{key}_1"
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        # Deletes the documents whose TTL indexed field is a time at least that index's seconds ago.
+        # Returns the number deleted.
+        now = now or datetime.utcnow()
+        expired = [
+            match_id for match_id, doc in self.docs.items()
+            if any(isinstance(doc.get(key), datetime) and doc[key] + timedelta(seconds=seconds) <= now
+                   for key, seconds in self.ttl_indexes.items())
+        ]
+        for match_id in expired:
+            del self.docs[match_id]
+        return len(expired)
+
+    def _sweep(self) -> None:
+        if self.ttl_indexes and time.monotonic() - self.last_sweep >= TTL_SWEEP_INTERVAL:
+            self.last_sweep = time.monotonic()
+            self.expire()
+
+    def find_one(self, query: Document, projection: Optional[Dict[str, int]] = None) -> Optional[Document]:
+        self.calls += 1
+        doc = self.docs.get(query["_id"])
+        if doc is None or not matches_filter(doc, query):
+            return None
+        return copy.deepcopy(project(doc, projection))
+
+    def find(self, query: Document, projection: Optional[Dict[str, int]] = None,
+             batch_size: int = 0) -> List[Document]:
+        # batch_size has no effect here.
+        self.calls += 1
+        return [copy.deepcopy(project(doc, projection)) for doc in self.docs.values() if matches_filter(doc, query)]
+
+    def insert_one(self, document: Document) -> InsertResult:
+        self.calls += 1
+        self._sweep()
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        self.docs[document["_id"]] = copy.deepcopy(document)
+        return InsertResult(document["_id"])
+
+    def insert_many(self, documents: List[Document], ordered: bool = True) -> None:
+        self.calls += 1
+        self._sweep()
+        for document in documents:
+            if "_id" not in document:
+                document["_id"] = ObjectId()
+            self.docs[document["_id"]] = copy.deepcopy(document)
+
+    def find_one_and_update(self, query: Document, update: Document, projection: Optional[Dict[str, int]] = None,
+                            return_document: bool = False) -> Optional[Document]:
+        self.calls += 1
+        doc = self.docs.get(query["_id"])
+        if doc is None or not matches_filter(doc, query):
+            return None
+        before = copy.deepcopy(project(doc, projection))
+        apply_update(doc, update)
+        return copy.deepcopy(project(doc, projection)) if return_document else before
+
+    def write_many(self, writes: List[Tuple[Document, Document]]) -> None:
+        # Each (filter, document) pair upserts the document, and each (filter, update) pair updates the document if
+        # it exists. MatchCache.flush sends these to MongoDB as ReplaceOne and UpdateOne requests.
+        self.calls += 1
+        self._sweep()
+        for query, document in writes:
+            if not is_update(document):
+                self.docs[query["_id"]] = copy.deepcopy(document)
+            elif query["_id"] in self.docs:
+                apply_update(self.docs[query["_id"]], copy.deepcopy(document))
@@ -0,0 +1,148 @@
+# Counters, gauges and histograms for the servers, rendered in the Prometheus text format at /metrics.
+# Recording is a dict lookup and a few additions, so it is cheap enough to do for every frame.
+import bisect
+import logging
+import queue
+import random
+import sys
+from abc import ABC, abstractmethod
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, List, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# Every metric, in the order they are rendered.
+registry: List["Metric"] = []
+
+
+class Metric(ABC):
+    TYPE = ""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        registry.append(self)
+
+    def label_str(self, labels: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.TYPE}"] + self.samples()
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self.label_str(labels)} {value}" for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self.label_str(labels)} {value}" for labels, value in self.values.items()]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+        # Per labels: the count of each bucket (not cumulative, the last one is +Inf), then the sum.
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def reset(self) -> None:
+        self.values.clear()
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self.values.items():
+            total = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self.label_str(labels, le)} {int(total)}")
+            lines.append(f"{self.name}_sum{self.label_str(labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{self.label_str(labels)} {int(total)}")
+        return lines
+
+
+# Called before rendering, for metrics that are computed from the server's state instead of being recorded.
+collectors: List[Callable[[], None]] = []
+
+
+def render() -> str:
+    for collect in collectors:
+        collect()
+    return "".join(metric.render() for metric in registry)
+
+
+COMMAND_SECONDS = Histogram("litama_command_seconds", "Time to run a command", ("command",))
+STORE_SECONDS = Histogram("litama_mongo_seconds", "Round trips to the matches collection", ("operation",))
+BROADCASTS = Histogram("litama_broadcast_recipients", "Clients a broadcast was sent to", buckets=COUNT_BUCKETS)
+BROADCAST_BYTES = Counter("litama_broadcast_bytes_total", "Bytes sent to clients by broadcasts")
+SOCKETS = Gauge("litama_sockets", "Connected WebSockets")
+REJECTED = Counter("litama_rejected_total", "Frames and commands rejected before they ran, by reason", ("reason",))
+MATCH_SOCKETS = Histogram("litama_match_sockets", "Sockets receiving the broadcasts of each match with any",
+                          buckets=COUNT_BUCKETS)
+
+
+# Logging goes through a queue to a thread that writes it, so a slow terminal or pipe never blocks a frame.
+logger = logging.getLogger("litama")
+
+
+def start_logging(level: str) -> QueueListener:
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    listener = QueueListener(records, handler)
+    logger.addHandler(QueueHandler(records))
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+def log_query(query: str, sample_rate: float) -> None:
+    # Received frames are logged at DEBUG, and only a sample_rate fraction of them.
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < sample_rate:
+        logger.debug("Received:`%s`", query)
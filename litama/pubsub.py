@@ -0,0 +1,231 @@
+import bisect
+import hashlib
+import sys
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Callable, Dict, List, Set, Tuple
+
+import gevent
+from gevent import socket
+from gevent.lock import Semaphore
+from gevent.queue import Queue
+from gevent.server import StreamServer
+
+from metrics import logger
+
+# Lets several server workers share match broadcasts and forward commands to the worker that owns a match.
+# InProcessPubSub is for a single worker. SocketPubSub connects every worker to a PubSubHub over TCP,
+# run it with: python pubsub.py [host:port]
+
+Callback = Callable[[str], None]
+
+# Seconds SocketPubSub waits before reconnecting to the hub, doubled after each failed attempt up to the maximum.
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 5.0
+
+
+class PubSub(ABC):
+    @abstractmethod
+    def publish(self, channel: str, payload: str) -> None:
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str, callback: Callback) -> None:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, channel: str) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessPubSub(PubSub):
+    # Callbacks run straight away, inside publish.
+    def __init__(self) -> None:
+        self._callbacks: Dict[str, Callback] = {}
+
+    def publish(self, channel: str, payload: str) -> None:
+        callback = self._callbacks.get(channel)
+        if callback is not None:
+            callback(payload)
+
+    def subscribe(self, channel: str, callback: Callback) -> None:
+        self._callbacks[channel] = callback
+
+    def unsubscribe(self, channel: str) -> None:
+        self._callbacks.pop(channel, None)
+
+
+# Wire format, in both directions: a header line and, for messages, the payload.
+#   SUB <channel>\n
+#   UNSUB <channel>\n
+#   PUB <channel> <payload length>\n<payload>  (worker to hub)
+#   MSG <channel> <payload length>\n<payload>  (hub to worker)
+# Frames from one connection are handled in order, so a SUB always takes effect before a later PUB.
+
+def read_frame(f: BinaryIO) -> Tuple[str, str, bytes]:
+    header = f.readline()
+    if not header:
+        raise EOFError()
+    parts = header.decode().split()
+    if parts[0] in ("PUB", "MSG"):
+        return parts[0], parts[1], f.read(int(parts[2]))
+    return parts[0], parts[1], b""
+
+
+def message_frame(kind: str, channel: str, payload: bytes) -> bytes:
+    return f"{kind} {channel} {len(payload)}\n".encode() + payload
+
+
+class SocketPubSub(PubSub):
+    # Callbacks run one at a time on their own greenlet, so a slow or failing one doesn't hold up reading from the
+    # hub. If the connection to the hub is lost, frames published until it is back are dropped, and every channel is
+    # subscribed to again once it is.
+    def __init__(self, address: Tuple[str, int]) -> None:
+        self._address = address
+        self._callbacks: Dict[str, Callback] = {}
+        # Frames have to be written whole, even when several greenlets publish at once.
+        self._write_lock = Semaphore()
+        self._connect()
+        self._inbox: "Queue[Tuple[Callback, bytes]]" = Queue()
+        self._greenlets = [gevent.spawn(self._read), gevent.spawn(self._deliver)]
+
+    def _connect(self) -> None:
+        sock = socket.create_connection(self._address)
+        with self._write_lock:
+            for channel in list(self._callbacks):
+                sock.sendall(f"SUB {channel}\n".encode())
+            self._sock = sock
+            self._reader = sock.makefile("rb")
+
+    def _send(self, frame: bytes) -> None:
+        with self._write_lock:
+            try:
+                self._sock.sendall(frame)
+            except OSError:
+                logger.warning("Not connected to the pub/sub hub, dropped a %s frame", frame[:5].split()[0].decode())
+
+    def publish(self, channel: str, payload: str) -> None:
+        self._send(message_frame("PUB", channel, payload.encode()))
+
+    def subscribe(self, channel: str, callback: Callback) -> None:
+        self._callbacks[channel] = callback
+        self._send(f"SUB {channel}\n".encode())
+
+    def unsubscribe(self, channel: str) -> None:
+        if self._callbacks.pop(channel, None) is not None:
+            self._send(f"UNSUB {channel}\n".encode())
+
+    def _read(self) -> None:
+        while True:
+            try:
+                _, channel, payload = read_frame(self._reader)
+            except (EOFError, OSError, ValueError, IndexError):
+                logger.warning("Lost the connection to the pub/sub hub, reconnecting")
+                self._reconnect()
+                continue
+            callback = self._callbacks.get(channel)
+            if callback is not None:
+                self._inbox.put((callback, payload))
+
+    def _reconnect(self) -> None:
+        self._sock.close()
+        delay = RECONNECT_DELAY
+        while True:
+            gevent.sleep(delay)
+            try:
+                self._connect()
+            except OSError:
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                logger.warning("Could not reconnect to the pub/sub hub, retrying in %.1f seconds", delay)
+                continue
+            logger.info("Reconnected to the pub/sub hub")
+            return
+
+    def _deliver(self) -> None:
+        for callback, payload in self._inbox:
+            try:
+                callback(payload.decode())
+            except Exception:
+                logger.exception("Pub/sub callback failed")
+
+    def close(self) -> None:
+        gevent.killall(self._greenlets)
+        self._sock.close()
+
+
+class PubSubHub:
+    # Forwards every published message to the connections subscribed to its channel, including the publisher's.
+    def __init__(self, address: Tuple[str, int]) -> None:
+        self._subscribers: Dict[str, Set[socket.socket]] = {}
+        self._locks: Dict[socket.socket, Semaphore] = {}
+        self.server = StreamServer(address, self._handle)
+
+    def _handle(self, conn: socket.socket, address: Tuple[str, int]) -> None:
+        self._locks[conn] = Semaphore()
+        channels: Set[str] = set()
+        reader = conn.makefile("rb")
+        try:
+            while True:
+                kind, channel, payload = read_frame(reader)
+                if kind == "SUB":
+                    self._subscribers.setdefault(channel, set()).add(conn)
+                    channels.add(channel)
+                elif kind == "UNSUB":
+                    self._remove(channel, conn)
+                    channels.discard(channel)
+                elif kind == "PUB":
+                    frame = message_frame("MSG", channel, payload)
+                    for subscriber in list(self._subscribers.get(channel, ())):
+                        try:
+                            with self._locks[subscriber]:
+                                subscriber.sendall(frame)
+                        except (OSError, KeyError):
+                            self._remove(channel, subscriber)
+        except (EOFError, OSError):
+            pass
+        finally:
+            for channel in channels:
+                self._remove(channel, conn)
+            self._locks.pop(conn, None)
+            conn.close()
+
+    def _remove(self, channel: str, conn: socket.socket) -> None:
+        subscribers = self._subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(conn)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+
+
+class HashRing:
+    # Consistent hashing of match ids onto workers. Each worker gets `replicas` points on the ring so matches spread
+    # evenly, and adding or removing a worker only moves the matches next to its points.
+    def __init__(self, nodes: List[str], replicas: int = 100) -> None:
+        self._ring: List[Tuple[int, str]] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[i][1]
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    hub = PubSubHub(parse_address(sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1:6100"))
+    print("Running")
+    hub.serve_forever()
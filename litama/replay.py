@@ -0,0 +1,157 @@
+# Rebuilds the position of a match at any ply from its startingCards and moves.
+# Also exports finished matches with: python replay.py [--output games.jsonl] [--positions]
+import argparse
+import json
+import struct
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+from bitboard import BitBoard, from_str, make_move, to_str, winner
+from cards import CARDS_BY_ID, CARDS_BY_NAME
+from conversions import bytes_to_move_strs, stored_moves_bytes
+from engine import Hands, enemy_of
+from structures import GameState, Player
+
+# Positions are kept for every SNAPSHOT_INTERVAL plies, so getting to any ply replays at most that many moves.
+SNAPSHOT_INTERVAL = 16
+# Histories of this many matches are kept, least recently used first out.
+MAX_HISTORIES = 1000
+EXPORT_BATCH_SIZE = 500
+
+# The starting position in the conversions.board_to_str format.
+START_BOARD = from_str("1121100000000000000033433")
+
+
+class Snapshot(NamedTuple):
+    board: BitBoard
+    hands: Hands
+    turn: Player
+
+
+class History:
+    def __init__(self, starting_cards: Dict[str, Any], moves: bytes) -> None:
+        blue, red, side = starting_cards["blue"], starting_cards["red"], starting_cards["side"]
+        self.snapshots: List[Snapshot] = [
+            Snapshot(START_BOARD, ((blue[0], blue[1]), (red[0], red[1]), side), CARDS_BY_NAME[side].color)
+        ]
+        self.moves = b""
+        self.codes: Tuple[int, ...] = ()
+        self.extend(moves)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def extend(self, moves: bytes) -> None:
+        # moves has to start with the moves already in the history, games only ever get longer.
+        self.moves = moves
+        self.codes = struct.unpack(f">{len(moves) // 2}H", moves)
+        ply = (len(self.snapshots) - 1) * SNAPSHOT_INTERVAL
+        position = self.snapshots[-1]
+        while ply + SNAPSHOT_INTERVAL <= len(self.codes):
+            position = self._play(position, ply, ply + SNAPSHOT_INTERVAL)
+            ply += SNAPSHOT_INTERVAL
+            self.snapshots.append(position)
+
+    def at(self, ply: int) -> Snapshot:
+        # The position after ply moves, 0 <= ply <= len(self).
+        start = ply // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL
+        return self._play(self.snapshots[ply // SNAPSHOT_INTERVAL], start, ply)
+
+    def positions(self) -> Iterator[Snapshot]:
+        # Every position from the start to the last move, in one pass.
+        position = self.snapshots[0]
+        yield position
+        for ply in range(len(self.codes)):
+            position = self._play(position, ply, ply + 1)
+            yield position
+
+    def _play(self, position: Snapshot, start: int, end: int) -> Snapshot:
+        board, (blue_hand, red_hand, side), turn = position
+        for code in self.codes[start:end]:
+            name = CARDS_BY_ID[code >> 10].name
+            board = make_move(board, code >> 5 & 31, code & 31)
+            if turn == Player.BLUE:
+                blue_hand = (side, blue_hand[1]) if blue_hand[0] == name else (blue_hand[0], side)
+            else:
+                red_hand = (side, red_hand[1]) if red_hand[0] == name else (red_hand[0], side)
+            side = name
+            turn = enemy_of(turn)
+        return Snapshot(board, (blue_hand, red_hand, side), turn)
+
+
+_histories: "OrderedDict[Any, History]" = OrderedDict()
+
+
+def history(match: Dict[str, Any]) -> History:
+    # Built once per match and extended with the moves made since, so replaying stays O(SNAPSHOT_INTERVAL).
+    moves = stored_moves_bytes(match["moves"])
+    entry = _histories.get(match["_id"])
+    if entry is None or not moves.startswith(entry.moves):
+        entry = History(match["startingCards"], moves)
+        _histories[match["_id"]] = entry
+        if len(_histories) > MAX_HISTORIES:
+            _histories.popitem(last=False)
+    else:
+        _histories.move_to_end(match["_id"])
+        if len(moves) != len(entry.moves):
+            entry.extend(moves)
+    return entry
+
+
+def snapshot_dict(position: Snapshot) -> Dict[str, Any]:
+    # In the format of the state message.
+    blue_hand, red_hand, side = position.hands
+    return {
+        "board": to_str(position.board),
+        "cards": {"blue": list(blue_hand), "red": list(red_hand), "side": side},
+        "currentTurn": position.turn.value,
+        "winner": winner(position.board).value
+    }
+
+
+def export_games(matches: Any, positions: bool = False) -> Iterator[Dict[str, Any]]:
+    # Every finished match, without the tokens. With positions, also the position after every ply.
+    cursor = matches.find(
+        {"gameState": GameState.ENDED.value},
+        {"usernames": 1, "startingCards": 1, "moves": 1, "winner": 1},
+        batch_size=EXPORT_BATCH_SIZE
+    )
+    for match in cursor:
+        if "startingCards" not in match:
+            continue
+        moves = stored_moves_bytes(match["moves"])
+        game: Dict[str, Any] = {
+            "matchId": str(match["_id"]),
+            "usernames": match["usernames"],
+            "startingCards": match["startingCards"],
+            "moves": bytes_to_move_strs(moves),
+            "winner": match["winner"]
+        }
+        if positions:
+            replay = History(match["startingCards"], moves)
+            game["positions"] = [snapshot_dict(position) for position in replay.positions()]
+        yield game
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="JSONL file for the games, stdout if not given")
+    parser.add_argument("--positions", action="store_true", help="include the position after every ply")
+    args = parser.parse_args()
+
+    from config import MONGODB_HOST
+    from pymongo import MongoClient
+    matches: Any = MongoClient(MONGODB_HOST).litama.matches
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for game in export_games(matches, args.positions):
+            output.write(json.dumps(game) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,505 @@
 import json
-from typing import Dict, List, Union, Set, Type, Any
+import signal
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Union, Set, Tuple
 
-from flask import Flask
+from bson import ObjectId
+
+from flask import Flask, Response
 from flask_sockets import Sockets
-from geventwebsocket import WebSocketError
 from pymongo import MongoClient
+import gevent
 from gevent import pywsgi
+from geventwebsocket.exceptions import ProtocolError, WebSocketError
 from geventwebsocket.handler import WebSocketHandler
-from geventwebsocket.websocket import WebSocket
+from geventwebsocket.websocket import Header, WebSocket
 from pymongo.collection import Collection
 
-from commands.command import Command
-from commands.create import Create
-from commands.join import Join
+from book import open_book
+from broadcaster import Broadcaster
+from commands.ai import Ai
+from commands.flag import Flag
 from commands.message import Message
 from commands.move import Move
 from commands.spectate import Spectate
-from commands.state import State
-from config import MONGODB_HOST
+from config import AI_PROCESSES, AI_TIME_LIMIT, BOOK_PATH, FLUSH_INTERVAL, LOG_LEVEL, LOG_SAMPLE_RATE, \
+    MATCH_IDLE_TIMEOUT, MAX_FLUSH_BACKOFF, MAX_FRAME_LENGTH, MEMORY_STORE, MONGODB_HOST, PORT, PUBSUB_ADDRESS, \
+    RATE_BURST, RATE_LIMIT, SOCKET_IDLE_TIMEOUT, TABLEBASE_PATH, TIMER_TICK, WORKER_ID, WORKERS
+from conversions import stored_board_str
+from dispatch import BATCH_PREFIX, dispatch, dispatch_batch, parse_batch, target_match, validate
+from engine import SearchResult, search_match
+from limits import TokenBucket, admit
+from match_cache import MatchCache
+from memory_collection import MemoryCollection
+from metrics import BROADCAST_BYTES, BROADCASTS, MATCH_SOCKETS, SOCKETS, collectors, log_query, logger, render, \
+    start_logging
+from pubsub import HashRing, InProcessPubSub, PubSub, SocketPubSub, parse_address
+from storage import STATE_FIELDS, ensure_indexes
+from structures import GameState
+from tablebase import open_tablebases
+from timers import TimerWheel
+
+
+class MessageTooLarge(Exception):
+    pass
+
+
+class CappedWebSocket(WebSocket):  # type: ignore[misc]
+    # Closes the socket as soon as a message's frames add up to more than MAX_FRAME_LENGTH bytes, before their payload
+    # is read. Control frames can come between the frames of a message and don't count.
+    __slots__ = ("message_length",)
+
+    def __init__(self, *args: Any) -> None:
+        super().__init__(*args)
+        self.message_length = 0
+
+    def read_frame(self) -> Tuple[Header, bytes]:
+        header = Header.decode_header(self.stream)
+        if header.flags:
+            raise ProtocolError
+        if header.opcode < self.OPCODE_CLOSE:
+            if header.opcode != self.OPCODE_CONTINUATION:
+                self.message_length = 0
+            self.message_length += header.length
+            if self.message_length > MAX_FRAME_LENGTH:
+                raise MessageTooLarge
+        payload = self.raw_read(header.length) if header.length else b""
+        if len(payload) != header.length:
+            raise WebSocketError("Unexpected EOF reading frame payload")
+        if header.mask:
+            payload = header.unmask_payload(payload)
+        return header, payload
+
+    def receive(self) -> Optional[str]:
+        try:
+            return super().receive()  # type: ignore[no-any-return]
+        except MessageTooLarge:
+            self.close()
+            return None
+
+
+class CappedWebSocketHandler(WebSocketHandler):  # type: ignore[misc]
+    def upgrade_websocket(self) -> Any:
+        result = super().upgrade_websocket()
+        websocket = getattr(self, "websocket", None)
+        if websocket is not None:
+            # The socket made by gevent-websocket sends a close frame when collected unless it is marked closed.
+            websocket.closed = True
+            self.websocket = CappedWebSocket(self.environ, websocket.stream, self)
+            self.environ["wsgi.websocket"] = self.websocket
+        return result
+
 
 app = Flask(__name__)
 sockets = Sockets(app)
 
-mongodb = MongoClient(MONGODB_HOST)
-matches: Collection = mongodb.litama.matches
+matches: Union["Collection[Dict[str, Any]]", MemoryCollection]
+if MEMORY_STORE:
+    matches = MemoryCollection()
+else:
+    matches = MongoClient(MONGODB_HOST).litama.matches
+
+# Each match is owned by one worker, which runs every command for it against its own cache. Other workers forward
+# commands for it over the bus and get the replies back on their reply channel. Broadcasts are published on the
+# match's channel, which every worker with clients in that match subscribes to.
+ring = HashRing(WORKERS)
+bus: PubSub = SocketPubSub(parse_address(PUBSUB_ADDRESS)) if PUBSUB_ADDRESS else InProcessPubSub()
+
+
+def owned_object_id() -> ObjectId:
+    # New matches are given an id that hashes to this worker, so the worker that created one keeps it.
+    while True:
+        object_id = ObjectId()
+        if ring.node_for(str(object_id)) == WORKER_ID:
+            return object_id
+
+
+# Commands go through the cache, which writes changed matches back to the collection every FLUSH_INTERVAL seconds.
+# A miss reads the fields the command asks for and those of the state message that most commands go on to send.
+match_cache = MatchCache(matches, new_id=owned_object_id, load_fields=STATE_FIELDS)
+
+# The engine searches in separate processes so that it never blocks the sockets handled by this one.
+engine_pool = ProcessPoolExecutor(max_workers=AI_PROCESSES, initializer=open_tablebases, initargs=(TABLEBASE_PATH,))
 
 game_clients: Dict[str, Set[WebSocket]] = {}
+# The matches each client is in game_clients for, so they can be removed when it disconnects.
+client_matches: Dict[WebSocket, Set[str]] = {}
+# Clients that get delta messages instead of full state broadcasts after moves.
+delta_clients: Set[WebSocket] = set()
+# Ids of the connected clients, used to send replies to commands that were run by another worker.
+client_ids: Dict[WebSocket, str] = {}
+clients_by_id: Dict[str, WebSocket] = {}
+# Forwarded spectate commands that haven't been replied to yet, by match id.
+pending_spectates: Dict[str, int] = {}
+# The worker and client id forwarded commands came from, and the matches they spectate.
+RemoteSender = Tuple[str, str, List[str]]
+
+# Deadlines of the clocks of the matches this worker owns, keyed ("clock", match id), of the matches it has clients
+# in, keyed ("match", match id), and of its sockets, keyed ("socket", ws). All of them are run by run_timers.
+timers: TimerWheel[Tuple[str, Any]] = TimerWheel(time.monotonic(), TIMER_TICK)
+# When each match in game_clients last had a broadcast and each socket last sent a frame.
+match_activity: Dict[str, float] = {}
+socket_activity: Dict[WebSocket, float] = {}
 
 StateDict = Dict[str, Union[bool, str, List[str], Dict[str, Union[List[str], str]]]]
 CommandResponse = Dict[str, Union[bool, str]]
 
-commands: List[Type[Command]] = [Create, Join, State, Move, Spectate]
+
+def forget_client(ws: WebSocket) -> None:
+    delta_clients.discard(ws)
+    for match_id in client_matches.pop(ws, set()):
+        clients = game_clients.get(match_id)
+        if clients is not None:
+            clients.discard(ws)
+            if not clients:
+                forget_match(match_id)
+
+
+def forget_match(match_id: str) -> None:
+    # Stops sending the match's broadcasts to anyone on this worker.
+    for ws in game_clients.pop(match_id, set()):
+        client_matches.get(ws, set()).discard(match_id)
+    match_activity.pop(match_id, None)
+    timers.cancel(("match", match_id))
+    bus.unsubscribe(f"match:{match_id}")
+
+
+# All sends go through here, see broadcaster.py.
+broadcaster = Broadcaster(forget_client)
 
 
 @sockets.route("/")  # type: ignore
 def game_socket(ws: WebSocket) -> None:
-    while not ws.closed:
-        query = ws.receive()
-        if query is None:
-            continue
+    broadcaster.register(ws)
+    client_id = uuid.uuid4().hex
+    client_ids[ws] = client_id
+    clients_by_id[client_id] = ws
+    SOCKETS.inc()
+    bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+    socket_activity[ws] = time.monotonic()
+    timers.schedule(("socket", ws), socket_activity[ws] + SOCKET_IDLE_TIMEOUT)
+    try:
+        while not ws.closed:
+            query = ws.receive()
+            if query is None:
+                continue
+            socket_activity[ws] = time.monotonic()
+
+            log_query(query, LOG_SAMPLE_RATE)
+
+            rejected = admit(query, bucket, MAX_FRAME_LENGTH)
+            if rejected is not None:
+                send_messages(ws, [rejected])
+                continue
+
+            handle_query(ws, query)
+    finally:
+        SOCKETS.inc(amount=-1)
+        broadcaster.unregister(ws)
+        del clients_by_id[client_ids.pop(ws)]
+        forget_client(ws)
+        del socket_activity[ws]
+        timers.cancel(("socket", ws))
+
+
+def handle_query(ws: WebSocket, query: str) -> None:
+    if query.startswith(BATCH_PREFIX) and len(WORKERS) > 1:
+        batch = parse_batch(query)
+        if batch is not None:
+            handle_batch(ws, batch)
+            return
 
-        print(f"Received:`{query}`")
+    match_id = target_match(query)
+    if match_id is None or ring.node_for(match_id) == WORKER_ID:
+        send_messages(ws, dispatch(match_cache, query))
+        return
+    # Malformed commands are answered here instead of making a round trip to the owner.
+    rejected = validate(query)
+    if rejected is not None:
+        send_messages(ws, [rejected])
+    else:
+        forward(ws, ring.node_for(match_id), {"query": query}, [query])
 
-        messages: List[Message]
-        for command in commands:
-            if command.command_matches(query):
-                messages = command.apply_command(matches, query[len(command.STARTS_WITH):])
-                break
+
+def handle_batch(ws: WebSocket, batch: List[str]) -> None:
+    # A batch goes to the worker that owns its matches. If they belong to several, it is split into one batch per
+    # worker and the client gets a reply for each, with the indices of the commands in it.
+    parts: Dict[str, List[int]] = {}
+    for i, query in enumerate(batch):
+        match_id = target_match(query)
+        parts.setdefault(WORKER_ID if match_id is None else ring.node_for(match_id), []).append(i)
+
+    for owner, part in parts.items():
+        queries = batch if len(parts) == 1 else [batch[i] for i in part]
+        indices = None if len(parts) == 1 else part
+        if owner == WORKER_ID:
+            send_messages(ws, dispatch_batch(match_cache, queries, indices))
         else:
-            messages = [Command.error_msg("Invalid command sent", query)]
-            pass
+            forward(ws, owner, {"batch": queries, "indices": indices}, queries)
 
-        for message in messages:
-            if message.add_sender_to_spectate_map:
-                add_client_to_map(message.match_id, ws)
 
-            msg_to_send_str = to_json_str(message.message)
-            if message.reply_to_only_sender:
-                ws.send(msg_to_send_str)
-            else:
-                removed_clients: List[WebSocket] = []
-                for client in game_clients[message.match_id]:
-                    try:
-                        client.send(msg_to_send_str)
-                    except WebSocketError:
-                        removed_clients.append(client)
-                for client in removed_clients:
-                    game_clients[message.match_id].remove(client)
+def forward(ws: WebSocket, owner: str, request: Dict[str, Any], queries: List[str]) -> None:
+    spectating: List[str] = []
+    for query in queries:
+        match_id = target_match(query)
+        if match_id is not None and query.startswith(Spectate.STARTS_WITH):
+            # Subscribed before forwarding so the state broadcast that follows a successful spectate isn't missed.
+            pending_spectates[match_id] = pending_spectates.get(match_id, 0) + 1
+            subscribe_match(match_id)
+            spectating.append(match_id)
+    request.update({"worker": WORKER_ID, "client": client_ids[ws], "spectating": spectating})
+    bus.publish(f"worker:{owner}", json.dumps(request))
+
+
+def handle_forwarded(payload: str) -> None:
+    request = json.loads(payload)
+    if "batch" in request:
+        messages = dispatch_batch(match_cache, request["batch"], request["indices"])
+    else:
+        messages = dispatch(match_cache, request["query"])
+    send_messages(None, messages, (request["worker"], request["client"], request["spectating"]))
 
 
-def to_json_str(d: Dict[str, Any]) -> str:
-    return json.dumps(d, separators=(',', ':'))
+def handle_reply(payload: str) -> None:
+    reply = json.loads(payload)
+    ws = clients_by_id.get(reply["client"])
+    if ws is not None:
+        for message in reply["messages"]:
+            apply_sender_flags(ws, message["matchId"], message["spectate"], message["deltaMode"])
+            if message["json"] is not None:
+                broadcaster.send(ws, message["json"])
+
+    for match_id in reply["spectating"]:
+        pending_spectates[match_id] -= 1
+        if not pending_spectates[match_id]:
+            del pending_spectates[match_id]
+            # Drops the subscription made by forward if the spectate failed or the client left meanwhile.
+            if match_id not in game_clients:
+                bus.unsubscribe(f"match:{match_id}")
+
+
+def send_messages(ws: Optional[WebSocket], messages: List[Message], remote: Optional[RemoteSender] = None) -> None:
+    # ws is the client that sent the command. It is None for moves made by the engine and for commands forwarded
+    # by another worker, in which case remote is the sender.
+    replies: List[Dict[str, Any]] = []
+    for message in messages:
+        if ws is not None:
+            apply_sender_flags(ws, message.match_id, message.add_sender_to_spectate_map, message.set_delta_mode)
+
+        if message.reply_to_only_sender:
+            if ws is not None:
+                if not message.batched:
+                    broadcaster.send(ws, message.to_json())
+            elif remote is not None:
+                replies.append({"json": None if message.batched else message.to_json(), "matchId": message.match_id,
+                                "spectate": message.add_sender_to_spectate_map, "deltaMode": message.set_delta_mode})
+        else:
+            # Replies have to be sent first so the sender's worker applies them before the broadcast arrives.
+            if replies and remote is not None:
+                send_replies(remote, replies)
+                replies = []
+                remote = (remote[0], remote[1], [])
+            publish_broadcast(message)
+            if message.message.get("messageType") == "state":
+                schedule_clock(message.message)
+
+        if message.ai_to_move:
+            gevent.spawn(play_ai_move, message.match_id)
+
+    # A forwarded spectate is always replied to, so the sender's worker can clean up its subscription.
+    if remote is not None and (replies or remote[2]):
+        send_replies(remote, replies)
+
+
+def send_replies(remote: RemoteSender, replies: List[Dict[str, Any]]) -> None:
+    worker, client_id, spectating = remote
+    bus.publish(f"reply:{worker}", json.dumps({"client": client_id, "messages": replies, "spectating": spectating}))
+
+
+def apply_sender_flags(ws: WebSocket, match_id: str, spectate: bool, delta_mode: Optional[bool]) -> None:
+    if spectate:
+        add_client_to_map(match_id, ws)
+    if delta_mode is not None:
+        if delta_mode:
+            delta_clients.add(ws)
+        else:
+            delta_clients.discard(ws)
+
+
+def publish_broadcast(message: Message) -> None:
+    # Both encodings are already JSON without raw newlines, so they are joined with newlines instead of being
+    # encoded again. The first line says whether this is a state message.
+    is_state = message.message.get("messageType") == "state"
+    delta = "" if message.delta is None else message.delta.to_json()
+    bus.publish(f"match:{message.match_id}", f"{'s' if is_state else '-'}\n{message.to_json()}\n{delta}")
+
+
+def deliver_broadcast(match_id: str, payload: str) -> None:
+    kind, full, delta = payload.split("\n", 2)
+    # A newer state of the match replaces one the client hasn't been sent yet.
+    state_key = f"state:{match_id}" if kind == "s" else None
+    # Copied because the broadcaster can disconnect clients, which removes them from the set.
+    clients = list(game_clients.get(match_id, ()))
+    if clients:
+        match_activity[match_id] = time.monotonic()
+    sent = 0
+    for client in clients:
+        if delta and client in delta_clients:
+            broadcaster.send(client, delta)
+            sent += len(delta)
+        else:
+            broadcaster.send(client, full, state_key)
+            sent += len(full)
+    BROADCASTS.observe(len(clients))
+    BROADCAST_BYTES.inc(amount=sent)
+
+
+def subscribe_match(match_id: str) -> None:
+    bus.subscribe(f"match:{match_id}", lambda payload: deliver_broadcast(match_id, payload))
+
+
+def play_ai_move(match_id: str) -> None:
+    match = match_cache.find_one({"_id": ObjectId(match_id)})
+    if match is None or match["gameState"] != GameState.IN_PROGRESS.value:
+        return
+    future = engine_pool.submit(search_match, stored_board_str(match["board"]), match["cards"], match["currentTurn"],
+                                AI_TIME_LIMIT)
+    # Wait in a real thread so that only this greenlet blocks on the result.
+    result: SearchResult = gevent.get_hub().threadpool.apply(future.result)
+    if result.move is None:
+        # The engine has no legal move, which ends the match as a draw.
+        blocked = Move.end_blocked(match_cache, match)
+        if blocked is not None:
+            send_messages(None, [blocked])
+        return
+    send_messages(None, Move.apply_command(match_cache, Ai.move_query(match, result.move)))
 
 
 def add_client_to_map(match_id: str, ws: WebSocket) -> None:
     if match_id not in game_clients:
         game_clients[match_id] = set()
+        subscribe_match(match_id)
+        match_activity[match_id] = time.monotonic()
+        timers.schedule(("match", match_id), match_activity[match_id] + MATCH_IDLE_TIMEOUT)
     game_clients[match_id].add(ws)
+    client_matches.setdefault(ws, set()).add(match_id)
+
+
+def collect_match_sockets() -> None:
+    MATCH_SOCKETS.reset()
+    for clients in game_clients.values():
+        MATCH_SOCKETS.observe(len(clients))
 
 
-@app.route("/")
+collectors.append(collect_match_sockets)
+
+
+def schedule_clock(state: Dict[str, Any]) -> None:
+    # Called with every state broadcast of the matches this worker owns, which includes every change to a clock.
+    time_left = Flag.time_left(state)
+    if time_left is None:
+        timers.cancel(("clock", state["matchId"]))
+    else:
+        timers.schedule(("clock", state["matchId"]), time.monotonic() + max(0.0, time_left))
+
+
+def flag_match(match_id: str) -> None:
+    match = match_cache.find_one({"_id": ObjectId(match_id)})
+    time_left = None if match is None else Flag.time_left(match)
+    if time_left is None:
+        return
+    if time_left > 0:
+        timers.schedule(("clock", match_id), time.monotonic() + time_left)
+        return
+    send_messages(None, Flag.apply_command(match_cache, match_id))
+
+
+def expire_match(match_id: str, now: float) -> None:
+    last = match_activity.get(match_id)
+    if last is None:
+        return
+    if now - last < MATCH_IDLE_TIMEOUT:
+        timers.schedule(("match", match_id), last + MATCH_IDLE_TIMEOUT)
+    else:
+        # The sockets stay open, so they are told that they won't get the match's broadcasts anymore.
+        idle = Spectate.idle_msg(match_id).to_json()
+        for ws in list(game_clients.get(match_id, ())):
+            broadcaster.send(ws, idle)
+        forget_match(match_id)
+
+
+def expire_socket(ws: WebSocket, now: float) -> None:
+    last = socket_activity.get(ws)
+    if last is None:
+        return
+    if now - last < SOCKET_IDLE_TIMEOUT:
+        timers.schedule(("socket", ws), last + SOCKET_IDLE_TIMEOUT)
+    elif client_matches.get(ws):
+        # Spectators don't have to send anything, they are only dropped with the matches they watch.
+        timers.schedule(("socket", ws), now + SOCKET_IDLE_TIMEOUT)
+    else:
+        ws.close()
+
+
+def run_timers() -> None:
+    # One loop for every timer instead of a sleeping greenlet each.
+    while True:
+        gevent.sleep(TIMER_TICK)
+        now = time.monotonic()
+        for kind, key in timers.advance(now):
+            if kind == "clock":
+                # Can wait on MongoDB, so it doesn't hold up the other timers.
+                gevent.spawn(flag_match, key)
+            elif kind == "match":
+                expire_match(key, now)
+            else:
+                expire_socket(key, now)
+
+
+def flush_matches() -> None:
+    delay = FLUSH_INTERVAL
+    while True:
+        gevent.sleep(delay)
+        try:
+            match_cache.flush()
+        except Exception:
+            # The failed batch is kept dirty, so it is written by a later flush. Nothing is evicted meanwhile.
+            delay = min(delay * 2, MAX_FLUSH_BACKOFF)
+            logger.exception("Writing matches failed, retrying in %.1f seconds", delay)
+            continue
+        delay = FLUSH_INTERVAL
+        match_cache.evict()
+
+
+@app.route("/")  # type: ignore[misc]
 def index() -> str:
     return "This is a WebSocket server. Connect to this address using the ws or wss protocol. " \
            "See the <a href=\"https://github.com/TheBlocks/Litama/wiki\">wiki</a> for more information."
 
 
+@app.route("/metrics")  # type: ignore[misc]
+def metrics() -> Response:
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    server = pywsgi.WSGIServer(('127.0.0.1', 5000), app, handler_class=WebSocketHandler)
+    server = pywsgi.WSGIServer(('127.0.0.1', PORT), app, handler_class=CappedWebSocketHandler)
+    gevent.signal_handler(signal.SIGTERM, server.stop)
+    log_listener = start_logging(LOG_LEVEL)
+    open_book(BOOK_PATH)
+    ensure_indexes(matches)
+    flusher = gevent.spawn(flush_matches)
+    timer_loop = gevent.spawn(run_timers)
+    bus.subscribe(f"worker:{WORKER_ID}", handle_forwarded)
+    bus.subscribe(f"reply:{WORKER_ID}", handle_reply)
     print("Running")
-    server.serve_forever()
+    try:
+        server.serve_forever()
+    finally:
+        flusher.kill()
+        timer_loop.kill()
+        match_cache.flush()
+        bus.close()
+        log_listener.stop()
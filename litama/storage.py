@@ -0,0 +1,56 @@
+# How the commands use the matches collection: the indexes it needs, the fields each command reads and the
+# timestamps that let MongoDB expire matches nobody is coming back to.
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from structures import GameState
+
+Projection = Dict[str, int]
+
+# Seconds until a match that nobody joined, or that ended, is deleted after its last change. Matches in progress
+# never expire.
+WAITING_MATCH_TTL = 24 * 60 * 60
+ENDED_MATCH_TTL = 30 * 24 * 60 * 60
+
+# Fields each command reads, _id is always included. Reading only these leaves out the tokens and timestamps, and
+# the moves of long games when the command doesn't need them. The servers' MatchCache reads these on a miss along
+# with STATE_FIELDS, which most commands go on to send, and reads any other fields a later command needs then.
+STATE_FIELDS: Projection = {
+    "usernames": 1, "indices": 1, "currentTurn": 1, "cards": 1, "startingCards": 1, "moves": 1, "board": 1,
+    "gameState": 1, "winner": 1, "clock": 1
+}
+JOIN_FIELDS: Projection = {"gameState": 1, "tokenRed": 1, "usernames": 1, "indices": 1, "clock": 1}
+MOVE_FIELDS: Projection = {
+    "gameState": 1, "tokenBlue": 1, "tokenRed": 1, "currentTurn": 1, "board": 1, "cards": 1, "ply": 1, "ai": 1,
+    "clock": 1
+}
+# moves is only read for matches stored before ply was.
+MOVES_FIELDS: Projection = {"gameState": 1, "currentTurn": 1, "board": 1, "cards": 1, "moves": 1, "ply": 1}
+HISTORY_FIELDS: Projection = {"gameState": 1, "startingCards": 1, "moves": 1}
+FLAG_FIELDS: Projection = {"gameState": 1, "currentTurn": 1, "clock": 1, "ply": 1}
+
+_TTLS = {
+    GameState.WAITING_FOR_PLAYER.value: WAITING_MATCH_TTL,
+    GameState.ENDED.value: ENDED_MATCH_TTL,
+}
+
+
+def ensure_indexes(matches: Any) -> None:
+    # Run at startup, creating an index that already exists does nothing.
+    # MongoDB deletes a match once the time in its expireAt has passed. Matches without one are kept.
+    matches.create_index("expireAt", expireAfterSeconds=0)
+    # For the exports and the opening book, which read every finished match.
+    matches.create_index("gameState")
+
+
+def timestamps(game_state: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+    # Fields to set on every write that leaves the match in game_state. Naive UTC, which is what pymongo returns.
+    now = now or datetime.utcnow()
+    ttl = _TTLS.get(game_state)
+    return {"updatedAt": now, "expireAt": None if ttl is None else now + timedelta(seconds=ttl)}
+
+
+def created(game_state: str) -> Dict[str, Any]:
+    # Fields of a newly inserted match.
+    now = datetime.utcnow()
+    return {"createdAt": now, **timestamps(game_state, now)}
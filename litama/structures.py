@@ -1,7 +1,7 @@
-from dataclasses import dataclass
-from enum import Enum, auto
+from dataclasses import dataclass, FrozenInstanceError
+from enum import Enum
 
-from typing import List, Tuple
+from typing import Any, Dict, List, Sequence, Tuple
 
 
 class Player(Enum):
@@ -16,22 +16,112 @@ class GameState(Enum):
     ENDED = "ended"
 
 
-@dataclass
+# Pieces and positions are immutable and interned: constructing one with the same arguments returns the same
+# object, so a board is just 25 references to a handful of shared pieces and move generation doesn't allocate.
+_interned_pieces: Dict[Tuple[bool, Player], "Piece"] = {}
+_interned_positions: Dict[Tuple[int, int], "Pos"] = {}
+
+
+@dataclass(eq=True, frozen=True, init=False)
 class Piece:
+    __slots__ = ("is_master", "color")
     is_master: bool
     color: Player
 
+    def __new__(cls, is_master: bool, color: Player) -> "Piece":
+        piece = _interned_pieces.get((is_master, color))
+        if piece is None:
+            piece = object.__new__(cls)
+            object.__setattr__(piece, "is_master", is_master)
+            object.__setattr__(piece, "color", color)
+            _interned_pieces[(is_master, color)] = piece
+        return piece
+
+    def __reduce__(self) -> Tuple[Any, Tuple[bool, Player]]:
+        return Piece, (self.is_master, self.color)
+
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, init=False)
 class Pos:
+    __slots__ = ("x", "y")
     x: int
     y: int
 
+    def __new__(cls, x: int, y: int) -> "Pos":
+        pos = _interned_positions.get((x, y))
+        if pos is None:
+            pos = object.__new__(cls)
+            object.__setattr__(pos, "x", x)
+            object.__setattr__(pos, "y", y)
+            _interned_positions[(x, y)] = pos
+        return pos
+
+    def __reduce__(self) -> Tuple[Any, Tuple[int, int]]:
+        return Pos, (self.x, self.y)
+
 
-@dataclass(eq=True, frozen=True)
 class Card:
+    # Immutable like the dataclasses above, but written out by hand because the tables derived from
+    # the moves need slots as well, which dataclass fields with init=False can't have before Python 3.10.
+    __slots__ = ("name", "color", "moves", "destinations", "target_masks")
     name: str
     color: Player
-    moves: List[Pos]
+    moves: Tuple[Pos, ...]
     # moves = Positions the piece can move to using the card.
     # The piece is at (0, 0) and positions are relative to it.
+
+    # destinations[color][y * 5 + x] = Positions a piece of that color at (x, y) can move to using the card,
+    # already rotated for the color and clipped to the board. target_masks holds the same as bitmasks.
+    destinations: Dict[Player, Tuple[Tuple[Pos, ...], ...]]
+    target_masks: Dict[Player, Tuple[int, ...]]
+
+    def __init__(self, name: str, color: Player, moves: Sequence[Pos]) -> None:
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "color", color)
+        object.__setattr__(self, "moves", tuple(moves))
+
+        destinations: Dict[Player, Tuple[Tuple[Pos, ...], ...]] = {}
+        target_masks: Dict[Player, Tuple[int, ...]] = {}
+        for side in (Player.BLUE, Player.RED):
+            side_destinations: List[Tuple[Pos, ...]] = []
+            for sq in range(25):
+                piece_x, piece_y = sq % 5, sq // 5
+                square_destinations: List[Pos] = []
+                for move in self.moves:
+                    # Account for card rotation on both sides
+                    # On blue side, negative X goes right
+                    # On red side, negative Y goes up
+                    x = (-move.x if side == Player.BLUE else move.x) + piece_x
+                    y = (-move.y if side == Player.RED else move.y) + piece_y
+                    if 0 <= x <= 4 and 0 <= y <= 4:
+                        square_destinations.append(Pos(x, y))
+                side_destinations.append(tuple(square_destinations))
+            destinations[side] = tuple(side_destinations)
+            target_masks[side] = tuple(
+                sum(1 << (pos.y * 5 + pos.x) for pos in square_destinations)
+                for square_destinations in side_destinations
+            )
+        object.__setattr__(self, "destinations", destinations)
+        object.__setattr__(self, "target_masks", target_masks)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __delattr__(self, name: str) -> None:
+        raise FrozenInstanceError(f"cannot delete field '{name}'")
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, Card):
+            return NotImplemented
+        return (self.name, self.color, self.moves) == (other.name, other.color, other.moves)
+
+    def __hash__(self) -> int:
+        return hash((self.name, self.color, self.moves))
+
+    def __repr__(self) -> str:
+        return f"Card(name={self.name!r}, color={self.color!r}, moves={self.moves!r})"
+
+    def __reduce__(self) -> Tuple[Any, Tuple[str, Player, Tuple[Pos, ...]]]:
+        return Card, (self.name, self.color, self.moves)
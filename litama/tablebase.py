@@ -0,0 +1,346 @@
+# Endgame tablebases: the number of plies to the end of the game with perfect play, for every position with both
+# masters, at most one student per side and a fixed set of five cards. Build one per card set with:
+# python tablebase.py --cards tiger,crab,monkey,crane,dragon [--students 1] [--processes 4] [--output tablebases]
+#
+# Positions are solved by retrograde analysis in passes. Pass k finds the positions that end after exactly k plies:
+# wins when k is odd (a move leads to a loss in k - 1) and losses when it is even (every move leads to a win in at
+# most k - 1). Each pass is split into chunks that worker processes solve against the memory-mapped table of the
+# previous pass. Whatever is left when a pass finds nothing is a draw, including positions without a legal move
+# (bitboard.NO_MOVES_WINNER).
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from bitboard import BitBoard, BLUE_TEMPLE, RED_TEMPLE
+from cards import CARD_IDS, CARDS_BY_ID
+from structures import Player
+
+MAGIC = b"LTTB"
+VERSION = 1
+# Magic, format version, the ids of the five cards in increasing order, students per side.
+HEADER = struct.Struct("<4sI5BB")
+MAX_STUDENTS = 1
+CHUNK_SIZE = 1 << 20
+
+# One byte per position. 0 is a draw, INVALID a square holding two pieces or a game that can't be reached, anything
+# else is one more than the number of plies left: odd for a loss of the side to move, even for a win.
+DRAW = 0
+INVALID = 255
+MAX_DISTANCE = INVALID - 2
+
+# Same as engine.Hands, which can't be imported here because the engine probes the tablebases.
+Hands = Tuple[Tuple[str, str], Tuple[str, str], str]
+Indices = npt.NDArray[np.int64]
+
+# Every way to deal five cards (numbered 0 to 4) into two hands and a side card: (blue hand, red hand, side card)
+# with the hands in increasing order.
+CARD_STATES: List[Tuple[Tuple[int, int], Tuple[int, int], int]] = [
+    (blue, red, side)
+    for blue in combinations(range(5), 2)
+    for red in combinations([card for card in range(5) if card not in blue], 2)
+    for side in range(5) if side not in blue and side not in red
+]
+STATE_INDEX: Dict[Tuple[Tuple[int, int], Tuple[int, int], int], int] = {
+    state: i for i, state in enumerate(CARD_STATES)
+}
+# Looked up once, enum attributes and struct sizes are slow to get on every probe.
+_BLUE = Player.BLUE
+_HEADER_SIZE = HEADER.size
+BLUE_TEMPLE_SQUARE = BLUE_TEMPLE.bit_length() - 1
+RED_TEMPLE_SQUARE = RED_TEMPLE.bit_length() - 1
+
+
+def _next_state(state: int, turn: int, slot: int) -> int:
+    # The card state after the player to move uses the card in slot of their hand.
+    blue, red, side = CARD_STATES[state]
+    hand = blue if turn == 0 else red
+    used = hand[slot]
+    low, high = sorted((hand[1 - slot], side))
+    if turn == 0:
+        return STATE_INDEX[((low, high), red, used)]
+    return STATE_INDEX[(blue, (low, high), used)]
+
+
+# HAND_CARDS[turn, state, slot] is the card in that slot of the hand of the player to move, NEXT_STATE the state
+# after it is used.
+HAND_CARDS = np.array([[list(blue), list(red)] for blue, red, _ in CARD_STATES], dtype=np.int64).transpose(1, 0, 2)
+NEXT_STATE = np.array([[[_next_state(state, turn, slot) for slot in range(2)] for state in range(len(CARD_STATES))]
+                       for turn in range(2)], dtype=np.int64)
+
+
+def student_squares(students: int) -> int:
+    # Student coordinates are 0 for no student and square + 1 otherwise.
+    return 26 if students else 1
+
+
+def table_size(students: int) -> int:
+    return 2 * len(CARD_STATES) * 25 * 25 * student_squares(students) ** 2
+
+
+def targets_table(card_ids: Sequence[int]) -> npt.NDArray[np.int64]:
+    # TARGETS[card, turn, from square, i] is the i-th square the card moves a piece to from that square, or -1.
+    # From square 25 stands for a missing student and has no targets.
+    targets = np.full((5, 2, 26, 4), -1, dtype=np.int64)
+    for card, card_id in enumerate(card_ids):
+        for turn, color in enumerate((Player.BLUE, Player.RED)):
+            for sq, destinations in enumerate(CARDS_BY_ID[card_id].destinations[color]):
+                for i, pos in enumerate(destinations):
+                    targets[card, turn, sq, i] = pos.y * 5 + pos.x
+    return targets
+
+
+def decode(indices: Indices, students: int) -> Tuple[Indices, ...]:
+    # (turn, card state, blue master, red master, blue student, red student) of every index.
+    size = student_squares(students)
+    rest, red_student = np.divmod(indices, size)
+    rest, blue_student = np.divmod(rest, size)
+    rest, red_master = np.divmod(rest, 25)
+    rest, blue_master = np.divmod(rest, 25)
+    turn, state = np.divmod(rest, len(CARD_STATES))
+    return turn, state, blue_master, red_master, blue_student, red_student
+
+
+def encode(turn: Indices, state: Indices, blue_master: Indices, red_master: Indices,
+           blue_student: Indices, red_student: Indices, students: int) -> Indices:
+    size = student_squares(students)
+    index: Indices = ((((turn * len(CARD_STATES) + state) * 25 + blue_master) * 25 + red_master) * size
+                      + blue_student) * size + red_student
+    return index
+
+
+def initial_values(start: int, end: int, students: int) -> npt.NDArray[np.uint8]:
+    # Marks squares with two pieces as INVALID and games that are already over as lost for the side to move.
+    turn, _, blue_master, red_master, blue_student, red_student = decode(np.arange(start, end), students)
+    overlapping = (
+        (blue_master == red_master)
+        | (blue_student - 1 == blue_master) | (blue_student - 1 == red_master)
+        | (red_student - 1 == blue_master) | (red_student - 1 == red_master)
+        | ((blue_student > 0) & (blue_student == red_student))
+    )
+    blue_won = blue_master == RED_TEMPLE_SQUARE
+    red_won = red_master == BLUE_TEMPLE_SQUARE
+    # Only the player who just moved can have won, anything else can't be reached.
+    lost = np.where(turn == 0, red_won & ~blue_won, blue_won & ~red_won)
+    values = np.full(end - start, DRAW, dtype=np.uint8)
+    values[lost] = 1
+    values[overlapping | ((blue_won | red_won) & ~lost)] = INVALID
+    return values
+
+
+def solve_chunk(path: str, card_ids: Tuple[int, ...], students: int, start: int, end: int,
+                k: int) -> Tuple[Indices, int]:
+    # The indices between start and end that end after exactly k plies, see the top of the file.
+    table = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size)
+    indices: Indices = start + np.flatnonzero(table[start:end] == DRAW)
+    turn, state, blue_master, red_master, blue_student, red_student = decode(indices, students)
+    is_blue = turn == 0
+    own_master = np.where(is_blue, blue_master, red_master)
+    enemy_master = np.where(is_blue, red_master, blue_master)
+    own_student = np.where(is_blue, blue_student, red_student)
+    enemy_student = np.where(is_blue, red_student, blue_student)
+    temple = np.where(is_blue, RED_TEMPLE_SQUARE, BLUE_TEMPLE_SQUARE)
+    targets = targets_table(card_ids)
+    # Squares the pieces move from, 25 for a missing student.
+    student_from = np.where(own_student > 0, own_student - 1, 25)
+
+    found = np.zeros(len(indices), dtype=bool)
+    all_won = np.ones(len(indices), dtype=bool)
+    has_move = np.zeros(len(indices), dtype=bool)
+    for slot in range(2):
+        card = HAND_CARDS[turn, state, slot]
+        next_state = NEXT_STATE[turn, state, slot]
+        for moves_master in (True, False):
+            from_sq = own_master if moves_master else student_from
+            other = student_from if moves_master else own_master
+            for i in range(4):
+                to = targets[card, turn, from_sq, i]
+                legal = (to >= 0) & (to != other)
+                if not legal.any():
+                    continue
+                has_move |= legal
+                ends_game = legal & ((to == enemy_master) | (moves_master & (to == temple)))
+                rows = np.flatnonzero(legal & ~ends_game)
+                if k == 1:
+                    found |= ends_game
+                    continue
+
+                row_to = to[rows]
+                new_master = row_to if moves_master else own_master[rows]
+                new_student = own_student[rows] if moves_master else row_to + 1
+                captured = enemy_student[rows] == row_to + 1
+                new_enemy_student = np.where(captured, 0, enemy_student[rows])
+                blue = is_blue[rows]
+                child = encode(
+                    1 - turn[rows], next_state[rows],
+                    np.where(blue, new_master, enemy_master[rows]),
+                    np.where(blue, enemy_master[rows], new_master),
+                    np.where(blue, new_student, new_enemy_student),
+                    np.where(blue, new_enemy_student, new_student),
+                    students
+                )
+                values = table[child]
+                if k % 2:
+                    # Wins: a move to a position the opponent loses after k - 1 plies.
+                    found[rows[values == k]] = True
+                else:
+                    # Losses: every move leads to a win for the opponent.
+                    all_won[rows[(values == DRAW) | (values % 2 == 1)]] = False
+
+    if k % 2 == 0:
+        # Positions without a legal move aren't losses, they stay draws (bitboard.NO_MOVES_WINNER).
+        found = has_move & all_won
+    resolved: Indices = indices[found]
+    return resolved, k + 1
+
+
+def tablebase_name(names: Sequence[str]) -> str:
+    return "-".join(sorted(names, key=lambda name: CARD_IDS[name])) + ".tb"
+
+
+def generate(names: Sequence[str], students: int, path: str, processes: int) -> Dict[str, float]:
+    # Writes the tablebase to path and returns stats about it.
+    card_ids = tuple(sorted(CARD_IDS[name] for name in names))
+    if len(set(card_ids)) != 5:
+        raise ValueError("A tablebase needs five different cards")
+    if not 0 <= students <= MAX_STUDENTS:
+        raise ValueError(f"Tablebases hold at most {MAX_STUDENTS} student per side")
+
+    start_time = time.perf_counter()
+    size = table_size(students)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, *card_ids, students))
+        for start in range(0, size, CHUNK_SIZE):
+            f.write(initial_values(start, min(start + CHUNK_SIZE, size), students).tobytes())
+
+    table = np.memmap(temp_path, dtype=np.uint8, mode="r+", offset=HEADER.size)
+    chunks = [(start, min(start + CHUNK_SIZE, size)) for start in range(0, size, CHUNK_SIZE)]
+    passes = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for k in range(1, MAX_DISTANCE + 1):
+            results = list(pool.map(solve_chunk, [temp_path] * len(chunks), [card_ids] * len(chunks),
+                                    [students] * len(chunks), [start for start, _ in chunks],
+                                    [end for _, end in chunks], [k] * len(chunks)))
+            if not any(len(resolved) for resolved, _ in results):
+                break
+            # Written after the whole pass, so every chunk saw the table of the previous one.
+            for resolved, value in results:
+                table[resolved] = value
+            table.flush()
+            passes = k
+    del table
+    os.replace(temp_path, path)
+
+    values = np.fromfile(path, dtype=np.uint8, offset=HEADER.size)
+    decided = (values != DRAW) & (values != INVALID) & (values != 1)
+    return {
+        "seconds": round(time.perf_counter() - start_time, 2),
+        "bytes": os.path.getsize(path),
+        "positions": int((values != INVALID).sum() - (values == 1).sum()),
+        "wins": int((decided & (values % 2 == 0)).sum()),
+        "losses": int((decided & (values % 2 == 1)).sum()),
+        "draws": int((values == DRAW).sum()),
+        "longestPlies": passes,
+    }
+
+
+class Tablebase:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, *card_ids, self.students = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a tablebase of version {VERSION}")
+        names = [CARDS_BY_ID[card_id].name for card_id in card_ids]
+        self.cards = frozenset(names)
+        # Card state of every deal, by (blue hand, red hand, side card) in either order of the hands.
+        self._states: Dict[Hands, int] = {}
+        for (blue, red, side), state in STATE_INDEX.items():
+            for blue_hand in ((blue[0], blue[1]), (blue[1], blue[0])):
+                for red_hand in ((red[0], red[1]), (red[1], red[0])):
+                    hands = ((names[blue_hand[0]], names[blue_hand[1]]), (names[red_hand[0]], names[red_hand[1]]),
+                             names[side])
+                    self._states[hands] = state
+        self._size = student_squares(self.students)
+
+    def probe(self, bb: BitBoard, hands: Hands, turn: Player) -> Optional[int]:
+        # Plies until the game ends: positive if the side to move wins, negative if it loses and 0 for a draw.
+        # None for positions with too many students or whose game is already over.
+        blue_master = bb.blue & bb.masters
+        red_master = bb.red & bb.masters
+        blue_students = bb.blue ^ blue_master
+        red_students = bb.red ^ red_master
+        if not blue_master or not red_master:
+            return None
+        if blue_students & (blue_students - 1) or red_students & (red_students - 1):
+            return None
+        if self._size == 1 and (blue_students or red_students):
+            return None
+        state = self._states.get(hands)
+        if state is None:
+            return None
+        position = (((((0 if turn is _BLUE else 1) * len(CARD_STATES) + state) * 25
+                      + blue_master.bit_length() - 1) * 25 + red_master.bit_length() - 1) * self._size
+                    + blue_students.bit_length()) * self._size + red_students.bit_length()
+        value = self._map[_HEADER_SIZE + position]
+        if value == INVALID or value == 1:
+            return None
+        if value == DRAW:
+            return 0
+        return value - 1 if value % 2 == 0 else 1 - value
+
+    def close(self) -> None:
+        self._map.close()
+
+
+# Opened by the engine processes, see open_tablebases.
+tablebases: Dict[FrozenSet[str], Tablebase] = {}
+
+
+def open_tablebases(directory: str) -> None:
+    # Loads every tablebase in directory, if it exists.
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".tb"):
+            table = Tablebase(os.path.join(directory, name))
+            tablebases[table.cards] = table
+
+
+def probe(bb: BitBoard, hands: Hands, turn: Player) -> Optional[int]:
+    # Tablebase.probe with the tablebase for the cards of the position, None if there is none.
+    # Positions with more than two students are turned away first, before the cards are looked at.
+    students = (bb.blue | bb.red) & ~bb.masters
+    students &= students - 1
+    if students & (students - 1):
+        return None
+    table = tablebases.get(frozenset((hands[0][0], hands[0][1], hands[1][0], hands[1][1], hands[2])))
+    return None if table is None else table.probe(bb, hands, turn)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", required=True, help="the five cards, separated by commas")
+    parser.add_argument("--students", type=int, default=MAX_STUDENTS, help="students per side, 0 or 1")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="tablebases", help="directory the tablebase is written to")
+    args = parser.parse_args()
+
+    names = args.cards.split(",")
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, tablebase_name(names))
+    stats = generate(names, args.students, path, args.processes)
+    print(json.dumps({"tablebase": path, **stats}))
+
+
+if __name__ == "__main__":
+    main()
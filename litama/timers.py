@@ -0,0 +1,63 @@
+# Hashed timing wheel for the deadlines the servers keep: match clocks, idle matches and idle sockets.
+# Scheduling, rescheduling and cancelling are O(1), and each tick only looks at the timers in one slot, so a single
+# loop can keep thousands of them without one sleeping greenlet or task per timer.
+import math
+from typing import Dict, Generic, Hashable, List, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class TimerWheel(Generic[K]):
+    # Deadlines are rounded up to the next tick, so timers fire up to one tick late and never early. Deadlines more
+    # than a full turn of the wheel away are put back in when their slot comes round before they are due.
+    def __init__(self, now: float, tick: float, slots: int = 4096) -> None:
+        self.tick = tick
+        self.start = now
+        # Ticks since start, and the time the wheel has been moved up to.
+        self.ticks = 0
+        self.time = now
+        self.size = slots
+        self.slots: List[List[Tuple[K, float]]] = [[] for _ in range(slots)]
+        # The current deadline of each key. Entries left in a slot by an earlier schedule or a cancel are skipped.
+        self.deadlines: Dict[K, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.deadlines
+
+    def schedule(self, key: K, deadline: float) -> None:
+        # Replaces the deadline of key if it already has one.
+        self.deadlines[key] = deadline
+        self._insert(key, deadline)
+
+    def cancel(self, key: K) -> None:
+        self.deadlines.pop(key, None)
+
+    def advance(self, now: float) -> List[K]:
+        # Moves the wheel up to now and returns the keys whose deadline passed, one tick after another.
+        expired: List[K] = []
+        while self.time + self.tick <= now:
+            self.ticks += 1
+            self.time = self.start + self.ticks * self.tick
+            index = self.ticks % self.size
+            slot = self.slots[index]
+            self.slots[index] = []
+            for key, deadline in slot:
+                if self.deadlines.get(key) != deadline:
+                    continue
+                if deadline <= self.time:
+                    del self.deadlines[key]
+                    expired.append(key)
+                else:
+                    self._insert(key, deadline)
+        return expired
+
+    def _insert(self, key: K, deadline: float) -> None:
+        ticks = math.ceil((deadline - self.time) / self.tick)
+        if ticks < 1:
+            ticks = 1
+        elif ticks > self.size:
+            ticks = self.size
+        self.slots[(self.ticks + ticks) % self.size].append((key, deadline))
@@ -0,0 +1,225 @@
+# Plays bots against each other without the server, spread over a process pool.
+# Usage: python tournament.py --blue random --red greedy [--games 1000] [--seed 0] [--processes 4]
+#                             [--output results.jsonl] [--store] [--tablebases tablebases]
+# Agents are one of the names in AGENTS, or "module:function" for any other agent with the Agent signature.
+# Results are written as one JSON line per game in the order of the games. --store also saves the finished games to
+# the matches collection in the same format as the server.
+import argparse
+import importlib
+import json
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Tuple
+
+from bitboard import BitBoard, NO_MOVES_WINNER, RED_TEMPLE, BLUE_TEMPLE, from_board, generate_moves, make_move, \
+    square_to_pos, to_str, winner
+from conversions import board_str_to_bytes, move_str_to_bytes, pos_to_notation
+from engine import Hands, enemy_of, search
+from game import init_game
+from structures import Card, GameState, Player
+from tablebase import open_tablebases
+
+# (from square, to square, card)
+PlayerMove = Tuple[int, int, Card]
+
+
+class Position(NamedTuple):
+    board: BitBoard
+    turn: Player
+    blue_cards: List[Card]
+    red_cards: List[Card]
+    side_card: Card
+    # Never empty, games without a legal move end before the agent is asked.
+    legal_moves: List[PlayerMove]
+    ply: int
+
+
+# Returns one of position.legal_moves. The Random is seeded per game, so games with the same seed replay exactly.
+Agent = Callable[[Position, random.Random], PlayerMove]
+
+MAX_PLIES = 200
+ENGINE_TIME_LIMIT = 0.05
+STORE_BATCH_SIZE = 1000
+
+
+def random_agent(position: Position, rng: random.Random) -> PlayerMove:
+    return rng.choice(position.legal_moves)
+
+
+def greedy_agent(position: Position, rng: random.Random) -> PlayerMove:
+    # Wins when it can, otherwise captures the most valuable piece it can, otherwise moves randomly.
+    enemy = position.board.red if position.turn == Player.BLUE else position.board.blue
+    temple = RED_TEMPLE if position.turn == Player.BLUE else BLUE_TEMPLE
+    masters = position.board.masters
+
+    def rank(move: PlayerMove) -> int:
+        to_bit = 1 << move[1]
+        if enemy & masters & to_bit or (masters & (1 << move[0]) and temple & to_bit):
+            return 0
+        return 1 if enemy & to_bit else 2
+
+    best = min(rank(move) for move in position.legal_moves)
+    return rng.choice([move for move in position.legal_moves if rank(move) == best])
+
+
+def engine_agent(position: Position, rng: random.Random) -> PlayerMove:
+    hands: Hands = (
+        (position.blue_cards[0].name, position.blue_cards[1].name),
+        (position.red_cards[0].name, position.red_cards[1].name),
+        position.side_card.name
+    )
+    result = search(position.board, hands, position.turn, ENGINE_TIME_LIMIT)
+    for move in position.legal_moves:
+        if (move[0], move[1], move[2].name) == result.move:
+            return move
+    return position.legal_moves[0]
+
+
+AGENTS: Dict[str, Agent] = {
+    "random": random_agent,
+    "greedy": greedy_agent,
+    "engine": engine_agent,
+}
+
+
+def load_agent(name: str) -> Agent:
+    if name in AGENTS:
+        return AGENTS[name]
+    module, function = name.split(":")
+    agent: Agent = getattr(importlib.import_module(module), function)
+    return agent
+
+
+def play_game(blue: str, red: str, seed: int, game: int, max_plies: int = MAX_PLIES) -> Dict[str, Any]:
+    # Agents are passed by name so that only strings have to be sent to the worker processes.
+    rng = random.Random(seed * 1_000_003 + game)
+    agents = {Player.BLUE: load_agent(blue), Player.RED: load_agent(red)}
+    board, blue_cards, red_cards, side_card = init_game(rng)
+    starting_cards = {
+        "blue": [card.name for card in blue_cards],
+        "red": [card.name for card in red_cards],
+        "side": side_card.name
+    }
+    hands = {Player.BLUE: blue_cards, Player.RED: red_cards}
+    bb = from_board(board)
+    turn = side_card.color
+    moves: List[str] = []
+    result = Player.NONE
+
+    # Games that reach max_plies are draws.
+    while len(moves) < max_plies:
+        legal = generate_moves(bb, turn, hands[turn])
+        if not legal:
+            result = NO_MOVES_WINNER
+            break
+        move = agents[turn](Position(bb, turn, blue_cards, red_cards, side_card, legal, len(moves)), rng)
+        from_sq, to_sq, card = move
+        moves.append(f"{card.name}:{pos_to_notation(square_to_pos(from_sq))}{pos_to_notation(square_to_pos(to_sq))}")
+        bb = make_move(bb, from_sq, to_sq)
+        hand = hands[turn]
+        hand[hand.index(card)] = side_card
+        side_card = card
+        result = winner(bb)
+        if result != Player.NONE:
+            break
+        turn = enemy_of(turn)
+
+    return {
+        "game": game,
+        "seed": seed,
+        "blue": blue,
+        "red": red,
+        "winner": result.value,
+        "plies": len(moves),
+        "startingCards": starting_cards,
+        "moves": moves,
+        "board": to_str(bb),
+        "cards": {
+            "blue": [card.name for card in blue_cards],
+            "red": [card.name for card in red_cards],
+            "side": side_card.name
+        },
+        "currentTurn": enemy_of(turn).value if result != Player.NONE else turn.value
+    }
+
+
+def play_games(blue: str, red: str, games: int, seed: int, processes: int,
+               max_plies: int = MAX_PLIES, tablebase_path: str = "") -> Iterator[Dict[str, Any]]:
+    # Yields results in game order as soon as they are available. The engine agent probes the tablebases in
+    # tablebase_path, if given.
+    with ProcessPoolExecutor(max_workers=processes, initializer=open_tablebases, initargs=(tablebase_path,)) as pool:
+        yield from pool.map(play_game, [blue] * games, [red] * games, [seed] * games, range(games),
+                            [max_plies] * games, chunksize=max(1, min(64, games // (processes * 4))))
+
+
+def to_match(result: Dict[str, Any]) -> Dict[str, Any]:
+    # A finished game in the format the server stores matches in. Nobody can move in it, so the tokens are empty.
+    # They are kept for analysis, so unlike the matches played on the server they have no expireAt.
+    now = datetime.utcnow()
+    return {
+        "usernames": {"blue": result["blue"], "red": result["red"]},
+        "indices": {"blue": 0, "red": 1},
+        "tokenBlue": "",
+        "tokenRed": "",
+        "gameState": GameState.ENDED.value,
+        "board": board_str_to_bytes(result["board"]),
+        "moves": [move_str_to_bytes(move) for move in result["moves"]],
+        "ply": result["plies"],
+        "currentTurn": result["currentTurn"],
+        "cards": result["cards"],
+        "startingCards": result["startingCards"],
+        "winner": result["winner"],
+        "tournament": {"seed": result["seed"], "game": result["game"]},
+        "createdAt": now,
+        "updatedAt": now
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blue", default="random", help="agent playing blue")
+    parser.add_argument("--red", default="random", help="agent playing red")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES)
+    parser.add_argument("--output", help="JSONL file for the results, stdout if not given")
+    parser.add_argument("--store", action="store_true", help="save the games to the matches collection")
+    parser.add_argument("--tablebases", default="", help="directory of endgame tablebases for the engine agent")
+    args = parser.parse_args()
+    # Fails early on unknown agents instead of in every worker.
+    load_agent(args.blue)
+    load_agent(args.red)
+
+    matches: Any = None
+    if args.store:
+        from config import MEMORY_STORE, MONGODB_HOST
+        from memory_collection import MemoryCollection
+        from pymongo import MongoClient
+        matches = MemoryCollection() if MEMORY_STORE else MongoClient(MONGODB_HOST).litama.matches
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    wins = {player.value: 0 for player in Player}
+    pending: List[Dict[str, Any]] = []
+    try:
+        for result in play_games(args.blue, args.red, args.games, args.seed, args.processes, args.max_plies,
+                                 args.tablebases):
+            output.write(json.dumps(result) + "\n")
+            wins[result["winner"]] += 1
+            if matches is not None:
+                pending.append(to_match(result))
+                if len(pending) >= STORE_BATCH_SIZE:
+                    matches.insert_many(pending, ordered=False)
+                    pending = []
+        if pending:
+            matches.insert_many(pending, ordered=False)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps({"blue": args.blue, "red": args.red, "games": args.games, "wins": wins}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()